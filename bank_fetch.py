@@ -0,0 +1,247 @@
+"""
+Concurrent page fetching for no3.py's BankScraperApp: many source pages per scrape, over
+one keep-alive session.
+
+    from bank_fetch import fetch_pages
+    fetch_pages(urls, on_page=lambda result: parse(result.text))
+
+The pages are fetched by a bounded thread pool sharing one requests.Session, so every
+connection to a host is reused from its pool instead of being set up per page. No more
+than per_host requests go to one host at a time, whatever the pool size, and every
+request has a connect and a read timeout. Each page is handed to on_page as soon as it
+arrives, in the calling thread, while the others are still being fetched. A page that
+fails is passed on with its error rather than stopping the rest.
+
+With a PageCache, pages are kept on disk with their ETag and Last-Modified headers. A
+page validated less than ttl seconds ago is served from the cache without a request;
+an older one is fetched with If-None-Match / If-Modified-Since, and a 304 reuses the
+stored page. Either way its FetchResult has not_modified set, so the caller can reuse
+what it extracted from the page last time (PageCache.get_frame) instead of parsing it
+again. Least recently used pages are deleted once the cache passes max_bytes.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from disk_cache import DiskCache
+
+# Threads fetching at once, and requests to one host at once
+MAX_WORKERS = 8
+PER_HOST = 2
+
+# Seconds to connect, and to wait for the server between bytes of the response
+TIMEOUT = (5, 30)
+
+USER_AGENT = 'BankScraper/1.0 (market cap research)'
+
+DEFAULT_CACHE_DIR = '.page_cache'
+DEFAULT_CACHE_MAX_BYTES = 64 << 20  # 64 MB
+DEFAULT_CACHE_TTL = 3600  # seconds a page is used without asking the server again
+
+# not_modified: the text is the cached page, which is fresh or the server confirmed unchanged
+FetchResult = namedtuple('FetchResult', 'url status text error seconds not_modified', defaults=(False,))
+
+
+def make_session(max_workers=MAX_WORKERS, per_host=PER_HOST):
+    """A requests.Session whose connection pools keep enough connections alive for fetch_pages."""
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max(per_host, 1))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class HostLimiter:
+    """One semaphore per host, so no more than per_host requests go to any host at once."""
+
+    def __init__(self, per_host=PER_HOST):
+        self.per_host = per_host
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self._semaphores[host]
+
+
+class PageCache(DiskCache):
+    """
+    Fetched pages by URL, with their validators and what was extracted from them: an HTML
+    file, a JSON file of headers and an optional Feather file of the extracted frame each.
+
+    Args:
+        cache_dir (str, optional): Directory of the cache; created when first written to.
+        max_bytes (int, optional): Size past which least recently used pages are deleted.
+        ttl (float, optional): Seconds after being fetched or validated that a page is
+            used without a request; after that it is revalidated with a conditional request.
+    """
+
+    EXTENSIONS = ('html', 'json', 'feather')
+    USED = 'html'
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES, ttl=DEFAULT_CACHE_TTL):
+        super().__init__(cache_dir, max_bytes)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url):
+        """The name of a page's files."""
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def get(self, url):
+        """The stored (info, text) of url, or None. Marks the page as just used."""
+        key = self.key(url)
+        info = self._read_info(key)
+        if info is None:
+            return None
+        try:
+            with open(self._path(key, 'html'), encoding='utf-8') as f:
+                text = f.read()
+            self._touch(key)
+        except FileNotFoundError:
+            return None
+        return info, text
+
+    def is_fresh(self, info):
+        """Whether a page was fetched or validated less than ttl seconds ago."""
+        return time.time() - info['validated'] < self.ttl
+
+    @staticmethod
+    def conditional_headers(info):
+        """If-None-Match and If-Modified-Since headers from a page's stored validators."""
+        headers = {}
+        if info.get('etag'):
+            headers['If-None-Match'] = info['etag']
+        if info.get('last_modified'):
+            headers['If-Modified-Since'] = info['last_modified']
+        return headers
+
+    def put(self, url, response):
+        """Stores a fetched page and its validators; the frame extracted from the old page is dropped."""
+        key = self.key(url)
+        info = {'url': url, 'status': response.status_code, 'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'), 'validated': time.time()}
+
+        def write(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(response.text)
+        with self._lock:
+            self._delete_file(key, 'feather')
+            self._replace(key, 'html', write)
+            self._write_info(key, info)
+            self.evict(keep=key)
+
+    def revalidated(self, url, info, response):
+        """Records that the server answered 304 for a stored page, with any new validators it sent."""
+        info = dict(info, validated=time.time())
+        for field, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified')):
+            if response.headers.get(header):
+                info[field] = response.headers[header]
+        with self._lock:
+            self._write_info(self.key(url), info)
+
+    def get_frame(self, url):
+        """The DataFrame put_frame stored for the current page of url, or None."""
+        import pyarrow.feather as feather
+
+        try:
+            return feather.read_table(self._path(self.key(url), 'feather')).to_pandas()
+        except FileNotFoundError:
+            return None
+
+    def put_frame(self, url, df):
+        """Stores what was extracted from the current page of url, for later runs to reuse."""
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        key = self.key(url)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with self._lock:
+            if not os.path.exists(self._path(key, 'html')):
+                return  # evicted, or never stored
+            self._replace(key, 'feather', lambda path: feather.write_feather(table, path))
+            self.evict(keep=key)
+
+    def remove(self, url):
+        """Deletes the stored page of url."""
+        self._delete(self.key(url))
+
+
+def fetch_page(session, url, limiter, timeout=TIMEOUT, cache=None):
+    """
+    Fetches one page within its host's limit, as a FetchResult; errors are returned, not raised.
+
+    With a cache, a fresh stored page is returned without a request, and a stale one is
+    revalidated with a conditional request.
+    """
+    started = time.perf_counter()
+    cached = cache.get(url) if cache is not None else None
+    if cached is not None and cache.is_fresh(cached[0]):
+        return FetchResult(url, cached[0]['status'], cached[1], None, time.perf_counter() - started, True)
+    with limiter(url):
+        try:
+            headers = cache.conditional_headers(cached[0]) if cached is not None else {}
+            response = session.get(url, headers=headers, timeout=timeout)
+            if response.status_code == 304 and cached is not None:
+                cache.revalidated(url, cached[0], response)
+                return FetchResult(url, 304, cached[1], None, time.perf_counter() - started, True)
+            response.raise_for_status()
+            if cache is not None:
+                cache.put(url, response)
+            return FetchResult(url, response.status_code, response.text, None, time.perf_counter() - started)
+        except requests.RequestException as e:
+            status = e.response.status_code if e.response is not None else None
+            return FetchResult(url, status, None, e, time.perf_counter() - started)
+
+
+def fetch_pages(urls, on_page=None, max_workers=MAX_WORKERS, per_host=PER_HOST, timeout=TIMEOUT, session=None,
+                cache=None):
+    """
+    Fetches every url concurrently and hands each page to on_page as it arrives.
+
+    Args:
+        urls (list): Pages to fetch; a url listed twice is fetched once.
+        on_page (callable, optional): Called with each FetchResult in the calling thread,
+            in the order the pages arrive. Results with an error have text None.
+        max_workers (int, optional): Threads fetching at once.
+        per_host (int, optional): Requests to one host at once.
+        timeout (tuple, optional): Connect and read timeouts in seconds.
+        session (Session, optional): Session to fetch with; defaults to make_session().
+        cache (PageCache, optional): Keep pages on disk and revalidate them, see PageCache.
+
+    Returns:
+        list: The FetchResults, in the order of urls.
+    """
+    urls = list(dict.fromkeys(urls))
+    own_session = session is None
+    if own_session:
+        session = make_session(max_workers, per_host)
+    limiter = HostLimiter(per_host)
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(fetch_page, session, url, limiter, timeout, cache) for url in urls]
+            for future in as_completed(futures):
+                result = future.result()
+                results[result.url] = result
+                if result.error is not None:
+                    logging.warning(f"Fetching {result.url} failed: {result.error}")
+                if on_page is not None:
+                    on_page(result)
+    finally:
+        if own_session:
+            session.close()
+    return [results[url] for url in urls]
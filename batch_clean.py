@@ -0,0 +1,213 @@
+"""
+Batch mode: cleans many RewardsData exports in parallel with a process pool.
+
+The Zip mean of step d is taken over all the input files, so every file is filled with
+the same mean. Each file gets its own step j generator, spawned from one seed in input
+order, so a run with any number of workers gives the same output as a serial run
+(workers=1). A file that fails is reported without stopping the others.
+"""
+import argparse
+import glob
+import os
+import shutil
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from rewards_cleaning import (CHUNKSIZE, CITY_FIXES, CleanedWriter, clean_rewards,
+                              clean_rewards_csv_chunked, default_plan, load_city_fixes, output_format,
+                              read_cleaned_table, read_rewards_csv, write_cleaned, zip_mean_of,
+                              zip_totals)
+
+BatchResult = namedtuple('BatchResult', 'csv_file_path output_path rows error')
+
+
+def find_rewards_files(pattern):
+    """
+    The CSV files to clean, in sorted order.
+
+    Args:
+        pattern (str): A directory (all its *.csv files) or a glob such as 'exports/*.csv'.
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.csv')
+    return sorted(glob.glob(pattern))
+
+
+def cleaned_output_paths(csv_file_paths, output_dir, fmt='csv'):
+    """
+    The cleaned file of each input, as Cleaned_<name>.<fmt> under output_dir in the same
+    subdirectory as the input has under the inputs' common directory, so that inputs of the
+    same name from different directories do not overwrite each other.
+
+    Raises:
+        ValueError: If two inputs would still be cleaned into the same file.
+    """
+    directories = [os.path.dirname(os.path.abspath(path)) for path in csv_file_paths]
+    root = os.path.commonpath(directories) if directories else ''
+    output_paths = []
+    for path, directory in zip(csv_file_paths, directories):
+        name = os.path.splitext(os.path.basename(path))[0]
+        output_paths.append(os.path.normpath(os.path.join(output_dir, os.path.relpath(directory, root),
+                                                          f"Cleaned_{name}.{fmt}")))
+    seen = {}
+    for path, output_path in zip(csv_file_paths, output_paths):
+        key = os.path.normcase(output_path)
+        if key in seen:
+            raise ValueError(f"'{seen[key]}' and '{path}' would both be cleaned into '{output_path}'.")
+        seen[key] = path
+    return output_paths
+
+
+def _zip_totals_task(task):
+    csv_file_path, chunksize, skip = task
+    try:
+        return zip_totals(csv_file_path, chunksize, default_plan().disable(*skip)), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _clean_task(task):
+    (csv_file_path, output_path, zip_mean, seed_sequence, chunksize, skip, city_fixes,
+     compact, optimize) = task
+    # Plans hold lambdas, which do not pickle, so each worker builds its own
+    plan = default_plan().disable(*skip)
+    rng = np.random.default_rng(seed_sequence)
+    try:
+        if chunksize:
+            rows = clean_rewards_csv_chunked(csv_file_path, output_path, chunksize,
+                                             city_fixes=city_fixes, compact=compact, plan=plan,
+                                             optimize=optimize, zip_mean=zip_mean, rng=rng)
+        else:
+            df = read_rewards_csv(csv_file_path, compact, usecols=plan.usecols())
+            df = clean_rewards(df, zip_mean=zip_mean, rng=rng, city_fixes=city_fixes,
+                               compact=compact, plan=plan, optimize=optimize)
+            write_cleaned(df, output_path)
+            rows = len(df)
+        return BatchResult(csv_file_path, output_path, rows, None)
+    except Exception as e:
+        return BatchResult(csv_file_path, output_path, 0, f"{type(e).__name__}: {e}")
+
+
+def merge_cleaned_files(output_paths, merged_path):
+    """
+    Concatenates cleaned files into one of the format merged_path's extension asks for.
+
+    CSV into CSV is copied as text, keeping only the first file's header; anything else goes
+    through Arrow one file at a time.
+    """
+    if output_format(merged_path) == 'csv' and all(output_format(path) == 'csv' for path in output_paths):
+        with open(merged_path, 'w', newline='') as merged:
+            for i, output_path in enumerate(output_paths):
+                with open(output_path, 'r', newline='') as f:
+                    header = f.readline()
+                    if i == 0:
+                        merged.write(header)
+                    shutil.copyfileobj(f, merged)
+        return
+
+    with CleanedWriter(merged_path) as writer:
+        for output_path in output_paths:
+            if output_format(output_path) == 'csv':
+                df = pd.read_csv(output_path)
+            else:
+                df = read_cleaned_table(output_path).to_pandas(date_as_object=False)
+            writer.write(df)
+
+
+def clean_rewards_batch(csv_file_paths, output_dir, workers=None, merged_path=None, seed=None,
+                        chunksize=None, skip=(), city_fixes=CITY_FIXES, compact=False,
+                        optimize=True, fmt='csv'):
+    """
+    Cleans every file in csv_file_paths into output_dir as Cleaned_<name>.<fmt>, in the
+    subdirectory each has under their common directory; see cleaned_output_paths.
+
+    Args:
+        csv_file_paths (list): Raw RewardsData CSV files.
+        output_dir (str): Directory for the cleaned files.
+        workers (int, optional): Worker processes. Defaults to the number of CPUs.
+        merged_path (str, optional): Also write all cleaned rows to this one file.
+        seed (int, optional): Seed for the step j random birthdates of the whole batch.
+        chunksize (int, optional): Stream each file in chunks of this many rows.
+        skip (tuple, optional): Steps to leave out, e.g. ('c', 'd').
+        city_fixes (dict, optional): City variant to canonical name, for step e.
+        compact (bool, optional): Clean with the compact schema.
+        optimize (bool, optional): Reorder and fuse steps, see CleaningPlan.compile.
+        fmt (str, optional): 'csv', 'parquet' or 'feather' for the cleaned files.
+
+    Returns:
+        list: One BatchResult per input file; error is None for the files that succeeded.
+
+    Raises:
+        ValueError: If two inputs would be cleaned into the same file; nothing is cleaned.
+    """
+    output_paths = dict(zip(csv_file_paths, cleaned_output_paths(csv_file_paths, output_dir, fmt)))
+    for output_path in output_paths.values():
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    skip = tuple(skip)
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(csv_file_paths))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # First pass: Zip totals of every file, added up into one mean for the batch
+        totals = list(pool.map(_zip_totals_task,
+                               [(path, chunksize or CHUNKSIZE, skip) for path in csv_file_paths]))
+        failed = {path: error for path, (_, error) in zip(csv_file_paths, totals) if error}
+        zip_sum = sum(total[0] for total, error in totals if not error)
+        zip_count = sum(total[1] for total, error in totals if not error)
+        zip_mean = zip_mean_of(zip_sum, zip_count) if zip_count else None
+
+        tasks = []
+        for path, seed_sequence in zip(csv_file_paths, seed_sequences):
+            if path in failed:
+                continue
+            tasks.append((path, output_paths[path], zip_mean, seed_sequence, chunksize, skip,
+                          city_fixes, compact, optimize))
+        cleaned = {result.csv_file_path: result for result in pool.map(_clean_task, tasks)}
+
+    results = [cleaned.get(path) or BatchResult(path, None, 0, failed[path]) for path in csv_file_paths]
+    if merged_path:
+        merge_cleaned_files([result.output_path for result in results if not result.error], merged_path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clean many RewardsData CSV files in parallel.")
+    parser.add_argument('inputs', help="Directory of CSV files, or a glob such as 'exports/*.csv'")
+    parser.add_argument('--output-dir', default='cleaned')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--merged', default=None, help="Also write every cleaned row to this file")
+    parser.add_argument('--format', dest='fmt', default='csv', choices=['csv', 'parquet', 'feather'],
+                        help="Format of the cleaned files")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=None)
+    parser.add_argument('--skip', default='', help="Comma-separated steps to leave out, e.g. c,d")
+    parser.add_argument('--city-fixes', default=None)
+    parser.add_argument('--compact', action='store_true')
+    parser.add_argument('--no-optimize', dest='optimize', action='store_false')
+    args = parser.parse_args()
+
+    csv_file_paths = find_rewards_files(args.inputs)
+    if not csv_file_paths:
+        parser.error(f"No CSV files match '{args.inputs}'")
+    skip = [name.strip() for name in args.skip.split(',') if name.strip()]
+    city_fixes = load_city_fixes(args.city_fixes) if args.city_fixes else CITY_FIXES
+
+    try:
+        results = clean_rewards_batch(csv_file_paths, args.output_dir, args.workers, args.merged,
+                                      args.seed, args.chunksize, skip, city_fixes, args.compact,
+                                      args.optimize, args.fmt)
+    except ValueError as e:
+        parser.error(str(e))
+    for result in results:
+        if result.error:
+            print(f"FAILED {result.csv_file_path}: {result.error}")
+        else:
+            print(f"Cleaned {result.csv_file_path} -> {result.output_path} ({result.rows} rows)")
+    failures = sum(1 for result in results if result.error)
+    print(f"Batch complete: {len(results) - failures} cleaned, {failures} failed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark: text (CSV) COPY against binary COPY for a cleaned RewardsData file.
+
+Times encoding alone and encoding plus COPY into a fresh table for both formats, over the
+same batches, e.g.
+
+    python bench_copy.py Cleaned_RewardsData.parquet --rows 1000000 --dbname rewards_data
+"""
+import argparse
+import time
+from io import BytesIO, StringIO
+
+import psycopg2
+import pyarrow as pa
+
+from rewards_cleaning import read_cleaned_table
+from rewards_loader import (BINARY_COPY_HEADER, BINARY_COPY_TRAILER, COPY_BATCH_ROWS, binary_copy_data,
+                            create_table_from_schema, postgres_type)
+
+
+def repeat_table(table, rows):
+    """The table's rows repeated up to exactly rows rows."""
+    copies = -(-rows // table.num_rows)
+    return pa.concat_tables([table] * copies).slice(0, rows).combine_chunks()
+
+
+def encode_text(batch):
+    buffer = StringIO()
+    batch.to_pandas(date_as_object=False).to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def encode_binary(batch, pg_types):
+    return BytesIO(BINARY_COPY_HEADER + binary_copy_data(batch, pg_types) + BINARY_COPY_TRAILER)
+
+
+def benchmark_copy(conn, table, batch_rows=COPY_BATCH_ROWS, repeat=3, table_name='bench_copy'):
+    """
+    Times text and binary COPY of a pyarrow Table, best of repeat runs each.
+
+    Returns:
+        dict: For 'text' and 'binary', the seconds spent encoding, the seconds to encode and
+            COPY every batch, and the rows per second of the latter.
+    """
+    pg_types = [postgres_type(field.type) for field in table.schema]
+    columns = ', '.join(table.column_names)
+    batches = table.to_batches(max_chunksize=batch_rows)
+    encoders = {'text': (encode_text, 'csv'),
+                'binary': (lambda batch: encode_binary(batch, pg_types), 'binary')}
+    results = {}
+    cursor = conn.cursor()
+    try:
+        for name, (encode, copy_format) in encoders.items():
+            encode_times, copy_times = [], []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                for batch in batches:
+                    encode(batch)
+                encode_times.append(time.perf_counter() - started)
+
+                cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+                conn.commit()
+                create_table_from_schema(conn, table_name, table.schema)
+                started = time.perf_counter()
+                for batch in batches:
+                    cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT {copy_format})",
+                                       encode(batch))
+                conn.commit()
+                copy_times.append(time.perf_counter() - started)
+            results[name] = {'encode_seconds': min(encode_times), 'copy_seconds': min(copy_times),
+                             'rows_per_second': table.num_rows / min(copy_times)}
+        cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+        conn.commit()
+    finally:
+        cursor.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare text and binary COPY of a cleaned file.")
+    parser.add_argument('path', help="Cleaned .parquet or .feather file")
+    parser.add_argument('--rows', type=int, default=None, help="Repeat the file's rows up to this many")
+    parser.add_argument('--batch-rows', type=int, default=COPY_BATCH_ROWS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--dbname', default='rewards_data')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default=None)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    args = parser.parse_args()
+
+    table = read_cleaned_table(args.path)
+    if args.rows:
+        table = repeat_table(table, args.rows)
+    conn = psycopg2.connect(dbname=args.dbname, user=args.user, password=args.password, host=args.host,
+                            port=args.port)
+    try:
+        results = benchmark_copy(conn, table, args.batch_rows, args.repeat)
+    finally:
+        conn.close()
+
+    print(f"{table.num_rows} rows, batches of {args.batch_rows}:")
+    for name, result in results.items():
+        print(f"  {name:6}  encode {result['encode_seconds']:.3f}s  encode+COPY {result['copy_seconds']:.3f}s  "
+              f"({result['rows_per_second']:,.0f} rows/s)")
+    print(f"  binary is {results['text']['copy_seconds'] / results['binary']['copy_seconds']:.2f}x faster end to end")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Benchmark suite: times every cleaning step and the CSV to Postgres load on synthetic
+RewardsData files (rewards_synth.py) of each size, and records the results as JSON.
+
+    python bench_rewards.py --rows 100000 1000000 10000000 100000000 --output bench.json
+    python bench_rewards.py --rows 1000000 --compare bench.json
+
+Files up to --whole-max-rows are cleaned whole (clean_rewards); bigger ones are streamed in
+chunks (clean_rewards_csv_chunked), with each step's time added up over the chunks. Each
+result records the commit and library versions, so two JSON files from different versions
+can be compared with --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from rewards_cleaning import (CHUNKSIZE, CITY_FIXES, CleanedWriter, default_plan, read_rewards_csv,
+                              scan_rewards_csv, write_cleaned)
+from rewards_loader import copy_from_csv, create_table_from_csv
+from rewards_synth import generate_rewards_data
+from step_profiler import StepProfiler
+
+SIZES = (100_000, 1_000_000, 10_000_000, 100_000_000)
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_cleaning(csv_file_path, output_path, whole=True, chunksize=CHUNKSIZE, optimize=False, seed=0):
+    """
+    Cleans csv_file_path into output_path, timing each phase and step.
+
+    Args:
+        whole (bool, optional): Clean the whole file at once, else stream it in chunks.
+        chunksize (int, optional): Rows per chunk when streaming.
+        optimize (bool, optional): Run the optimized plan (fused, reordered steps) rather
+            than steps a-l one by one.
+        seed (int, optional): Seed for the step j random birthdates.
+
+    Returns:
+        dict: Seconds per phase ('scan', 'read', 'write') and per step, the StepProfiler
+            summary of each step ('steps'), and the rows out.
+    """
+    plan = default_plan()
+    context = {'zip_mean': None, 'state_start': 0, 'format_counts': {}, 'rng': np.random.default_rng(seed),
+               'city_fixes': CITY_FIXES, 'compact': False}
+    profiler = StepProfiler(count_changes=False)
+    result = {'mode': 'whole' if whole else 'chunked', 'optimize': optimize}
+
+    if whole:
+        started = time.perf_counter()
+        df = read_rewards_csv(csv_file_path, usecols=plan.usecols())
+        result['read_seconds'] = time.perf_counter() - started
+        df = plan.run(df, context, optimize, profiler)
+        started = time.perf_counter()
+        write_cleaned(df, output_path)
+        result['write_seconds'] = time.perf_counter() - started
+        rows_out = len(df)
+    else:
+        started = time.perf_counter()
+        context['zip_mean'], dtypes = scan_rewards_csv(csv_file_path, chunksize, plan)
+        result['scan_seconds'] = time.perf_counter() - started
+        read_seconds = write_seconds = 0.0
+        with CleanedWriter(output_path) as writer:
+            chunks = pd.read_csv(csv_file_path, chunksize=chunksize, dtype=dtypes, usecols=plan.usecols())
+            while True:
+                started = time.perf_counter()
+                chunk = next(chunks, None)
+                read_seconds += time.perf_counter() - started
+                if chunk is None:
+                    break
+                chunk = plan.run(chunk, context, optimize, profiler)
+                started = time.perf_counter()
+                writer.write(chunk)
+                write_seconds += time.perf_counter() - started
+        result.update(read_seconds=read_seconds, write_seconds=write_seconds)
+        rows_out = writer.rows
+
+    result['steps'] = profiler.summary()
+    result['step_seconds'] = {step['step']: step['wall_seconds'] for step in result['steps']}
+    result['rows_out'] = rows_out
+    return result
+
+
+def bench_load(conn_params, cleaned_file_path, table_name='bench_reward_data'):
+    """Times creating table_name from the cleaned CSV file and COPYing it in; drops it after."""
+    conn = psycopg2.connect(**conn_params)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+        conn.commit()
+        started = time.perf_counter()
+        create_table_from_csv(conn, table_name, cleaned_file_path)
+        created = time.perf_counter()
+        copy_from_csv(conn, table_name, cleaned_file_path, progress_interval=None)
+        copied = time.perf_counter()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+        conn.commit()
+    finally:
+        conn.close()
+    return {'create_table_seconds': created - started, 'copy_seconds': copied - created}
+
+
+def compare(results, baseline):
+    """Prints each timing next to the one for the same rows in a baseline results file."""
+    old_runs = {run['rows']: run for run in baseline['runs']}
+    print(f"Compared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for run in results['runs']:
+        old = old_runs.get(run['rows'])
+        if old is None:
+            continue
+        print(f"  {run['rows']} rows:")
+        timings = _timings(run)
+        old_timings = _timings(old)
+        for name, seconds in timings.items():
+            if name in old_timings and old_timings[name] > 0:
+                ratio = seconds / old_timings[name]
+                flag = '  SLOWER' if ratio > 1.10 else ''
+                print(f"    {name:18} {old_timings[name]:9.3f}s -> {seconds:9.3f}s  ({ratio:.2f}x){flag}")
+
+
+def _timings(run):
+    timings = {f"step {name}": seconds for name, seconds in run['cleaning']['step_seconds'].items()}
+    for phase in ('scan', 'read', 'write'):
+        if f"{phase}_seconds" in run['cleaning']:
+            timings[phase] = run['cleaning'][f"{phase}_seconds"]
+    for phase, seconds in (run.get('load') or {}).items():
+        if phase.endswith('_seconds'):
+            timings[f"load {phase[:-len('_seconds')]}"] = seconds
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cleaning steps a-l and the Postgres load.")
+    parser.add_argument('--rows', type=int, nargs='+', default=list(SIZES[:2]),
+                        help=f"Sizes to run; the full suite is {' '.join(map(str, SIZES))}")
+    parser.add_argument('--data-dir', default='bench_data', help="Where generated files are kept")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--whole-max-rows', type=int, default=1_000_000,
+                        help="Files with more rows are cleaned in chunks")
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    parser.add_argument('--optimize', action='store_true', help="Time the optimized plan instead of a-l")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', default=None, help="Earlier results file to compare with")
+    parser.add_argument('--no-load', dest='load', action='store_false')
+    parser.add_argument('--dbname', default='rewards_data')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default=None)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    args = parser.parse_args()
+
+    conn_params = {'dbname': args.dbname, 'user': args.user, 'password': args.password, 'host': args.host,
+                   'port': args.port}
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = {'commit': _commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+               'runs': []}
+
+    for rows in args.rows:
+        csv_file_path = os.path.join(args.data_dir, f"RewardsData_{rows}_{args.seed}.csv")
+        run = {'rows': rows}
+        if not os.path.exists(csv_file_path):
+            started = time.perf_counter()
+            generate_rewards_data(rows, csv_file_path, args.seed)
+            run['generate_seconds'] = time.perf_counter() - started
+        cleaned_file_path = os.path.join(args.data_dir, f"Cleaned_RewardsData_{rows}_{args.seed}.csv")
+
+        started = time.perf_counter()
+        run['cleaning'] = bench_cleaning(csv_file_path, cleaned_file_path, rows <= args.whole_max_rows,
+                                         args.chunksize, args.optimize, args.seed)
+        run['cleaning']['total_seconds'] = time.perf_counter() - started
+        if args.load:
+            try:
+                run['load'] = bench_load(conn_params, cleaned_file_path)
+            except psycopg2.Error as e:
+                run['load'] = {'error': str(e).strip()}
+        results['runs'].append(run)
+
+        cleaning = run['cleaning']
+        print(f"{rows} rows ({cleaning['mode']}): cleaned in {cleaning['total_seconds']:.2f}s, "
+              f"{cleaning['rows_out']} rows out")
+        for step in cleaning['steps']:
+            peak, growth = step['peak_rss_bytes'], step['peak_rss_growth_bytes']
+            print(f"  step {step['step']:6} {step['wall_seconds']:8.3f}s wall {step['cpu_seconds']:8.3f}s cpu"
+                  + (f"  peak RSS {peak / 1e6:.1f} MB (+{growth / 1e6:.1f})" if peak is not None else ''))
+        for phase, value in (run.get('load') or {}).items():
+            print(f"  load {phase}: {value:.3f}s" if phase.endswith('_seconds') else f"  load {phase}: {value}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark: Zip steps c and d, string truncation against normalize_zips, and the global
+mean fill against the City/State median fill, on synthetic Zip, City and State columns.
+
+    python bench_zip.py --rows 10000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from rewards_cleaning import (STATES_ORDERED, _map_distinct, _truncate_zip_values, fill_zip_mean,
+                              fill_zip_median, normalize_zips)
+
+
+def synthetic_zips(rows, seed=0, cities=2_000):
+    """Zip, City and State columns shaped like RewardsData: 5 and 9 digit Zips, some empty."""
+    rng = np.random.default_rng(seed)
+    zips = np.where(rng.random(rows) < 0.5, rng.integers(10_000, 100_000, rows),
+                    rng.integers(100_000_000, 1_000_000_000, rows)).astype('float64')
+    zips[rng.random(rows) < 0.2] = np.nan
+    city_names = np.array([f"City {i}" for i in range(cities)], dtype=object)
+    return pd.DataFrame({'Zip': zips,
+                         'City': city_names[rng.integers(0, cities, rows)],
+                         'State': np.array(STATES_ORDERED, dtype=object)[rng.integers(0, len(STATES_ORDERED), rows)]})
+
+
+def per_row_strings(df):
+    """Step c as exam_bright.py wrote it, a string for every row, then step d."""
+    df['Zip'] = df['Zip'].astype(str).str[:5]
+    return fill_zip_mean(df)
+
+
+def distinct_strings(df):
+    """Steps c and d before normalize_zips: strings for every distinct Zip."""
+    df['Zip'] = _map_distinct(df['Zip'], _truncate_zip_values)
+    return fill_zip_mean(df)
+
+
+def numeric_mean(df):
+    df['Zip'] = normalize_zips(df['Zip'])
+    return fill_zip_mean(df)
+
+
+def numeric_median(df):
+    df['Zip'] = normalize_zips(df['Zip'])
+    return fill_zip_median(df)
+
+
+VARIANTS = {
+    'c+d per-row strings': per_row_strings,
+    'c+d distinct strings': distinct_strings,
+    'c+d numeric, mean': numeric_mean,
+    'c+d numeric, City/State median': numeric_median,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Zip normalization and imputation steps.")
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    df = synthetic_zips(args.rows, args.seed)
+    print(f"{args.rows} rows, best of {args.repeat}:")
+    results = {}
+    for name, variant in VARIANTS.items():
+        times = []
+        for _ in range(args.repeat):
+            frame = df.copy()
+            started = time.perf_counter()
+            results[name] = variant(frame)['Zip']
+            times.append(time.perf_counter() - started)
+        print(f"  {name:32} {min(times):7.3f}s")
+    same = results['c+d distinct strings'].equals(results['c+d numeric, mean'])
+    print(f"  numeric and string truncation give the same Zips: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Checks of bank_fetch.py against a local fixture HTTP server: the per-host limit, timeouts,
+and the PageCache's 304 revalidation, ttl and max_bytes eviction.
+
+    python check_bank_fetch.py
+
+The server (http.server on a thread) answers on 127.0.0.1 and on localhost, which
+fetch_pages counts as two hosts, and records how many requests each host had in flight
+at once and which answers it gave. Nothing goes over the network. Exits with status 1
+if any check fails.
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import requests
+
+from bank_fetch import PageCache, fetch_pages
+
+# Seconds the /slow pages take, and the /hang page takes, to answer
+SLOW_SECONDS = 0.2
+HANG_SECONDS = 3
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """
+    /slow/<n>  - a page after SLOW_SECONDS
+    /hang      - a page after HANG_SECONDS, for the read timeout
+    /page/<n>  - a page with an ETag, or 304 for a request that sends it back
+    /missing   - 404
+    """
+
+    def do_GET(self):
+        server = self.server
+        host = self.headers.get('Host', '').split(':')[0]
+        with server.lock:
+            server.in_flight[host] = server.in_flight.get(host, 0) + 1
+            server.peak[host] = max(server.peak.get(host, 0), server.in_flight[host])
+        try:
+            if self.path.startswith('/slow/'):
+                time.sleep(SLOW_SECONDS)
+                self._send(200, f"<html><body>{self.path}</body></html>")
+            elif self.path == '/hang':
+                time.sleep(HANG_SECONDS)
+                self._send(200, "<html></html>")
+            elif self.path.startswith('/page/'):
+                etag = f'"{self.path.rsplit("/", 1)[1]}-{server.version}"'
+                if self.headers.get('If-None-Match') == etag:
+                    self._send(304, None, etag)
+                else:
+                    self._send(200, f"<html><body>{self.path}{'.' * 1000}</body></html>", etag)
+            else:
+                self._send(404, "<html>not found</html>")
+        finally:
+            with server.lock:
+                server.in_flight[host] -= 1
+
+    def _send(self, status, text, etag=None):
+        with self.server.lock:
+            self.server.answers.append((self.path, status))
+        body = text.encode() if text is not None else b''
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        if status != 304:
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if status != 304:
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client timed out
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """The fixture server on a daemon thread, for a with block; url(path) is a page on it."""
+
+    def __init__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.version = 1
+        self.reset()
+
+    def reset(self):
+        with self.server.lock:
+            self.server.in_flight = {}
+            self.server.peak = {}
+            self.server.answers = []
+
+    def url(self, path, host='127.0.0.1'):
+        return f"http://{host}:{self.server.server_address[1]}{path}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def check_per_host_limit(fixture, cache_dir):
+    """No more than per_host requests reach a host at once, though the pool is larger."""
+    fixture.reset()
+    urls = [fixture.url(f'/slow/{i}', host) for host in ('127.0.0.1', 'localhost') for i in range(6)]
+    results = fetch_pages(urls, max_workers=8, per_host=2)
+    if any(result.error is not None for result in results):
+        return f"fetch errors: {[str(result.error) for result in results if result.error is not None]}"
+    if any(peak > 2 for peak in fixture.server.peak.values()):
+        return f"more than 2 requests in flight to a host: {fixture.server.peak}"
+    if max(fixture.server.peak.values()) < 2:
+        return f"requests were not concurrent: {fixture.server.peak}"
+    return None
+
+
+def check_timeout(fixture, cache_dir):
+    """A page slower than the read timeout comes back as an error, without stopping the rest."""
+    fixture.reset()
+    started = time.perf_counter()
+    hang, missing, slow = fetch_pages([fixture.url('/hang'), fixture.url('/missing'), fixture.url('/slow/0')],
+                                      timeout=(2, 0.5))
+    seconds = time.perf_counter() - started
+    if not isinstance(hang.error, requests.Timeout):
+        return f"/hang gave {hang.error!r}, not a timeout"
+    if seconds >= HANG_SECONDS:
+        return f"the timeout did not cut the wait short ({seconds:.1f}s)"
+    if missing.status != 404 or missing.error is None:
+        return f"/missing gave status {missing.status}, error {missing.error!r}"
+    if slow.error is not None or slow.text is None:
+        return f"/slow/0 failed beside the others: {slow.error!r}"
+    return None
+
+
+def check_revalidation(fixture, cache_dir):
+    """A stale page is revalidated; the 304 serves the cached page and the stored frame."""
+    fixture.reset()
+    cache = PageCache(cache_dir, ttl=0)
+    url = fixture.url('/page/a')
+    first, = fetch_pages([url], cache=cache)
+    frame = pd.DataFrame({'Bank': ['First'], 'Market Cap': [1.5]})
+    cache.put_frame(url, frame)
+    second, = fetch_pages([url], cache=cache)
+    if first.status != 200 or first.not_modified:
+        return f"first fetch gave status {first.status}, not_modified {first.not_modified}"
+    if second.status != 304 or not second.not_modified or second.text != first.text:
+        return f"second fetch gave status {second.status}, not_modified {second.not_modified}"
+    if fixture.server.answers != [('/page/a', 200), ('/page/a', 304)]:
+        return f"server answers {fixture.server.answers}"
+    stored = cache.get_frame(url)
+    if stored is None or not stored.equals(frame):
+        return f"the stored frame came back as {stored!r}"
+
+    # A changed page is fetched again, and the frame of the old page dropped
+    fixture.server.version += 1
+    third, = fetch_pages([url], cache=cache)
+    if third.status != 200 or third.not_modified or cache.get_frame(url) is not None:
+        return f"changed page gave status {third.status}, not_modified {third.not_modified}"
+    return None
+
+
+def check_ttl(fixture, cache_dir):
+    """A page fetched less than ttl seconds ago is served with no request at all."""
+    fixture.reset()
+    cache = PageCache(cache_dir, ttl=60)
+    url = fixture.url('/page/b')
+    fetch_pages([url], cache=cache)
+    again, = fetch_pages([url], cache=cache)
+    if fixture.server.answers != [('/page/b', 200)]:
+        return f"server answers {fixture.server.answers}, not one 200"
+    if not again.not_modified or again.text is None:
+        return f"second fetch gave not_modified {again.not_modified}"
+    return None
+
+
+def check_eviction(fixture, cache_dir):
+    """Past max_bytes the least recently used page goes, and a page just read is kept."""
+    fixture.reset()
+    urls = [fixture.url(f'/page/{name}') for name in ('c', 'd', 'e')]
+    cache = PageCache(cache_dir, ttl=60)
+    fetch_pages(urls[:1], cache=cache)
+    page_bytes = cache.entries()[0]['bytes']
+    cache.max_bytes = 2 * page_bytes + page_bytes // 2
+    fetch_pages(urls[1:2], cache=cache)
+    time.sleep(0.05)  # so the read below is clearly the most recent use
+    cache.get(urls[0])
+    fetch_pages(urls[2:], cache=cache)
+    kept = sorted(entry['url'] for entry in cache.entries())
+    if kept != sorted([urls[0], urls[2]]):
+        return f"kept {kept}, not the pages of c and e"
+    if sum(entry['bytes'] for entry in cache.entries()) > cache.max_bytes:
+        return "the cache is larger than max_bytes"
+    removed = cache.clear()
+    if removed != 2 or cache.entries():
+        return f"clear removed {removed} pages"
+    return None
+
+
+CHECKS = [check_per_host_limit, check_timeout, check_revalidation, check_ttl, check_eviction]
+
+
+def main():
+    argparse.ArgumentParser(description="Check bank_fetch.py against a local fixture HTTP server.").parse_args()
+    failures = 0
+    with FixtureServer() as fixture:
+        for check in CHECKS:
+            cache_dir = tempfile.mkdtemp(prefix='page_cache_')
+            started = time.perf_counter()
+            try:
+                difference = check(fixture, cache_dir)
+            finally:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            print(f"{'PASS' if difference is None else 'FAIL'}  {check.__name__:24} "
+                  f"{time.perf_counter() - started:6.2f}s  {check.__doc__}")
+            if difference is not None:
+                failures += 1
+                print(difference)
+    print(f"{len(CHECKS) - failures} of {len(CHECKS)} checks pass.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
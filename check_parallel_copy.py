@@ -0,0 +1,231 @@
+"""
+Checks of rewards_loader.parallel_copy_csv against a PostgreSQL server: it loads the same
+rows as a serial copy_from_csv, and a partition that fails leaves the live table as it was.
+
+    python check_parallel_copy.py --dbname rewards_data --user postgres
+
+Synthetic RewardsData files are cleaned into CSV files and loaded over --workers
+connections, through the unlogged staging table and the swap. The checks make their own
+tables, named check_parallel_*, and drop them at the end. If no server answers, the
+checks are skipped and the script exits with status 0; otherwise it exits with status 1
+if any check fails.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import psycopg2
+
+from rewards_cleaning import clean_rewards_csv_chunked
+from rewards_loader import copy_from_csv, create_table_from_csv, parallel_copy_csv, split_on_lines
+from rewards_synth import generate_rewards_data
+
+TABLE = 'check_parallel_copy'
+STAGING = f'{TABLE}_staging'
+SERIAL = 'check_parallel_serial'
+BEFORE = 'check_parallel_before'
+INDEX_COLUMNS = ('CustomerID',)
+
+# Seconds to wait for the staging table, or for the workers to queue on its lock
+WAIT_SECONDS = 30
+
+Fixture = namedtuple('Fixture', 'conn_params cursor workers loaded other bad')
+
+
+def make_files(rows, work_dir):
+    """
+    Cleaned CSV files to load: loaded, and other with different rows; bad is other with a
+    CustomerID that is not a number about seven eighths of the way in, in the middle of
+    the last partition, so that COPY fails after that partition has sent rows.
+    """
+    paths = []
+    for seed, name in ((0, 'loaded'), (1, 'other')):
+        raw_path = generate_rewards_data(rows, os.path.join(work_dir, f'raw_{name}.csv'), seed)
+        paths.append(os.path.join(work_dir, f'{name}.csv'))
+        clean_rewards_csv_chunked(raw_path, paths[-1], seed=seed)
+    with open(paths[1], newline='') as f:
+        lines = f.readlines()
+    bad_line = 1 + (len(lines) - 1) * 7 // 8
+    lines[bad_line] = 'not-a-number' + lines[bad_line][lines[bad_line].index(','):]
+    paths.append(os.path.join(work_dir, 'bad.csv'))
+    with open(paths[-1], 'w', newline='') as f:
+        f.writelines(lines)
+    return paths
+
+
+def _count(cursor, query, params=None):
+    cursor.execute(query, params)
+    return cursor.fetchone()[0]
+
+
+def _differing_rows(cursor, left, right):
+    """Rows of either table that the other does not have as many times."""
+    return _count(cursor, f"SELECT (SELECT count(*) FROM (SELECT * FROM {left} EXCEPT ALL SELECT * FROM {right}) a)"
+                          f" + (SELECT count(*) FROM (SELECT * FROM {right} EXCEPT ALL SELECT * FROM {left}) b)")
+
+
+def _load_live_table(fixture):
+    """Loads the loaded file into TABLE, and a copy of it into BEFORE."""
+    fixture.cursor.execute(f"DROP TABLE IF EXISTS {TABLE}, {STAGING}, {BEFORE}")
+    parallel_copy_csv(fixture.conn_params, TABLE, fixture.loaded, fixture.workers, INDEX_COLUMNS)
+    fixture.cursor.execute(f"CREATE TABLE {BEFORE} AS SELECT * FROM {TABLE}")
+
+
+def _unchanged(fixture):
+    """None if TABLE still holds the rows of BEFORE with its index, and no staging table is left."""
+    cursor = fixture.cursor
+    differing = _differing_rows(cursor, TABLE, BEFORE)
+    if differing:
+        return f"the live table changed: {differing} rows differ from before the load"
+    if _count(cursor, "SELECT to_regclass(%s) IS NOT NULL", (STAGING,)):
+        return "the staging table was left behind"
+    indexes = _count(cursor, "SELECT count(*) FROM pg_indexes WHERE tablename = %s", (TABLE,))
+    if indexes != len(INDEX_COLUMNS):
+        return f"the live table has {indexes} indexes, not {len(INDEX_COLUMNS)}"
+    return None
+
+
+def check_matches_serial(fixture):
+    """A parallel load has the rows of a serial copy_from_csv, indexed and logged."""
+    cursor = fixture.cursor
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE}, {STAGING}, {SERIAL}")
+    rows = parallel_copy_csv(fixture.conn_params, TABLE, fixture.loaded, fixture.workers, INDEX_COLUMNS)
+    conn = cursor.connection
+    create_table_from_csv(conn, SERIAL, fixture.loaded)
+    copy_from_csv(conn, SERIAL, fixture.loaded, progress_interval=None)
+
+    with open(fixture.loaded, newline='') as f:
+        file_rows = sum(1 for _ in f) - 1
+    table_rows = _count(cursor, f"SELECT count(*) FROM {TABLE}")
+    if not rows == table_rows == file_rows:
+        return f"loaded {rows} rows, the table has {table_rows}, the file {file_rows}"
+    differing = _differing_rows(cursor, TABLE, SERIAL)
+    if differing:
+        return f"{differing} rows differ from the serial copy_from_csv"
+    if _count(cursor, "SELECT relpersistence FROM pg_class WHERE relname = %s", (TABLE,)) != 'p':
+        return "the table is still unlogged"
+    if _count(cursor, "SELECT to_regclass(%s) IS NOT NULL", (STAGING,)):
+        return "the staging table was left behind"
+    indexes = [f"{TABLE}_{column}_idx".lower() for column in INDEX_COLUMNS]
+    cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", (TABLE,))
+    if sorted(name for name, in cursor.fetchall()) != sorted(indexes):
+        return f"the table does not have exactly the indexes {indexes}"
+    return None
+
+
+def check_failed_partition(fixture):
+    """A row COPY rejects halfway through a partition fails the load; the live table is kept."""
+    _load_live_table(fixture)
+    try:
+        rows = parallel_copy_csv(fixture.conn_params, TABLE, fixture.bad, fixture.workers, INDEX_COLUMNS)
+    except psycopg2.Error:
+        return _unchanged(fixture)
+    return f"the load of the bad file succeeded with {rows} rows"
+
+
+def check_terminated_worker(fixture):
+    """A worker whose connection dies during its COPY fails the load; the live table is kept."""
+    _load_live_table(fixture)
+    outcome = {}
+
+    def load():
+        try:
+            outcome['rows'] = parallel_copy_csv(fixture.conn_params, TABLE, fixture.other, fixture.workers,
+                                                INDEX_COLUMNS)
+        except Exception as e:
+            outcome['error'] = e
+
+    # Holding a lock on the staging table keeps every worker waiting inside its COPY until
+    # one of them is terminated
+    lock_conn = psycopg2.connect(**fixture.conn_params)
+    lock_conn.autocommit = True  # so each poll sees the tables committed since the last
+    thread = threading.Thread(target=load)
+    try:
+        lock_cursor = lock_conn.cursor()
+        thread.start()
+        deadline = time.monotonic() + WAIT_SECONDS
+        while not _count(lock_cursor, "SELECT to_regclass(%s) IS NOT NULL", (STAGING,)):
+            if time.monotonic() > deadline or not thread.is_alive():
+                return "the staging table was never created"
+        lock_cursor.execute("BEGIN")
+        lock_cursor.execute(f"LOCK TABLE {STAGING} IN ACCESS EXCLUSIVE MODE")
+        partitions = len(split_on_lines(fixture.other, fixture.workers))
+        waiting = []
+        while len(waiting) < partitions:
+            if time.monotonic() > deadline:
+                return f"{len(waiting)} of {partitions} workers reached their COPY while the lock was held"
+            fixture.cursor.execute("SELECT pid FROM pg_stat_activity WHERE wait_event_type = 'Lock' "
+                                   "AND query LIKE %s", (f"COPY {STAGING} %",))
+            waiting = [pid for pid, in fixture.cursor.fetchall()]
+        fixture.cursor.execute("SELECT pg_terminate_backend(%s)", (waiting[0],))
+        lock_cursor.execute("ROLLBACK")
+        thread.join()
+    finally:
+        lock_conn.close()
+        if thread.is_alive():
+            thread.join()
+    if 'error' not in outcome:
+        return f"the load succeeded with {outcome['rows']} rows after a worker was terminated"
+    if not isinstance(outcome['error'], psycopg2.Error):
+        return f"the load failed with {outcome['error']!r}, not the worker's database error"
+    return _unchanged(fixture)
+
+
+CHECKS = [check_matches_serial, check_failed_partition, check_terminated_worker]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check parallel_copy_csv against a PostgreSQL server.")
+    parser.add_argument('--rows', type=int, default=200_000, help="Rows of each synthetic file")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--dbname', default='rewards_data')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default=None)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    args = parser.parse_args()
+
+    conn_params = {'dbname': args.dbname, 'user': args.user, 'password': args.password, 'host': args.host,
+                   'port': args.port}
+    try:
+        conn = psycopg2.connect(**conn_params)
+    except psycopg2.OperationalError as e:
+        print(f"SKIP  no PostgreSQL server to check against: {str(e).strip()}")
+        sys.exit(0)
+    conn.autocommit = True
+    failures = 0
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            with contextlib.redirect_stdout(io.StringIO()):
+                loaded, other, bad = make_files(args.rows, work_dir)
+            fixture = Fixture(conn_params, conn.cursor(), args.workers, loaded, other, bad)
+            for check in CHECKS:
+                started = time.perf_counter()
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    try:
+                        difference = check(fixture)
+                    except Exception as e:
+                        difference = f"{type(e).__name__}: {e}"
+                print(f"{'PASS' if difference is None else 'FAIL'}  {check.__name__:24} "
+                      f"{time.perf_counter() - started:6.2f}s  {check.__doc__}")
+                if difference is not None:
+                    failures += 1
+                    print(difference)
+                    print(output.getvalue()[-2000:])
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}, {STAGING}, {SERIAL}, {BEFORE}")
+        conn.close()
+    print(f"{len(CHECKS) - failures} of {len(CHECKS)} checks pass.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
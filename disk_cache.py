@@ -0,0 +1,109 @@
+"""
+A directory of cache entries bounded in size, for step_cache.StepCache and
+bank_fetch.PageCache.
+
+Each entry is a few files named <key>.<extension>, one of them a JSON file of the entry's
+info. Files are written under a temporary name and renamed, so a reader never sees half a
+file. Reading an entry touches its USED file, and once the files pass max_bytes the least
+recently used entries are deleted.
+"""
+import glob
+import json
+import os
+import time
+
+
+class DiskCache:
+    """
+    Entries of files named by key in one directory, evicted least recently used first.
+
+    Subclasses set EXTENSIONS, every file an entry can have, and USED, the file whose
+    modification time is the entry's last use; an entry without it is not listed.
+
+    Args:
+        cache_dir (str): Directory of the cache; created when first written to.
+        max_bytes (int): Size past which least recently used entries are deleted.
+    """
+
+    EXTENSIONS = ('json',)
+    USED = 'json'
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _path(self, key, extension):
+        return os.path.join(self.cache_dir, f"{key}.{extension}")
+
+    def _replace(self, key, extension, write):
+        """Calls write(path) with a temporary path, then renames that file to the entry's."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key, extension)
+        write(path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def _write_info(self, key, info):
+        def write(path):
+            with open(path, 'w') as f:
+                json.dump(info, f)
+        self._replace(key, 'json', write)
+
+    def _read_info(self, key):
+        """The info of the entry, or None if it has none or it is not whole."""
+        try:
+            with open(self._path(key, 'json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _touch(self, key):
+        """Marks the entry as just used."""
+        now = time.time()
+        os.utime(self._path(key, self.USED), (now, now))
+
+    def _delete_file(self, key, extension):
+        try:
+            os.remove(self._path(key, extension))
+        except FileNotFoundError:
+            pass
+
+    def _delete(self, key):
+        for extension in self.EXTENSIONS:
+            self._delete_file(key, extension)
+
+    def remove(self, key):
+        """Deletes the entry's files."""
+        self._delete(key)
+
+    def entries(self):
+        """Every entry's info, with its key, size and last use, most recently used first."""
+        entries = []
+        for info_path in glob.glob(os.path.join(self.cache_dir, '*.json')):
+            key = os.path.basename(info_path)[:-len('.json')]
+            info = self._read_info(key)
+            if info is None or not os.path.exists(self._path(key, self.USED)):
+                continue
+            sizes = [os.path.getsize(path) for path in (self._path(key, extension) for extension in self.EXTENSIONS)
+                     if os.path.exists(path)]
+            info.update(key=key, bytes=sum(sizes), last_used=os.path.getmtime(self._path(key, self.USED)))
+            entries.append(info)
+        return sorted(entries, key=lambda entry: entry['last_used'], reverse=True)
+
+    def evict(self, keep=None):
+        """Deletes least recently used entries, except keep, until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(entry['bytes'] for entry in entries)
+        for entry in reversed(entries):
+            if total <= self.max_bytes:
+                break
+            if entry['key'] == keep:
+                continue
+            self._delete(entry['key'])
+            total -= entry['bytes']
+
+    def clear(self):
+        """Deletes every entry; returns how many there were."""
+        entries = self.entries()
+        for entry in entries:
+            self._delete(entry['key'])
+        return len(entries)
@@ -10,6 +10,22 @@ import csv
 
 
 
+# # Streaming mode for exports too large to load at once: runs steps a-l below chunk by
+# # chunk and appends to the cleaned file (see rewards_cleaning.py)
+# from rewards_cleaning import clean_rewards_csv_chunked
+# clean_rewards_csv_chunked(r"c:\Users\HP\Documents\RewardsData.csv", 'Cleaned_RewardsData.csv')
+
+# # While tuning a step: keeps each step's result in a cache, so a re-run only redoes the
+# # steps from the first one that changed (see step_cache.py; 'python step_cache.py list')
+# import numpy as np
+# from step_cache import clean_rewards_cached
+# df = clean_rewards_cached(r"c:\Users\HP\Documents\RewardsData.csv", rng=np.random.default_rng(0))
+
+# # While RewardsData.csv is being appended to: cleans only the rows added since the last
+# # run and appends them to the cleaned file (see rewards_follow.py; --watch keeps running)
+# from rewards_follow import follow_once
+# follow_once(r"c:\Users\HP\Documents\RewardsData.csv", 'Cleaned_RewardsData.csv', seed=0)
+
 # Load the data
 df = pd.read_csv(r"c:\Users\HP\Documents\RewardsData.csv")
 
@@ -119,149 +135,6 @@ if pd.isna(df.at[437, 'Zip']):  # row 438 is index 437
 
 # df = pd.read_csv('Cleaned_RewardsData.csv')
 
-# # Loading to data base
-
-
-# def copy_from_csv(conn, table_name, csv_file_path, delimiter=',', null_string=''):
-#     """
-#     Copies data from a CSV file into a PostgreSQL table using the COPY command.
-#     This is the most efficient way to load large amounts of data.
-
-#     Args:
-#         conn: psycopg2 connection object.
-#         table_name (str): The name of the table to copy data into.
-#         csv_file_path (str): Path to the CSV file.
-#         delimiter (str, optional): The delimiter used in the CSV file. Defaults to ','.
-#         null_string (str, optional): The string representing NULL values in the CSV. Defaults to ''.
-#     """
-#     cursor = conn.cursor()
-#     try:
-#         with open(csv_file_path, 'r') as f:
-#             reader = csv.reader(f, delimiter=delimiter)
-#             header = next(reader)  # Read and discard the header row
-#             csv_file = StringIO()
-#             writer = csv.writer(csv_file, delimiter=delimiter, quotechar='"', quoting=csv.QUOTE_MINIMAL)
-#             for row in reader:
-#                 # Check if the row has more columns than the header
-#                 if len(row) > len(header):
-#                     row = row[:len(header)]  # Truncate the row to match the header
-#                 elif len(row) < len(header):
-#                     # Pad the row with empty strings if it has fewer columns
-#                     row += [''] * (len(header) - len(row))
-#                 writer.writerow(row)
-#             csv_file.seek(0)
-
-#             cursor.copy_from(csv_file, table_name, sep=delimiter, null=null_string)
-#             conn.commit()
-#             print(f"Data from '{csv_file_path}' successfully copied to table '{table_name}'.")
-
-#     except psycopg2.Error as e:
-#         print(f"Error copying data from CSV to table: {e}")
-#         conn.rollback()  # Rollback the transaction on error
-#         raise  # Re-raise the exception to be handled by the caller, if needed.
-#     finally:
-#         cursor.close()  # Ensure the cursor is closed.
-
-# def create_table_from_csv(conn, table_name, csv_file_path,  null_string=''):
-#     """
-#     Creates a PostgreSQL table from a CSV file, inferring column names and data types
-#     from the CSV file's header row.  Handles potential issues with empty fields and
-#     attempts to handle different CSV dialects.
-
-#     Args:
-#         conn: psycopg2 connection object.
-#         table_name (str): The name of the table to create.
-#         csv_file_path (str): Path to the CSV file.
-#         null_string (str, optional): The string representing NULL values in the CSV.
-#     """
-#     cursor = conn.cursor()
-#     try:
-#         with open(csv_file_path, 'r') as f:
-#             # Use csv.Sniffer to detect the delimiter and quotechar
-#             dialect = csv.Sniffer().sniff(f.read(1024))  # Read a chunk to sniff
-#             f.seek(0)  # Reset file position after sniffing
-#             reader = csv.reader(f, dialect)
-#             header = next(reader)  # Get the header row
-
-#             # Determine data types from the first row of data (after the header)
-#             first_data_row = next(reader, None)  # Get the first data row or None if empty
-#             if not first_data_row:
-#                 raise ValueError("CSV file is empty or contains only a header.")
-#              # Infer data types.  Handles empty strings correctly now.
-#             column_types = []
-#             for value in first_data_row:
-#                 if value == null_string:  # Check for your NULL string
-#                     column_types.append('TEXT')  # Default to TEXT for NULLs
-#                 else:
-#                     try:
-#                         int(value)
-#                         column_types.append('INTEGER')
-#                     except ValueError:
-#                         try:
-#                             float(value)
-#                             column_types.append('REAL')
-#                         except ValueError:
-#                             column_types.append('TEXT')  # Fallback to TEXT
-
-#         # Construct the CREATE TABLE statement.
-#         columns = [f"{header[i]} {column_types[i]}" for i in range(len(header))]
-#         create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns)})"
-#         print(f"Creating table: {create_table_query}")  # Print the query
-#         cursor.execute(create_table_query)
-#         conn.commit()
-#         print(f"Table '{table_name}' successfully created.")
-
-#     except psycopg2.Error as e:
-#         print(f"Error creating table: {e}")
-#         conn.rollback()
-#         raise
-#     except ValueError as e:
-#         print(f"Error determining column types or CSV format: {e}")
-#         conn.rollback()
-#         raise
-#     finally:
-#         cursor.close()
-
-
-# def main():
-#     """
-#     Main function to connect to the database, create a table, and copy data from a CSV file.
-#     """
-#     # 1.  Database connection details (replace with your actual details)
-#     dbname = "rewards_data"  # Replace with your database name
-#     user = "postgres"  # Default PostgreSQL user
-#     password = "best1234"
-#     host = "localhost"  # e.g., 'localhost' or an IP address
-#     port = "5432"  # Default PostgreSQL port
-
-#     # 2. CSV file path and table name
-#     csv_file_path = "Cleaned_RewardsData.csv"  # Replace with your CSV file path
-#     table_name = "reward_data"  # Replace with your desired table name
-
-#     try:
-#         # 3. Establish database connection
-#         conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
-#         conn.autocommit = False # Start a transaction
-
-#         # 4. Create the table (if it doesn't exist)
-#         create_table_from_csv(conn, table_name, csv_file_path)
-
-#         # 5. Copy data from the CSV file to the table
-#         copy_from_csv(conn, table_name, csv_file_path)
-
-#         conn.commit() # Explicitly commit the transaction
-#         print("Transaction completed successfully.")
-
-#     except psycopg2.Error as e:
-#         print(f"Database error: {e}")
-#         # IMPORTANT:  No conn.rollback() here.  It's handled in the functions.
-#     except Exception as e:
-#         print(f"An unexpected error occurred: {e}")
-#         # No conn.rollback() here either.
-#     finally:
-#         if conn:
-#             conn.close()
-#             print("Connection closed.")
-
-# if __name__  == "__main__":
-#     main()
+# # Loading to data base: copy_from_csv, create_table_from_csv and main() now live in
+# # rewards_loader.py, which also loads the typed .parquet / .feather files directly
+# # (python rewards_loader.py)
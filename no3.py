@@ -1,6 +1,5 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-import requests
 from bs4 import BeautifulSoup
 import pandas as pd
 from sqlalchemy import create_engine, inspect, text
@@ -11,6 +10,8 @@ import threading
 import psycopg2
 from psycopg2 import sql
 
+from bank_fetch import PageCache, fetch_pages
+
 # Exchange rates (normally you would fetch these from an API)
 EXCHANGE_RATES = {
     'EUR': 0.93,  # 1 USD = 0.93 EUR
@@ -18,6 +19,20 @@ EXCHANGE_RATES = {
     'INR': 83.40  # 1 USD = 83.40 INR
 }
 
+# Bank ranking pages scraped each cycle, e.g. one per region and year; they are fetched
+# concurrently (see bank_fetch.py) and their tables combined
+SOURCE_URLS = [
+    "https://en.wikipedia.org/wiki/List_of_largest_banks",
+]
+
+# On-disk cache of the scraped pages: pages are used without a request for ttl seconds,
+# then revalidated with ETag / Last-Modified; the least recently used go past max_bytes
+PAGE_CACHE_CONFIG = {
+    'cache_dir': '.page_cache',
+    'max_bytes': 64 << 20,  # 64 MB
+    'ttl': 15 * 60  # 15 minutes
+}
+
 # PostgreSQL configuration
 POSTGRES_CONFIG = {
     'dbname': 'bank_data',
@@ -47,6 +62,9 @@ class BankScraperApp:
         self.db_engine = None
         self.table_name = "bank_market_cap"
         
+        # Scraped pages and the rows extracted from them, revalidated with conditional requests
+        self.page_cache = PageCache(**PAGE_CACHE_CONFIG)
+        
         # Create GUI elements
         self.create_widgets()
         
@@ -178,53 +196,43 @@ class BankScraperApp:
         thread.start()
     
     def scrape_bank_data(self):
-        """Scrape bank data from Wikipedia"""
+        """Scrape bank data from every page in SOURCE_URLS, fetched concurrently"""
         try:
-            logging.info("Starting data scraping")
-            url = "https://en.wikipedia.org/wiki/List_of_largest_banks"
+            logging.info(f"Starting data scraping of {len(SOURCE_URLS)} pages")
             
             # Update progress
-            self.update_progress(10, "Fetching webpage...")
-            
-            # Fetch the webpage
-            response = requests.get(url)
-            response.raise_for_status()
-            
-            # Parse HTML
-            self.update_progress(30, "Parsing HTML...")
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Find the table - adjust selector as needed
-            tables = soup.find_all('table', {'class': 'wikitable'})
-            if not tables:
-                raise ValueError("Could not find any tables with class 'wikitable'")
-            
-            # We'll use the first table (adjust index if needed)
-            table = tables[0]
-            
-            # Extract table data
-            self.update_progress(50, "Extracting table data...")
-            rows = table.find_all('tr')[1:]  # Skip header row
+            self.update_progress(10, "Fetching webpages...")
             
+            # Each page is parsed as soon as it arrives, while the others are still being fetched
             data = []
-            for row in rows:
-                cols = row.find_all('td')
-                if len(cols) >= 3:  # Ensure we have enough columns
-                    rank = cols[0].text.strip()
-                    bank_name = cols[1].text.strip()
-                    market_cap_str = cols[2].text.strip()
-                    
-                    # Clean market cap value (remove $ and billion)
+            done = []
+            
+            def parse_page(result):
+                done.append(result.url)
+                # An unchanged page reuses the rows extracted from it last time, without parsing
+                cached = self.page_cache.get_frame(result.url) if result.not_modified else None
+                if cached is not None:
+                    data.extend(cached.to_dict('records'))
+                    logging.info(f"Page unchanged, reused {len(cached)} banks from {result.url}")
+                elif result.error is None:
                     try:
-                        market_cap = float(market_cap_str.replace('$', '').replace(' billion', '').strip())
-                    except ValueError:
-                        continue  # Skip rows with invalid market cap values
-                    
-                    data.append({
-                        'Rank': rank,
-                        'Bank': bank_name,
-                        'Market Cap (USD Billion)': market_cap
-                    })
+                        rows = self.parse_bank_page(result.text)
+                        for row in rows:
+                            row['Source'] = result.url
+                        data.extend(rows)
+                        self.page_cache.put_frame(result.url, pd.DataFrame(rows))
+                        logging.info(f"Parsed {len(rows)} banks from {result.url} ({result.seconds:.2f}s)")
+                    except ValueError as e:
+                        logging.warning(f"Could not parse {result.url}: {str(e)}")
+                self.update_progress(10 + 60 * len(done) / len(SOURCE_URLS),
+                                     f"Fetched {len(done)} of {len(SOURCE_URLS)} pages...")
+            
+            results = fetch_pages(SOURCE_URLS, on_page=parse_page, cache=self.page_cache)
+            failed = [result for result in results if result.error is not None]
+            if failed:
+                logging.warning(f"{len(failed)} of {len(results)} pages could not be fetched")
+            if not data and len(failed) == len(results):
+                raise failed[0].error
             
             if not data:
                 raise ValueError("No data extracted from the table")
@@ -253,6 +261,42 @@ class BankScraperApp:
         finally:
             self.scrape_button.config(state=tk.NORMAL)
     
+    def parse_bank_page(self, html):
+        """Extract the rank, bank and market cap rows of the first wikitable of a page"""
+        soup = BeautifulSoup(html, 'html.parser')
+        
+        # Find the table - adjust selector as needed
+        tables = soup.find_all('table', {'class': 'wikitable'})
+        if not tables:
+            raise ValueError("Could not find any tables with class 'wikitable'")
+        
+        # We'll use the first table (adjust index if needed)
+        table = tables[0]
+        
+        # Extract table data
+        rows = table.find_all('tr')[1:]  # Skip header row
+        
+        data = []
+        for row in rows:
+            cols = row.find_all('td')
+            if len(cols) >= 3:  # Ensure we have enough columns
+                rank = cols[0].text.strip()
+                bank_name = cols[1].text.strip()
+                market_cap_str = cols[2].text.strip()
+                
+                # Clean market cap value (remove $ and billion)
+                try:
+                    market_cap = float(market_cap_str.replace('$', '').replace(' billion', '').strip())
+                except ValueError:
+                    continue  # Skip rows with invalid market cap values
+                
+                data.append({
+                    'Rank': rank,
+                    'Bank': bank_name,
+                    'Market Cap (USD Billion)': market_cap
+                })
+        return data
+    
     def display_data(self, df):
         """Display data in the Treeview widget"""
         # Clear existing data
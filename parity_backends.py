@@ -0,0 +1,133 @@
+"""
+Parity check of the cleaning backends: cleans one raw file with pandas and with Polars
+(rewards_polars.py) under each plan variant, into each output format, and compares the
+cleaned files.
+
+    python parity_backends.py --rows 200000
+    python parity_backends.py RewardsData.csv --formats parquet
+
+Parquet and Feather files must have the same Arrow schema, where Polars' large_string and
+string_view count as string, since they hold the same text. The cleaned files are then
+read back, CSV files with pd.read_csv, and must match value for value and dtype for
+dtype, together with the Birthdate format counts. Exits with status 1 if any variant
+differs.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from rewards_cleaning import (OUTPUT_FORMATS, clean_rewards, default_plan, output_format, read_cleaned,
+                              read_rewards_csv, write_cleaned)
+from rewards_polars import clean_rewards_polars
+from rewards_synth import generate_rewards_data
+
+# (zip_fill, optimize, steps skipped) of every variant compared
+VARIANTS = [
+    ('mean', True, ()),
+    ('mean', False, ()),
+    ('median', True, ()),
+    ('median', False, ()),
+    ('mean', True, ('c', 'd')),
+    ('mean', True, ('k',)),
+    ('mean', True, ('e', 'g')),
+    ('median', True, ('h', 'j')),
+]
+
+
+def arrow_schema(path):
+    """The Arrow schema of a Parquet or Feather file, without metadata and with every string type as string."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if output_format(path) == 'parquet':
+        schema = pq.read_schema(path)
+    else:
+        with pa.memory_map(path) as source:
+            schema = pa.ipc.open_file(source).schema
+    return pa.schema([field.with_type(pa.string())
+                      if pa.types.is_large_string(field.type) or pa.types.is_string_view(field.type) else field
+                      for field in schema.remove_metadata()])
+
+
+def compare_backends(csv_file_path, zip_fill='mean', optimize=True, skip=(), seed=0, work_dir=None, fmt='csv'):
+    """
+    Cleans csv_file_path on both backends with the same plan and seed, into fmt files.
+
+    Returns:
+        tuple: (None if the cleaned files and format counts match, else what differs;
+            pandas seconds; Polars seconds)
+    """
+    work_dir = work_dir or tempfile.gettempdir()
+    pandas_path = os.path.join(work_dir, f'parity_pandas.{fmt}')
+    polars_path = os.path.join(work_dir, f'parity_polars.{fmt}')
+
+    started = time.perf_counter()
+    pandas_counts = {}
+    plan = default_plan(zip_fill).disable(*skip)
+    df = read_rewards_csv(csv_file_path, usecols=plan.usecols())
+    df = clean_rewards(df, format_counts=pandas_counts, rng=np.random.default_rng(seed), plan=plan,
+                       optimize=optimize)
+    write_cleaned(df, pandas_path)
+    pandas_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    polars_counts = {}
+    clean_rewards_polars(csv_file_path, polars_path, polars_counts, seed=seed,
+                         plan=default_plan(zip_fill).disable(*skip), optimize=optimize)
+    polars_seconds = time.perf_counter() - started
+
+    if pandas_counts != polars_counts:
+        return f"format counts differ: {pandas_counts} != {polars_counts}", pandas_seconds, polars_seconds
+    if fmt != 'csv':
+        pandas_schema, polars_schema = arrow_schema(pandas_path), arrow_schema(polars_path)
+        if not pandas_schema.equals(polars_schema):
+            return (f"schemas differ:\npandas:\n{pandas_schema}\npolars:\n{polars_schema}",
+                    pandas_seconds, polars_seconds)
+    try:
+        pd.testing.assert_frame_equal(read_cleaned(pandas_path), read_cleaned(polars_path))
+    except AssertionError as e:
+        return str(e), pandas_seconds, polars_seconds
+    return None, pandas_seconds, polars_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the pandas and Polars backends clean alike.")
+    parser.add_argument('csv_file_path', nargs='?', default=None,
+                        help="Raw RewardsData CSV file; a synthetic one of --rows rows if not given")
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--formats', default='csv,parquet,feather',
+                        help="Comma-separated output formats to compare, of csv, parquet and feather")
+    args = parser.parse_args()
+    formats = [fmt.strip() for fmt in args.formats.split(',') if fmt.strip()]
+    unknown = set(formats).difference(OUTPUT_FORMATS.values())
+    if unknown:
+        parser.error(f"Unknown formats: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        csv_file_path = args.csv_file_path
+        if csv_file_path is None:
+            csv_file_path = generate_rewards_data(args.rows, os.path.join(work_dir, 'RewardsData.csv'), args.seed)
+        failures = 0
+        for fmt in formats:
+            for zip_fill, optimize, skip in VARIANTS:
+                difference, pandas_seconds, polars_seconds = compare_backends(csv_file_path, zip_fill, optimize,
+                                                                              skip, args.seed, work_dir, fmt)
+                name = f"{fmt} zip_fill={zip_fill} optimize={optimize} skip={','.join(skip) or '-'}"
+                print(f"{'PASS' if difference is None else 'FAIL'}  {name:48} pandas {pandas_seconds:7.2f}s  "
+                      f"polars {polars_seconds:7.2f}s")
+                if difference is not None:
+                    failures += 1
+                    print(difference)
+    total = len(formats) * len(VARIANTS)
+    print(f"{total - failures} of {total} variants match.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1237 @@
+"""
+Cleaning steps a-l for RewardsData.csv (see exam_bright.py), as reusable functions.
+
+Every step takes a DataFrame and returns the cleaned DataFrame, so the same steps can be
+run on the whole file at once (clean_rewards) or on bounded chunks of it
+(clean_rewards_csv_chunked) for exports that do not fit in memory.
+"""
+import argparse
+import os
+import random
+import re
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Rows per chunk in streaming mode
+CHUNKSIZE = 100_000
+
+STATE_ABBR = {
+    'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas',
+    'CA': 'California', 'CO': 'Colorado', 'CT': 'Connecticut',
+    'DE': 'Delaware', 'FL': 'Florida', 'GA': 'Georgia', 'HI': 'Hawaii',
+    'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa',
+    'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine',
+    'MD': 'Maryland', 'MA': 'Massachusetts', 'MI': 'Michigan',
+    'MN': 'Minnesota', 'MS': 'Mississippi', 'MO': 'Missouri',
+    'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada', 'NH': 'New Hampshire',
+    'NJ': 'New Jersey', 'NM': 'New Mexico', 'NY': 'New York',
+    'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio',
+    'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania',
+    'RI': 'Rhode Island', 'SC': 'South Carolina', 'SD': 'South Dakota',
+    'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont',
+    'VA': 'Virginia', 'WA': 'Washington', 'WV': 'West Virginia',
+    'WI': 'Wisconsin', 'WY': 'Wyoming', 'DC': 'District of Columbia'
+}
+STATES_ORDERED = sorted(STATE_ABBR.values())
+
+DATE_FORMATS = ('%m/%d/%Y', '%m/%d/%y', '%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y')
+
+# Opt-in compact schema: City and State load as categoricals, and the cleaning steps then
+# keep Zip as a nullable Int32 and Birthdate as a native date
+COMPACT_DTYPES = {'City': 'category', 'State': 'category'}
+
+
+def read_rewards_csv(csv_file_path, compact=False, **kwargs):
+    """
+    Loads RewardsData.csv, optionally with the compact schema.
+
+    Args:
+        csv_file_path (str): Path to the raw CSV file.
+        compact (bool, optional): Load City and State as categoricals.
+        **kwargs: Passed on to pd.read_csv.
+    """
+    if compact:
+        kwargs['dtype'] = {**kwargs.get('dtype', {}), **COMPACT_DTYPES}
+    return pd.read_csv(csv_file_path, **kwargs)
+
+
+def _map_distinct(values, func):
+    """
+    Applies func to the Series of distinct values and maps the result back to every row.
+
+    Missing values stay missing. A categorical column comes back as a categorical.
+    """
+    codes, uniques = pd.factorize(values)  # missing values get code -1
+    mapped = func(pd.Series(uniques, dtype=object))
+    present = codes >= 0
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        mapped_codes, categories = pd.factorize(mapped)
+        new_codes = np.full(len(codes), -1)
+        new_codes[present] = mapped_codes[codes[present]]
+        return pd.Series(pd.Categorical.from_codes(new_codes, categories=categories),
+                         index=values.index, name=values.name)
+    result = np.full(len(codes), np.nan, dtype=object)
+    result[present] = mapped.to_numpy()[codes[present]]
+    return pd.Series(result, index=values.index, name=values.name)
+
+
+def _fill_category(values, fill):
+    """Adds the fill values a categorical column does not have yet to its categories."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        missing = pd.Index(fill).unique().difference(values.cat.categories)
+        if len(missing):
+            values = values.cat.add_categories(missing)
+    return values
+
+
+# a. Delete the tags column
+def drop_tags(df):
+    return df.drop('Tags', axis=1)
+
+
+# b. Locate the empty cell on row 438, under the zip column and fill it with the number (11011)
+def fill_row_438_zip(df):
+    # Chunks keep the file's row labels, so only the chunk holding row 438 is touched
+    if 437 in df.index and pd.isna(df.at[437, 'Zip']):  # row 438 is index 437
+        # A number in a numeric column, so the column is not turned into objects
+        df.at[437, 'Zip'] = 11011 if pd.api.types.is_numeric_dtype(df['Zip']) else '11011'
+    return df
+
+
+# Manual corrections by record key rather than by row position, as step b does it: a CSV
+# file of patches with the key column, 'column' and 'value', applied by patch_step
+PATCH_KEY = 'CustomerID'
+
+
+def load_patches(path, key=PATCH_KEY):
+    """
+    Loads correction patches from a CSV file with key, 'column' and 'value' columns.
+
+    Values are kept as text and converted to each column's type when applied; an empty
+    value empties the cell. Where the file patches the same cell twice, the later patch wins.
+
+    Returns:
+        DataFrame: The patches, numbered by their order in the file.
+    """
+    patches = pd.read_csv(path, dtype=str, keep_default_na=False)
+    missing = {key, 'column', 'value'}.difference(patches.columns)
+    if missing:
+        raise ValueError(f"Patch file '{path}' has no {', '.join(sorted(missing))} column.")
+    return patches[[key, 'column', 'value']]
+
+
+def _patch_keys(patches, keys, key):
+    """The patches' keys as the type of the keys they are matched against."""
+    if pd.api.types.is_numeric_dtype(keys):
+        return pd.to_numeric(patches[key], errors='coerce')
+    return patches[key].astype(object)
+
+
+def _patch_values(values, patched):
+    """The text of patched values as the type of the column values they go into."""
+    patched = patched.where(patched != '')
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        patched = pd.to_numeric(patched, errors='coerce')
+        if pd.api.types.is_integer_dtype(values) and (patched.isna().any() or (patched % 1 != 0).any()):
+            values = values.astype('float64')
+    elif pd.api.types.is_datetime64_any_dtype(values):
+        patched = pd.to_datetime(patched, errors='coerce')
+    elif isinstance(values.dtype, pd.CategoricalDtype):
+        values = _fill_category(values, patched.dropna())
+    return values.copy(), patched.to_numpy()
+
+
+def apply_patches(df, patches, key=PATCH_KEY):
+    """
+    Applies correction patches to the rows whose key they name, in one merge on the key.
+
+    Every row with a patch's key gets it. Patches whose key is in no row, or whose column
+    is not in df, change nothing; see unmatched_patches.
+
+    Args:
+        df (DataFrame): Rows to correct.
+        patches (DataFrame): From load_patches.
+        key (str, optional): Column that identifies a record.
+    """
+    if not len(patches) or not len(df):
+        return df
+    targets = pd.DataFrame({key: _patch_keys(patches, df[key], key), 'column': patches['column'],
+                            'value': patches['value'], 'patch': np.arange(len(patches))})
+    targets = targets[targets[key].notna() & targets['column'].isin(df.columns)]
+    rows = pd.DataFrame({key: df[key].to_numpy(), 'position': np.arange(len(df))})
+    hits = targets.merge(rows, on=key)
+    # The later of two patches to the same cell wins
+    hits = hits.sort_values('patch').drop_duplicates(['position', 'column'], keep='last')
+    for column, group in hits.groupby('column', sort=False):
+        values, patched = _patch_values(df[column], group['value'])
+        values.iloc[group['position'].to_numpy()] = patched
+        df[column] = values
+    return df
+
+
+def unmatched_patches(csv_file_path, patches, key=PATCH_KEY, chunksize=CHUNKSIZE):
+    """
+    The patches that match no row of a raw CSV file: their key is in no row, or their
+    column is not in the file. Reads only the key column, a chunk at a time.
+    """
+    columns = pd.read_csv(csv_file_path, nrows=0).columns
+    found = np.zeros(len(patches), dtype=bool)
+    for chunk in pd.read_csv(csv_file_path, usecols=[key], chunksize=chunksize):
+        found |= _patch_keys(patches, chunk[key], key).isin(chunk[key]).to_numpy()
+    return patches[~found | ~patches['column'].isin(columns).to_numpy()]
+
+
+def overridden_patches(patches, key=PATCH_KEY):
+    """
+    The patches that a later patch to the same key and column overrides, so that
+    apply_patches never writes them. Keys compare as numbers when they all are numbers,
+    as a numeric key column reads them.
+    """
+    keys = pd.to_numeric(patches[key], errors='coerce')
+    if keys.isna().any():
+        keys = patches[key]
+    return patches[pd.DataFrame({key: keys, 'column': patches['column']}).duplicated(keep='last').to_numpy()]
+
+
+def patch_step(patches, key=PATCH_KEY):
+    """A Step 'p' that applies patches, for CleaningPlan.add(patch_step(patches), before='a')."""
+    columns = tuple(column for column in dict.fromkeys(patches['column']) if column != key)
+    return Step('p', lambda df, context: apply_patches(df, patches, key), reads=(key,) + columns, writes=columns)
+
+
+# c. In the zip column, truncate the numbers to the first 5 numbers
+def _truncate_zip_values(zips):
+    return zips.astype(str).str[:5]
+
+
+def truncate_zip(df):
+    df['Zip'] = _map_distinct(df['Zip'], _truncate_zip_values)
+    return df
+
+
+# Powers of ten up to the largest whole Zip normalize_zips truncates without strings
+_ZIP_POWERS = 10.0 ** np.arange(16)
+
+
+def normalize_zips(zips):
+    """
+    Numeric truncate_zip: the first 5 digits of every Zip, as float numbers.
+
+    Whole non-negative numbers are truncated arithmetically, by the power of ten that
+    leaves 5 digits, so no string is made for them. The few other values (fractions,
+    negatives, text) go through the string truncation, and the result is then what
+    pd.to_numeric(truncate_zip(...), errors='coerce') gives, as step d reads it.
+
+    Args:
+        zips (Series): Zip column.
+    """
+    if not pd.api.types.is_numeric_dtype(zips) or pd.api.types.is_bool_dtype(zips):
+        return pd.to_numeric(_map_distinct(zips, _truncate_zip_values), errors='coerce')
+    values = zips.to_numpy(dtype='float64', na_value=np.nan)
+    whole = (values >= 0) & (values < _ZIP_POWERS[-1]) & (np.floor(values) == values)
+    digits = np.searchsorted(_ZIP_POWERS, values[whole], side='right')
+    result = values.copy()
+    result[whole] = values[whole] // _ZIP_POWERS[np.maximum(digits - 5, 0)]
+    other = ~whole & ~np.isnan(values)
+    if other.any():
+        result[other] = pd.to_numeric(_truncate_zip_values(zips[other]), errors='coerce').to_numpy()
+    return pd.Series(result, index=zips.index, name=zips.name)
+
+
+def normalize_zip(df):
+    df['Zip'] = normalize_zips(df['Zip'])
+    return df
+
+
+# d. In the zip column, populate all the empty cells with the mean value of the zip column
+def fill_zip_mean(df, zip_mean=None, dtype=int):
+    """
+    Args:
+        zip_mean (int, optional): Mean to fill with. Computed from df when not given;
+            streaming mode passes the mean of the whole file.
+        dtype (optional): dtype of the filled Zip column; the compact schema uses 'Int32'.
+    """
+    # First convert to numeric, handling non-numeric values
+    df['Zip'] = pd.to_numeric(df['Zip'], errors='coerce')
+    if zip_mean is None:
+        zip_mean = int(df['Zip'].mean())
+    df['Zip'] = df['Zip'].fillna(zip_mean).astype(dtype)
+    return df
+
+
+# Columns whose groups step d takes the median Zip of, with zip_fill='median'
+ZIP_GROUPS = ('City', 'State')
+
+
+def fill_zip_median(df, medians=None, fallback=None, by=ZIP_GROUPS, dtype=int):
+    """
+    Alternative to step d: fills each empty Zip with the median Zip of its City and State.
+
+    The medians come from one groupby-transform over the frame, or from medians (see
+    zip_medians) in streaming mode. Rows of a group with no Zip at all get the fallback,
+    the step d mean. Missing cities and states form groups of their own.
+
+    Args:
+        medians (DataFrame, optional): The by columns and a 'median' column, one row per group.
+        fallback (int, optional): Zip for groups without a median. Defaults to the mean of df.
+        by (tuple, optional): Columns to group by.
+        dtype (optional): dtype of the filled Zip column; the compact schema uses 'Int32'.
+    """
+    zips = pd.to_numeric(df['Zip'], errors='coerce')
+    if fallback is None:
+        fallback = int(zips.mean())
+    if medians is None:
+        group_medians = zips.groupby([df[column] for column in by], dropna=False, observed=True,
+                                     sort=False).transform('median')
+    else:
+        keys = df[list(by)].astype(object)
+        group_medians = pd.Series(keys.merge(medians, how='left', on=list(by))['median'].to_numpy(),
+                                  index=df.index)
+    # A median between two Zips is cut to a whole Zip, as int() does with the mean
+    df['Zip'] = zips.fillna(np.floor(group_medians)).fillna(fallback).astype(dtype)
+    return df
+
+
+def zip_group_counts(df, by=ZIP_GROUPS):
+    """How many rows of each group have each numeric Zip, as by columns, 'Zip' and 'rows'."""
+    zips = pd.to_numeric(df['Zip'], errors='coerce')
+    keys = df[list(by)].astype(object)[zips.notna()]
+    keys['Zip'] = zips[zips.notna()]
+    return keys.groupby(list(keys.columns), dropna=False, sort=False).size().rename('rows').reset_index()
+
+
+def medians_from_counts(counts, by=ZIP_GROUPS):
+    """
+    The median Zip of each group from zip_group_counts, added up over any number of chunks.
+
+    Returns:
+        DataFrame: The by columns and a 'median' column, as fill_zip_median takes them.
+    """
+    by = list(by)
+    counts = counts.groupby(by + ['Zip'], dropna=False, sort=False)['rows'].sum().reset_index()
+    counts = counts.sort_values(by + ['Zip'], ignore_index=True)
+    groups = counts.groupby(by, dropna=False, sort=False)['rows']
+    seen = groups.cumsum()
+    before = seen - counts['rows']
+    total = groups.transform('sum')
+    # The middle row, or the two middle rows, of each group in Zip order
+    low, high = (total - 1) // 2, total // 2
+    counts['low'] = counts['Zip'].where((before <= low) & (low < seen))
+    counts['high'] = counts['Zip'].where((before <= high) & (high < seen))
+    middles = counts.groupby(by, dropna=False, sort=False)[['low', 'high']].first()
+    return ((middles['low'] + middles['high']) / 2).rename('median').reset_index()
+
+
+# e. In the city column, replace all instances of Winston Salem with the right capitalization
+CITY_FIXES = {
+    'Winston Salem': 'Winston-Salem',
+    'Winston-salem': 'Winston-Salem',
+    'Winston salem': 'Winston-Salem',
+    'winston salem': 'Winston-Salem',
+    'winston-salem': 'Winston-Salem',
+}
+
+
+def load_city_fixes(path, base=CITY_FIXES):
+    """
+    Loads extra City fixes from a CSV file with 'variant' and 'canonical' columns.
+
+    Args:
+        path (str): Path to the CSV file.
+        base (dict, optional): Fixes the file adds to; a variant in the file overrides it.
+
+    Returns:
+        dict: Variant to canonical name.
+    """
+    table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    fixes = dict(base)
+    fixes.update(zip(table['variant'], table['canonical']))
+    return fixes
+
+
+# f. In the city column, remove every abbreviation and leave the cells empty
+def blank_abbreviation(cities):
+    # Assuming abbreviations are single letters (like 'G' in row 6)
+    return cities.mask(cities.str.strip().str.len() == 1, '')
+
+
+CITY_RULES = (blank_abbreviation,)
+
+
+def canonicalize_cities(cities, fixes=CITY_FIXES, rules=CITY_RULES):
+    """
+    Applies the City fixes and rules to the distinct values of a column only.
+
+    Every variant found inside a value is replaced by its canonical name in one regex
+    pass, then each rule runs on the Series of fixed values. The results are mapped back
+    to the rows, so the cost grows with the number of distinct cities, not with the rows.
+    Non-string values become NaN, as they do under Series.str. A categorical column stays
+    categorical.
+
+    Args:
+        cities (Series): City column.
+        fixes (dict, optional): Variant to canonical name.
+        rules (tuple, optional): Functions from a Series of cities to the fixed Series.
+    """
+    return _map_distinct(cities, lambda values: _fix_city_values(values, fixes, rules))
+
+
+def _fix_city_values(values, fixes, rules):
+    values = values.where(values.map(lambda v: isinstance(v, str)))
+    if fixes:
+        # Longest variants first, so a variant is never cut short by one it contains
+        variants = sorted(fixes, key=len, reverse=True)
+        pattern = re.compile('|'.join(re.escape(v) for v in variants))
+        values = values.str.replace(pattern, lambda m: fixes[m.group(0)], regex=True)
+    for rule in rules:
+        values = rule(values)
+    return values
+
+
+def fix_city_spellings(df, fixes=CITY_FIXES):
+    df['City'] = canonicalize_cities(df['City'], fixes, rules=())
+    return df
+
+
+def remove_city_abbreviations(df):
+    df['City'] = canonicalize_cities(df['City'], fixes={})
+    return df
+
+
+# e + f in a single pass over the distinct cities
+def fix_cities(df, fixes=CITY_FIXES, rules=CITY_RULES):
+    df['City'] = canonicalize_cities(df['City'], fixes, rules)
+    return df
+
+
+# g. In the state column, replace every abbreviation with the full state names
+def expand_state_abbr(df):
+    df['State'] = _map_distinct(df['State'], lambda states: states.replace(STATE_ABBR))
+    return df
+
+
+# h. Under the state column, replace all the empty cells with state names in alphabetical order
+def fill_empty_states(df, start=0):
+    """
+    Args:
+        start (int, optional): How many empty states came before this frame, so that
+            streaming mode carries on the alphabetical cycle where the last chunk left it.
+    """
+    empty = df['State'].isna()
+    empty_state_count = int(empty.sum())
+    positions = (start + np.arange(empty_state_count)) % len(STATES_ORDERED)
+    if empty_state_count:
+        df['State'] = _fill_category(df['State'], STATES_ORDERED)
+    df.loc[empty, 'State'] = [STATES_ORDERED[i] for i in positions]
+    return df
+
+
+# i. Reformat the dates in the birthday column to the proper format
+def reformat_date(date_str):
+    if pd.isna(date_str):
+        return np.nan
+    try:
+        # Try parsing with different formats
+        for fmt in DATE_FORMATS:
+            try:
+                dt = datetime.strptime(str(date_str), fmt)
+                return dt.strftime('%Y-%m-%d')
+            except ValueError:
+                continue
+        return np.nan
+    except:
+        return np.nan
+
+
+def normalize_dates(dates, formats=DATE_FORMATS, output_format='%Y-%m-%d', as_date=False, weights=None):
+    """
+    Vectorized reformat_date: reformats a whole column of date strings to output_format.
+
+    Each distinct raw value is parsed only once. The formats are tried one at a time over
+    the whole set of values, and each pass only retries the values still unparsed. Missing
+    values and values no format matches become NaN, as with reformat_date.
+
+    Args:
+        dates (Series): Raw date values.
+        formats (tuple, optional): strptime formats, in the order they are tried.
+        output_format (str, optional): strftime format of the result.
+        as_date (bool, optional): Return native dates instead of output_format strings.
+        weights (array, optional): Rows each value of dates stands for, when dates holds
+            distinct values only; the format counts are then counted in those rows.
+
+    Returns:
+        tuple: (Series of reformatted dates, dict of rows matched per format)
+    """
+    if as_date:
+        output_format = '%Y-%m-%d'  # the day strings numpy turns into dates
+    codes, uniques = pd.factorize(dates)  # missing values get code -1
+    raw = pd.Series(uniques.astype(str), dtype=object)
+    reformatted = pd.Series(np.nan, index=raw.index, dtype=object)
+    matched_by = np.full(len(raw), -1)
+
+    remaining = raw.index.to_numpy()
+    for i, fmt in enumerate(formats):
+        if not len(remaining):
+            break
+        parsed = pd.to_datetime(raw.iloc[remaining], format=fmt, errors='coerce')
+        hit = parsed.notna().to_numpy()
+        reformatted.iloc[remaining[hit]] = parsed[hit].dt.strftime(output_format)
+        matched_by[remaining[hit]] = i
+        remaining = remaining[~hit]
+
+    # Dates outside pandas' Timestamp range only parse through strptime; the values left
+    # are the few distinct ones no format matched, so retry them one by one
+    for position in remaining:
+        for i, fmt in enumerate(formats):
+            try:
+                dt = datetime.strptime(raw.iat[position], fmt)
+            except ValueError:
+                continue
+            reformatted.iat[position] = dt.date().isoformat() if as_date else dt.strftime(output_format)
+            matched_by[position] = i
+            break
+
+    present = codes >= 0
+    if as_date:
+        days = reformatted.fillna('NaT').to_numpy().astype('datetime64[D]')
+        result = np.full(len(codes), np.datetime64('NaT'), dtype='datetime64[D]')
+        result[present] = days[codes[present]]
+    else:
+        result = np.full(len(codes), np.nan, dtype=object)
+        result[present] = reformatted.to_numpy()[codes[present]]
+
+    rows_per_value = np.bincount(codes[present], minlength=len(raw),
+                                 weights=None if weights is None else np.asarray(weights)[present])
+    format_counts = {fmt: int(rows_per_value[matched_by == i].sum()) for i, fmt in enumerate(formats)}
+    return pd.Series(result, index=dates.index, name=dates.name), format_counts
+
+
+def reformat_birthdates(df, format_counts=None, as_date=False):
+    """
+    Args:
+        format_counts (dict, optional): Rows matched per date format are added to it.
+        as_date (bool, optional): Store native dates instead of 'YYYY-MM-DD' strings.
+    """
+    df['Birthdate'], counts = normalize_dates(df['Birthdate'], as_date=as_date)
+    if format_counts is not None:
+        for fmt, rows in counts.items():
+            format_counts[fmt] = format_counts.get(fmt, 0) + rows
+    return df
+
+
+# j. Replace all the empty cells in the birthday column with random birth dates
+def random_date(start_year=1950, end_year=2005):
+    year = random.randint(start_year, end_year)
+    month = random.randint(1, 12)
+    day = random.randint(1, 28)  # Simple approach to avoid invalid dates
+    return f"{year}-{month:02d}-{day:02d}"
+
+
+def random_dates(n, rng=None, start_year=1950, end_year=2005, as_date=False):
+    """
+    Vectorized random_date: n random dates drawn in one go from a NumPy generator.
+
+    Each date is a single draw, so splitting the same n dates over several calls on one
+    generator (as streaming mode does) gives the same dates as one call.
+
+    Args:
+        n (int): Number of dates.
+        rng (Generator, optional): np.random.default_rng(seed) for repeatable dates.
+        start_year (int, optional): First possible year.
+        end_year (int, optional): Last possible year.
+        as_date (bool, optional): Return datetime64[D] values instead of 'YYYY-MM-DD' strings.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    draws = rng.integers(0, (end_year - start_year + 1) * 12 * 28, size=n)
+    year, draws = np.divmod(draws, 12 * 28)
+    month, day = np.divmod(draws, 28)  # days stop at 28 to avoid invalid dates
+    dates = ((start_year - 1970 + year).astype('datetime64[Y]').astype('datetime64[M]')
+             + month.astype('timedelta64[M]')).astype('datetime64[D]') + day.astype('timedelta64[D]')
+    if as_date:
+        return dates
+    return np.datetime_as_string(dates, unit='D').astype(object)
+
+
+def fill_empty_birthdates(df, rng=None):
+    """
+    Args:
+        rng (Generator, optional): Generator for the random dates; seed it for repeatable output.
+    """
+    empty = df['Birthdate'].isna()
+    as_date = pd.api.types.is_datetime64_any_dtype(df['Birthdate'])
+    df.loc[empty, 'Birthdate'] = random_dates(int(empty.sum()), rng, as_date=as_date)
+    return df
+
+
+# k. In the zip column, delete every row with numbers less than 5
+def drop_small_zips(df):
+    # A shallow copy, so later steps assign columns on a frame of their own
+    return df[df['Zip'] >= 5].copy(deep=False)
+
+
+# l. In the city column, populate all the empty cells with Thomasville
+def fill_empty_cities(df):
+    df['City'] = _fill_category(df['City'], ['Thomasville']).fillna('Thomasville')
+    return df
+
+
+class Step:
+    """
+    One step of a CleaningPlan.
+
+    Args:
+        name (str): Step letter, used to enable or disable it.
+        func: What the step does, by kind:
+            'map'    - func(values, context) fixes a Series of the distinct values of column.
+            'filter' - func(df, context) returns the mask of rows to keep.
+            'drop'   - none; the step drops the columns in writes.
+            'frame'  - func(df, context) returns the cleaned DataFrame.
+        kind (str, optional): One of the kinds above.
+        column (str, optional): The column a 'map' step fixes.
+        reads (tuple, optional): Columns the step reads.
+        writes (tuple, optional): Columns the step changes or drops.
+        uses (tuple, optional): Context keys the step's result depends on.
+    """
+
+    def __init__(self, name, func=None, kind='frame', column=None, reads=(), writes=(), uses=()):
+        self.name = name
+        self.func = func
+        self.kind = kind
+        self.column = column
+        self.reads = tuple(reads) or ((column,) if column else ())
+        self.writes = tuple(writes) or ((column,) if column else ())
+        self.uses = tuple(uses)
+
+    def __repr__(self):
+        return f"Step({self.name!r}, kind={self.kind!r})"
+
+    def run(self, df, context):
+        if self.kind == 'map':
+            df[self.column] = _map_distinct(df[self.column], lambda values: self.func(values, context))
+            return df
+        if self.kind == 'filter':
+            # A shallow copy, so later steps assign columns on a frame of their own
+            return df[self.func(df, context)].copy(deep=False)
+        if self.kind == 'drop':
+            return df.drop(columns=list(self.writes), errors='ignore')
+        return self.func(df, context)
+
+
+def _fused_map(steps):
+    """Runs consecutive 'map' steps on one column as a single pass over its distinct values."""
+    def fix(values, context):
+        for step in steps:
+            values = step.func(values, context)
+        return values
+    uses = tuple(dict.fromkeys(key for step in steps for key in step.uses))
+    return Step('+'.join(step.name for step in steps), fix, kind='map', column=steps[0].column, uses=uses)
+
+
+class CleaningPlan:
+    """
+    Steps a-l as data, with an executor that can reorder and fuse them.
+
+    Every step can be switched off on its own, e.g. plan.disable('c', 'd') for a run with
+    those steps commented out. Running state such as the step d mean, the step h position in
+    the state cycle and the step j generator lives in a context dict, which streaming mode
+    keeps from one chunk to the next.
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.enabled = {step.name for step in self.steps}
+
+    def enable(self, *names):
+        self.enabled.update(names)
+        return self
+
+    def disable(self, *names):
+        self.enabled.difference_update(names)
+        return self
+
+    def add(self, step, before=None):
+        """Adds step, enabled, before the step named before, or last."""
+        names = [existing.name for existing in self.steps]
+        self.steps.insert(names.index(before) if before is not None else len(self.steps), step)
+        self.enabled.add(step.name)
+        return self
+
+    def compile(self, optimize=True):
+        """
+        The steps to run, in order.
+
+        With optimize, each row filter moves up to just after the last step that writes a
+        column it reads, so the steps in between see fewer rows, and consecutive 'map' steps
+        on the same column are fused into one pass. Steps h and j then only number or draw
+        for the rows that survive the filter, which changes which alphabetical state and
+        random date those rows get compared with optimize=False.
+        """
+        steps = [step for step in self.steps if step.name in self.enabled]
+        if not optimize:
+            return steps
+
+        for step in [step for step in steps if step.kind == 'filter']:
+            position = steps.index(step)
+            target = position
+            while target > 0 and not set(step.reads) & set(steps[target - 1].writes):
+                target -= 1
+            steps.insert(target, steps.pop(position))
+
+        groups = []
+        for step in steps:
+            last = groups[-1][-1] if groups else None
+            if step.kind == 'map' and last is not None and last.kind == 'map' and last.column == step.column:
+                groups[-1].append(step)
+            else:
+                groups.append([step])
+        return [group[0] if len(group) == 1 else _fused_map(group) for group in groups]
+
+    def dropped_columns(self):
+        """Columns the plan drops before anything reads them, which need not be loaded at all."""
+        dropped = set()
+        read = set()
+        for step in self.steps:
+            if step.name not in self.enabled:
+                continue
+            if step.kind == 'drop':
+                dropped.update(column for column in step.writes if column not in read)
+            read.update(step.reads)
+        return dropped
+
+    def usecols(self):
+        """A pd.read_csv usecols argument that skips dropped_columns."""
+        dropped = self.dropped_columns()
+        return lambda column: column not in dropped
+
+    def run(self, df, context=None, optimize=True, profiler=None):
+        """
+        Runs the enabled steps on one DataFrame.
+
+        Args:
+            df (DataFrame): Raw RewardsData rows.
+            context (dict, optional): Running state, see clean_rewards. Updated in place.
+            optimize (bool, optional): Reorder and fuse steps, see compile.
+            profiler (StepProfiler, optional): Records what each step costs, see step_profiler.py.
+        """
+        if context is None:
+            context = {}
+        for step in self.compile(optimize):
+            df = step.run(df, context) if profiler is None else profiler.run_step(step, df, context)
+        return df
+
+
+def _fill_zip_mean_step(df, context):
+    return fill_zip_mean(df, context.get('zip_mean'), 'Int32' if context.get('compact') else int)
+
+
+def _fill_zip_median_step(df, context):
+    return fill_zip_median(df, context.get('zip_medians'), context.get('zip_mean'),
+                           dtype='Int32' if context.get('compact') else int)
+
+
+def _fill_empty_states_step(df, context):
+    start = context.get('state_start', 0)
+    empty_state_count = int(df['State'].isna().sum())
+    df = fill_empty_states(df, start)
+    context['state_start'] = start + empty_state_count
+    return df
+
+
+def default_plan(zip_fill='mean'):
+    """
+    A new CleaningPlan of steps a-l, all enabled.
+
+    Args:
+        zip_fill (str, optional): 'mean' fills empty Zips with the mean, as step d says;
+            'median' fills them with the median Zip of their City and State instead
+            (fill_zip_median), so step d moves after the City and State steps e-h.
+    """
+    if zip_fill == 'median':
+        fill_zip = Step('d', _fill_zip_median_step, reads=('Zip',) + ZIP_GROUPS, writes=('Zip',),
+                        uses=('zip_medians', 'zip_mean', 'compact'))
+    elif zip_fill == 'mean':
+        fill_zip = Step('d', _fill_zip_mean_step, reads=('Zip',), writes=('Zip',), uses=('zip_mean', 'compact'))
+    else:
+        raise ValueError(f"zip_fill must be 'mean' or 'median', not {zip_fill!r}.")
+    steps = [
+        Step('a', kind='drop', writes=('Tags',)),
+        Step('b', lambda df, context: fill_row_438_zip(df), reads=('Zip',), writes=('Zip',)),
+        Step('c', lambda df, context: normalize_zip(df), reads=('Zip',), writes=('Zip',)),
+        fill_zip,
+        Step('e', lambda cities, context: _fix_city_values(cities, context.get('city_fixes', CITY_FIXES), ()),
+             kind='map', column='City', uses=('city_fixes',)),
+        Step('f', lambda cities, context: _fix_city_values(cities, {}, CITY_RULES), kind='map', column='City'),
+        Step('g', lambda states, context: states.replace(STATE_ABBR), kind='map', column='State'),
+        Step('h', _fill_empty_states_step, reads=('State',), writes=('State',), uses=('state_start',)),
+        Step('i', lambda df, context: reformat_birthdates(df, context.get('format_counts'),
+                                                          as_date=context.get('compact', False)),
+             reads=('Birthdate',), writes=('Birthdate',), uses=('compact',)),
+        Step('j', lambda df, context: fill_empty_birthdates(df, context.get('rng')),
+             reads=('Birthdate',), writes=('Birthdate',), uses=('rng',)),
+        Step('k', lambda df, context: df['Zip'] >= 5, kind='filter', reads=('Zip',)),
+        Step('l', lambda df, context: fill_empty_cities(df), reads=('City',), writes=('City',)),
+    ]
+    if zip_fill == 'median':
+        steps.insert(7, steps.pop(3))  # d moves from after c to after h
+    return CleaningPlan(steps)
+
+
+def clean_rewards(df, zip_mean=None, state_start=0, format_counts=None, rng=None,
+                  city_fixes=CITY_FIXES, compact=False, plan=None, optimize=True, profiler=None,
+                  quarantine=None):
+    """
+    Runs steps a-l on one DataFrame.
+
+    Args:
+        df (DataFrame): Raw RewardsData rows.
+        zip_mean (int, optional): Mean for step d. Defaults to the mean of df.
+        state_start (int, optional): Position in the alphabetical state cycle for step h.
+        format_counts (dict, optional): Collects the rows each Birthdate format matched.
+        rng (Generator, optional): Generator for the step j random birthdates.
+        city_fixes (dict, optional): City variant to canonical name, for step e.
+        compact (bool, optional): Keep Zip as Int32 and Birthdate as native dates.
+        plan (CleaningPlan, optional): Steps to run. Defaults to default_plan().
+        optimize (bool, optional): Reorder and fuse steps, see CleaningPlan.compile.
+        profiler (StepProfiler, optional): Records what each step costs, see step_profiler.py.
+        quarantine (Quarantine, optional): Gets the rows a validation step sets aside, see
+            rewards_validation.py.
+    """
+    if plan is None:
+        plan = default_plan()
+    context = {'zip_mean': zip_mean, 'state_start': state_start, 'format_counts': format_counts,
+               'rng': rng, 'city_fixes': city_fixes, 'compact': compact, 'quarantine': quarantine}
+    return plan.run(df, context, optimize, profiler)
+
+
+def _common_dtype(dtypes):
+    """The dtype a whole-file read gives a column that the chunks read as dtypes."""
+    dtypes = set(dtypes)
+    if len(dtypes) == 1:
+        return dtypes.pop()
+    if all(pd.api.types.is_numeric_dtype(d) and not pd.api.types.is_bool_dtype(d) for d in dtypes):
+        return np.dtype('float64')
+    return np.dtype('object')
+
+
+def _zip_steps(plan):
+    """The enabled steps before d that change the Zips it takes the mean of, or drop rows."""
+    names = [step.name for step in plan.steps]
+    return [step for step in plan.steps[:names.index('d') if 'd' in names else len(names)]
+            if step.name in plan.enabled and ('Zip' in step.writes or step.kind == 'filter')]
+
+
+def _zip_totals(chunk, plan):
+    """Sum and count of the numeric Zip values in a raw chunk, after the _zip_steps of plan."""
+    for step in _zip_steps(plan):
+        chunk = step.run(chunk, {})
+    zips = pd.to_numeric(chunk['Zip'], errors='coerce').dropna()
+    # Zips are whole numbers, so integer running sums give exactly pandas' mean
+    return int(zips.sum()), len(zips)
+
+
+def zip_totals(csv_file_path, chunksize=CHUNKSIZE, plan=None):
+    """
+    Sum and count of the numeric Zip values in a file, reading only the columns the steps
+    before d that count need.
+
+    Totals from several files add up to the step d mean of all of them (see zip_mean_of).
+    """
+    if plan is None:
+        plan = default_plan()
+    zip_sum = 0
+    zip_count = 0
+    columns = {'Zip'}.union(*(step.reads for step in _zip_steps(plan)))
+    for chunk in pd.read_csv(csv_file_path, chunksize=chunksize, usecols=lambda column: column in columns):
+        chunk_sum, chunk_count = _zip_totals(chunk, plan)
+        zip_sum += chunk_sum
+        zip_count += chunk_count
+    return zip_sum, zip_count
+
+
+def zip_mean_of(zip_sum, zip_count):
+    """The step d mean, int(mean), from Zip totals."""
+    if not zip_count:
+        raise ValueError("Zip column has no numeric values to take the mean of.")
+    return int(zip_sum / zip_count)
+
+
+def scan_rewards_csv(csv_file_path, chunksize=CHUNKSIZE, plan=None):
+    """
+    Cheap first pass over RewardsData.csv for the values streaming mode needs up front.
+
+    Args:
+        csv_file_path (str): Path to the raw CSV file.
+        chunksize (int, optional): Rows per chunk.
+        plan (CleaningPlan, optional): Steps b and c only count towards the mean if enabled.
+
+    Returns:
+        tuple: (zip_mean, dtypes) - the step d mean over the whole file (None if it has no
+            numeric Zip), and one dtype per column so every chunk is written the same way a
+            whole-file read would be.
+    """
+    if plan is None:
+        plan = default_plan()
+    zip_sum = 0
+    zip_count = 0
+    chunk_dtypes = {}
+    for chunk in pd.read_csv(csv_file_path, chunksize=chunksize, usecols=plan.usecols()):
+        for column, dtype in chunk.dtypes.items():
+            chunk_dtypes.setdefault(column, []).append(dtype)
+        chunk_sum, chunk_count = _zip_totals(chunk, plan)
+        zip_sum += chunk_sum
+        zip_count += chunk_count
+
+    zip_mean = zip_mean_of(zip_sum, zip_count) if zip_count else None
+    dtypes = {column: _common_dtype(seen) for column, seen in chunk_dtypes.items()}
+    return zip_mean, dtypes
+
+
+def zip_medians(csv_file_path, chunksize=CHUNKSIZE, plan=None, context=None, optimize=True, dtypes=None):
+    """
+    First pass for zip_fill='median' in streaming mode: the median Zip of every group.
+
+    The steps before d run on each chunk, on a copy of the context, and the Zips of each
+    group are counted; the medians then come from the counts of the whole file, so the
+    chunks are filled exactly as fill_zip_median would fill the whole file.
+
+    Returns:
+        DataFrame: The ZIP_GROUPS columns and a 'median' column, for fill_zip_median.
+    """
+    if plan is None:
+        plan = default_plan(zip_fill='median')
+    steps = plan.compile(optimize)
+    before_d = steps[:[step.name for step in steps].index('d')]
+    context = dict(context or {}, format_counts=None, quarantine=None)
+    counts = None
+    for chunk in pd.read_csv(csv_file_path, chunksize=chunksize, dtype=dtypes, usecols=plan.usecols()):
+        for step in before_d:
+            chunk = step.run(chunk, context)
+        chunk_counts = zip_group_counts(chunk)
+        if counts is not None:
+            chunk_counts = pd.concat([counts, chunk_counts], ignore_index=True)
+        columns = list(ZIP_GROUPS) + ['Zip']
+        counts = chunk_counts.groupby(columns, dropna=False, sort=False)['rows'].sum().reset_index()
+    return medians_from_counts(counts)
+
+
+# Cleaned output formats, by file extension. Parquet and Feather (Arrow IPC) keep the column
+# types, so readers of the cleaned data skip parsing text and inferring types again.
+OUTPUT_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+
+# Columns stored as Arrow dates: native dates, and the 'YYYY-MM-DD' text of step i
+DATE_COLUMNS = ('Birthdate',)
+
+
+def output_format(path):
+    """The cleaned file format for a path: 'csv', 'parquet' or 'feather'."""
+    return OUTPUT_FORMATS.get(os.path.splitext(path)[1].lower(), 'csv')
+
+
+def _to_arrow(df, schema=None, date_columns=DATE_COLUMNS):
+    """
+    A pyarrow Table of df, cast to schema if given. Otherwise the date_columns become
+    Arrow dates when they hold datetimes or ISO date strings; text in other formats stays
+    text.
+    """
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if schema is not None:
+        return table.cast(schema)
+    for i, field in enumerate(table.schema):
+        if field.name not in date_columns:
+            continue
+        if pa.types.is_timestamp(field.type) or pa.types.is_string(field.type):
+            try:
+                dates = table.column(i).cast(pa.date32())
+            except pa.ArrowInvalid:
+                continue  # not all ISO dates, e.g. with step i left out
+            table = table.set_column(i, field.with_type(pa.date32()), dates)
+    return table
+
+
+class CleanedWriter:
+    """
+    Writes cleaned chunks to one CSV, Parquet or Feather file, picked by the file extension.
+
+    Feather files are written uncompressed, so read_cleaned can memory-map them without
+    copying. Every chunk is cast to the schema of the first one.
+
+    Args:
+        output_path (str): Path of the file; .parquet and .feather write those formats.
+        date_columns (tuple, optional): Columns stored as Arrow dates, see _to_arrow.
+    """
+
+    def __init__(self, output_path, date_columns=DATE_COLUMNS):
+        self.output_path = output_path
+        self.date_columns = date_columns
+        self.format = output_format(output_path)
+        self.rows = 0
+        self._started = False
+        self._writer = None
+        self._schema = None
+
+    def write(self, df):
+        if self.format == 'csv':
+            df.to_csv(self.output_path, mode='a' if self._started else 'w', header=not self._started,
+                      index=False)
+        else:
+            self._write_arrow(df)
+        self._started = True
+        self.rows += len(df)
+
+    def _write_arrow(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = _to_arrow(df, self._schema, self.date_columns)
+        if self._writer is None:
+            fields = []
+            for field in table.schema:
+                if pa.types.is_null(field.type):
+                    # A column that is all-null in the first chunk is text in the later ones
+                    field = field.with_type(pa.string())
+                elif pa.types.is_dictionary(field.type) and self.format == 'feather':
+                    # IPC files allow one dictionary per column, but each chunk has its own
+                    field = field.with_type(field.type.value_type)
+                elif pa.types.is_dictionary(field.type):
+                    # Parquet keeps a dictionary per row group, but a later chunk can have
+                    # more categories than the first one's index type holds
+                    field = field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+                fields.append(field)
+            self._schema = pa.schema(fields)
+            table = table.cast(self._schema)
+            if self.format == 'parquet':
+                self._writer = pq.ParquetWriter(self.output_path, self._schema)
+            else:
+                self._writer = pa.ipc.new_file(self.output_path, self._schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_cleaned(df, output_path):
+    """Writes a cleaned DataFrame as CSV, Parquet or Feather, picked by the file extension."""
+    fmt = output_format(output_path)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(_to_arrow(df), output_path)
+    elif fmt == 'feather':
+        import pyarrow.feather as feather
+        feather.write_feather(_to_arrow(df), output_path, compression='uncompressed')
+    else:
+        df.to_csv(output_path, index=False)
+
+
+def read_cleaned_table(path, memory_map=True):
+    """
+    Reads a cleaned Parquet or Feather file as a pyarrow Table, with its stored types.
+
+    Args:
+        path (str): Path of the cleaned file.
+        memory_map (bool, optional): Memory-map the file instead of reading it into memory.
+            For uncompressed Feather files the columns then point straight into the map.
+    """
+    fmt = output_format(path)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_table(path, memory_map=memory_map)
+    if fmt == 'feather':
+        import pyarrow.feather as feather
+        return feather.read_table(path, memory_map=memory_map)
+    raise ValueError(f"'{path}' is not a Parquet or Feather file.")
+
+
+def read_cleaned(path, memory_map=True):
+    """Reads a cleaned file back into a DataFrame; only CSV files are parsed as text."""
+    if output_format(path) == 'csv':
+        return pd.read_csv(path)
+    return read_cleaned_table(path, memory_map).to_pandas(date_as_object=False)
+
+
+def clean_rewards_csv_chunked(csv_file_path, output_path, chunksize=CHUNKSIZE, format_counts=None,
+                              seed=None, city_fixes=CITY_FIXES, compact=False, plan=None,
+                              optimize=True, zip_mean=None, rng=None, profiler=None, quarantine=None):
+    """
+    Streaming mode: runs steps a-l on bounded chunks and appends them to the cleaned file.
+
+    Peak memory is set by chunksize instead of the file size. The Zip mean of step d comes
+    from a first pass (scan_rewards_csv), and the step h state cycle and step j generator
+    carry on from chunk to chunk, so the output matches clean_rewards on the whole file.
+
+    Args:
+        csv_file_path (str): Path to the raw CSV file.
+        output_path (str): Path of the cleaned file; .parquet and .feather write those formats.
+        chunksize (int, optional): Rows per chunk.
+        format_counts (dict, optional): Collects the rows each Birthdate format matched.
+        seed (int, optional): Seed for the step j random birthdates.
+        city_fixes (dict, optional): City variant to canonical name, for step e.
+        compact (bool, optional): Clean with the compact schema (see COMPACT_DTYPES).
+        plan (CleaningPlan, optional): Steps to run. Defaults to default_plan().
+        optimize (bool, optional): Reorder and fuse steps, see CleaningPlan.compile.
+        zip_mean (int, optional): Step d mean to use instead of the mean of this file.
+        rng (Generator, optional): Generator for step j, instead of one seeded with seed.
+        profiler (StepProfiler, optional): Records what each step costs on each chunk.
+        quarantine (Quarantine, optional): Gets the rows a validation step sets aside.
+
+    Returns:
+        int: Number of rows written.
+    """
+    if plan is None:
+        plan = default_plan()
+    file_zip_mean, dtypes = scan_rewards_csv(csv_file_path, chunksize, plan)
+    if zip_mean is None:
+        if file_zip_mean is None and 'd' in plan.enabled:
+            raise ValueError(f"Zip column of '{csv_file_path}' has no numeric values to take the mean of.")
+        zip_mean = file_zip_mean
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    if compact:
+        dtypes.update({column: dtype for column, dtype in COMPACT_DTYPES.items() if column in dtypes})
+    context = {'zip_mean': zip_mean, 'state_start': 0, 'format_counts': format_counts,
+               'rng': rng, 'city_fixes': city_fixes, 'compact': compact, 'quarantine': quarantine}
+    if 'd' in plan.enabled and any(step.func is _fill_zip_median_step for step in plan.steps):
+        context['zip_medians'] = zip_medians(csv_file_path, chunksize, plan, context, optimize, dtypes)
+
+    writer = CleanedWriter(output_path)
+    with writer:
+        for chunk in pd.read_csv(csv_file_path, chunksize=chunksize, dtype=dtypes, usecols=plan.usecols()):
+            writer.write(plan.run(chunk, context, optimize, profiler))
+    return writer.rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clean RewardsData.csv (steps a-l).")
+    parser.add_argument('csv_file_path', help="Raw RewardsData CSV file")
+    parser.add_argument('output_path', nargs='?', default='Cleaned_RewardsData.csv',
+                        help="Cleaned file; a .parquet or .feather extension writes that format")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="Stream the file in chunks of this many rows")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="Seed for the random birthdates, for repeatable output")
+    parser.add_argument('--city-fixes', default=None,
+                        help="CSV of extra City fixes with 'variant' and 'canonical' columns")
+    parser.add_argument('--compact', action='store_true',
+                        help="Use categoricals, Int32 Zip and native dates to save memory")
+    parser.add_argument('--skip', default='',
+                        help="Comma-separated steps to leave out, e.g. c,d")
+    parser.add_argument('--no-optimize', dest='optimize', action='store_false',
+                        help="Run the steps exactly in order a-l, without reordering or fusing")
+    parser.add_argument('--zip-fill', default='mean', choices=['mean', 'median'],
+                        help="Fill empty Zips with the mean, or the median Zip of their City and State")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Checkpoint every step here and resume from the last unchanged one "
+                             "(see step_cache.py; not used with --chunksize)")
+    parser.add_argument('--cache-max-mb', type=int, default=2048,
+                        help="Size of the step cache before least recently used entries are evicted")
+    parser.add_argument('--patches', default=None,
+                        help=f"CSV of corrections with '{PATCH_KEY}', 'column' and 'value' columns, "
+                             "applied to the raw rows before step a")
+    parser.add_argument('--unmatched-patches', default=None,
+                        help="Write the patches that match no row to this CSV file")
+    parser.add_argument('--zip-reference', default=None,
+                        help="ZIP reference file (zip_reference.py) to fill empty City and State values "
+                             "from the Zip before steps h and l")
+    parser.add_argument('--quarantine', default=None,
+                        help="Check the raw rows against the validation rules (rewards_validation.py) and write "
+                             "the ones that break a rule to this file instead of cleaning them")
+    parser.add_argument('--backend', default='pandas', choices=['pandas', 'polars'],
+                        help="Run the steps on pandas, or as one lazy streaming Polars query (rewards_polars.py)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Print the time, memory and rows of every step when done")
+    parser.add_argument('--profile-jsonl', default=None,
+                        help="Append a JSON line per step run to this file (implies --profile)")
+    parser.add_argument('--cprofile-step', default=None,
+                        help="Run this step under cProfile and print its statistics (implies --profile)")
+    parser.add_argument('--tracemalloc-step', default=None,
+                        help="Trace this step's Python allocations for their peak (implies --profile)")
+    args = parser.parse_args()
+    profiler = None
+    if args.profile or args.profile_jsonl or args.cprofile_step or args.tracemalloc_step:
+        from step_profiler import StepProfiler
+        profiler = StepProfiler(args.profile_jsonl, args.cprofile_step, args.tracemalloc_step)
+    city_fixes = load_city_fixes(args.city_fixes) if args.city_fixes else CITY_FIXES
+    plan = default_plan(args.zip_fill).disable(*[name.strip() for name in args.skip.split(',') if name.strip()])
+    patches = None
+    if args.patches:
+        if args.backend == 'polars':
+            parser.error("--patches runs on the pandas backend.")
+        patches = load_patches(args.patches)
+        plan.add(patch_step(patches), before='a')
+    if args.zip_reference:
+        if args.backend == 'polars':
+            parser.error("--zip-reference runs on the pandas backend.")
+        from zip_reference import ZipReference, zip_reference_step
+        # Just after step c, so only real Zips are looked up, not the step d fill
+        names = [step.name for step in plan.steps]
+        plan.add(zip_reference_step(ZipReference(args.zip_reference)), before=names[names.index('c') + 1])
+    quarantine = None
+    if args.quarantine:
+        if args.backend == 'polars' or args.cache_dir:
+            parser.error("--quarantine runs on the pandas backend and without --cache-dir.")
+        from rewards_validation import Quarantine, validation_step
+        plan.add(validation_step(), before='a')
+        quarantine = Quarantine(args.quarantine)
+
+    format_counts = {}
+    if args.backend == 'polars':
+        if args.chunksize or args.compact or args.cache_dir or profiler is not None:
+            parser.error("--backend polars streams by itself and has no --compact, --cache-dir or profiling.")
+        from rewards_polars import clean_rewards_polars
+        rows = clean_rewards_polars(args.csv_file_path, args.output_path, format_counts, args.seed, city_fixes,
+                                    plan, args.optimize)
+    elif args.chunksize:
+        rows = clean_rewards_csv_chunked(args.csv_file_path, args.output_path, args.chunksize,
+                                         format_counts=format_counts, seed=args.seed,
+                                         city_fixes=city_fixes, compact=args.compact, plan=plan,
+                                         optimize=args.optimize, profiler=profiler, quarantine=quarantine)
+    else:
+        if args.cache_dir:
+            from step_cache import StepCache, clean_rewards_cached
+            df = clean_rewards_cached(args.csv_file_path, StepCache(args.cache_dir, args.cache_max_mb << 20),
+                                      format_counts=format_counts, rng=np.random.default_rng(args.seed),
+                                      city_fixes=city_fixes, compact=args.compact, plan=plan,
+                                      optimize=args.optimize, profiler=profiler)
+        else:
+            df = read_rewards_csv(args.csv_file_path, args.compact, usecols=plan.usecols())
+            df = clean_rewards(df, format_counts=format_counts, rng=np.random.default_rng(args.seed),
+                               city_fixes=city_fixes, compact=args.compact, plan=plan,
+                               optimize=args.optimize, profiler=profiler, quarantine=quarantine)
+        write_cleaned(df, args.output_path)
+        rows = len(df)
+    print(f"Data cleaning complete. Saved {rows} rows to {args.output_path}")
+    for fmt, matched in format_counts.items():
+        print(f"Birthdate format {fmt}: {matched} rows")
+    if quarantine is not None:
+        quarantine.close()
+        print(f"Quarantined {quarantine.rows} rows to {args.quarantine}")
+        for name, broken in quarantine.rule_counts.items():
+            print(f"Rule {name}: {broken} rows")
+    if patches is not None:
+        unmatched = unmatched_patches(args.csv_file_path, patches)
+        overridden = overridden_patches(patches).index.difference(unmatched.index)
+        print(f"Applied {len(patches) - len(unmatched) - len(overridden)} of {len(patches)} patches; "
+              f"{len(unmatched)} match no row; {len(overridden)} are overridden by a later patch to the same cell.")
+        if len(unmatched):
+            print(unmatched.head(10).to_string(index=False))
+            if args.unmatched_patches:
+                unmatched.to_csv(args.unmatched_patches, index=False)
+    if profiler is not None:
+        profiler.print_summary()
+        profiler.print_cprofile()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+Duplicate customers: finds the records of one customer entered several times, and merges
+each such cluster of records into one by survivorship rules.
+
+    python rewards_dedupe.py Cleaned_RewardsData.csv Deduped_RewardsData.csv --clusters clusters.csv
+
+Records are only compared within a block: the same normalized first and last name and
+the same Zip prefix (blocking_keys). Within a block they are sorted, and each record is
+compared with the next window - 1 records only, so a block of any size costs linear
+time; blocks no bigger than the window are compared pair by pair. Two records match when
+the weights of the fields they share (MATCH_WEIGHTS) reach MATCH_THRESHOLD, and clusters
+are the connected groups of matches.
+
+A file is deduplicated in three passes, so memory stays bounded for any number of rows:
+the rows are split by block hash into bucket files, which keeps every block in one bucket;
+each bucket is clustered and its clusters merged; then the file is streamed again,
+dropping the merged-away records and putting the merged records in place of the first of
+their cluster. Only the clusters are kept between passes, and the rows keep their order.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from rewards_cleaning import CHUNKSIZE, CleanedWriter, _map_distinct
+
+# Weight of each field two records of one block share, and the total at which they match:
+# the same Email alone, or the same Birthdate and either the same Zip or the same City
+MATCH_WEIGHTS = {'Email': 3, 'Birthdate': 2, 'Zip': 1, 'City': 1}
+MATCH_THRESHOLD = 3
+
+# Records each record is compared with in its block, itself included, once with the block
+# sorted by each of SORT_KEYS; duplicates that differ in one key are still neighbours by another
+WINDOW = 10
+SORT_KEYS = ('Email', 'Birthdate')
+
+# How each column of a cluster's merged record is chosen from the cluster's records:
+#   'first' / 'last'  - the value of the earliest / latest record that has one
+#   'most_common'     - the most frequent value; ties go to the earliest record's
+#   'longest'         - the longest text; ties go to the earliest record's
+#   'min' / 'max' / 'sum' - of the numeric values
+# Columns not listed take the 'first' rule.
+SURVIVORSHIP = {
+    'CustomerID': 'min',
+    'FirstName': 'most_common',
+    'LastName': 'most_common',
+    'Email': 'most_common',
+    'City': 'most_common',
+    'State': 'most_common',
+    'Zip': 'most_common',
+    'Birthdate': 'most_common',
+    'Points': 'sum',
+}
+
+SURVIVORSHIP_RULES = ('first', 'last', 'most_common', 'longest', 'min', 'max', 'sum')
+
+# Buckets a file is split into; each is clustered in memory on its own
+BUCKETS = 16
+
+
+def normalize_text(values):
+    """Lowercase letters and digits only, on the distinct values; empty results are missing."""
+    def normalize(distinct):
+        distinct = distinct.astype(str).str.lower().str.replace(r'[^a-z0-9]', '', regex=True)
+        return distinct.where(distinct != '')
+    return _map_distinct(values, normalize)
+
+
+def _zip_numbers(zips):
+    return pd.to_numeric(zips, errors='coerce')
+
+
+def blocking_keys(df, name_columns=('FirstName', 'LastName'), zip_digits=3):
+    """
+    The block of every row, as a 64-bit hash of its normalized names and Zip prefix.
+
+    The hash depends on the values only, so chunks of one file hash alike. Rows without
+    a name get 0, and are never compared.
+    """
+    names = [normalize_text(df[column]) for column in name_columns]
+    key = names[0].fillna('')
+    for name in names[1:]:
+        key = key + ' ' + name.fillna('')
+    prefix = (_zip_numbers(df['Zip']) // 10 ** (5 - zip_digits)).astype('Int64').astype(str)
+    key = (key + ' ' + prefix).to_numpy(dtype=object)
+    blocks = pd.util.hash_array(key).view('int64')
+    nameless = np.logical_and.reduce([name.isna().to_numpy() for name in names])
+    blocks[nameless] = 0
+    return blocks
+
+
+def _field_codes(df, weights):
+    """Per field, a code per row that is equal for equal normalized values and -1 if missing."""
+    codes = {}
+    for column in weights:
+        if column not in df.columns:
+            continue
+        values = _zip_numbers(df[column]) if column == 'Zip' else normalize_text(df[column])
+        codes[column] = pd.factorize(values)[0]
+    return codes
+
+
+def matching_pairs(df, blocks, window=WINDOW, weights=None, threshold=MATCH_THRESHOLD):
+    """
+    The pairs of row positions in df that match, compared by sorted neighbourhood per block.
+
+    Each sort key of SORT_KEYS is one pass; a pair found by both passes is listed twice.
+
+    Returns:
+        tuple: (left, right) arrays of positions.
+    """
+    weights = MATCH_WEIGHTS if weights is None else weights
+    codes = _field_codes(df, weights)
+    left, right = [], []
+    for sort_key in [key for key in SORT_KEYS if key in codes] or [None]:
+        sort_by = codes[sort_key] if sort_key else np.zeros(len(df), dtype=np.int64)
+        order = np.lexsort((np.arange(len(df)), sort_by, blocks))
+        for offset in range(1, window):
+            a, b = order[:-offset], order[offset:]
+            same_block = (blocks[a] == blocks[b]) & (blocks[a] != 0)
+            a, b = a[same_block], b[same_block]
+            score = np.zeros(len(a))
+            for column, code in codes.items():
+                score += weights[column] * ((code[a] == code[b]) & (code[a] >= 0))
+            hit = score >= threshold
+            left.append(a[hit])
+            right.append(b[hit])
+    return np.concatenate(left), np.concatenate(right)
+
+
+def connected_components(n, left, right):
+    """
+    The component of each of n nodes joined by the edges (left, right), as its lowest node.
+
+    Union-find on arrays: each round hooks the larger root of every edge onto the smaller
+    one, then points every node straight at its root.
+    """
+    labels = np.arange(n)
+    while True:
+        low, high = labels[left], labels[right]
+        differ = low != high
+        if not differ.any():
+            return labels
+        roots = np.minimum(low[differ], high[differ])
+        np.minimum.at(labels, np.maximum(low[differ], high[differ]), roots)
+        while True:
+            jumped = labels[labels]
+            if (jumped == labels).all():
+                break
+            labels = jumped
+
+
+def find_duplicate_clusters(df, window=WINDOW, weights=None, threshold=MATCH_THRESHOLD, zip_digits=3):
+    """
+    The cluster of every row of df, as the position of the cluster's first row.
+
+    Rows without duplicates are clusters of their own, labelled with their own position.
+    """
+    blocks = blocking_keys(df, zip_digits=zip_digits)
+    left, right = matching_pairs(df, blocks, window, weights, threshold)
+    return connected_components(len(df), left, right)
+
+
+def _most_common(records, column, how):
+    values = records[['cluster', 'order', column]].dropna(subset=[column])
+    if how == 'longest':
+        values['rank'] = values[column].astype(str).str.len()
+    else:
+        values['rank'] = values.groupby(['cluster', column], sort=False)['order'].transform('size')
+    first = values.sort_values(['cluster', 'rank', 'order'], ascending=[True, False, True])
+    return first.drop_duplicates('cluster').set_index('cluster')[column]
+
+
+def _extreme(records, column, how):
+    # The value itself of the record with the min / max number, so it keeps its type or text
+    numbers = pd.to_numeric(records[column], errors='coerce')
+    present = numbers.notna().to_numpy()
+    values = pd.DataFrame({'cluster': records['cluster'].to_numpy()[present],
+                           'number': numbers.to_numpy()[present], 'position': np.flatnonzero(present)})
+    first = values.sort_values(['cluster', 'number', 'position'], ascending=[True, how == 'min', True])
+    first = first.drop_duplicates('cluster')
+    return pd.Series(records[column].to_numpy()[first['position'].to_numpy()], index=first['cluster'].to_numpy())
+
+
+def _sum(records, column):
+    # The sum of each cluster's numbers, in the type of the column or as its text is written
+    values = records[column]
+    totals = pd.to_numeric(values, errors='coerce').groupby(records['cluster'], sort=True).sum(min_count=1)
+    if pd.api.types.is_numeric_dtype(values):
+        if pd.api.types.is_integer_dtype(values) and totals.notna().all():
+            totals = totals.astype(values.dtype)
+        return totals
+    # Whole numbers, as an integer column writes them, unless a record's number has a point
+    fractional = values.str.contains(r'[.eE]', na=False).groupby(records['cluster'], sort=True).any()
+    return pd.Series([total if pd.isna(total) else str(float(total)) if point or total % 1 else str(int(total))
+                      for total, point in zip(totals, fractional)], index=totals.index, dtype=object)
+
+
+def _survivorship(rules):
+    rules = {**SURVIVORSHIP, **(rules or {})}
+    for column, how in rules.items():
+        if how not in SURVIVORSHIP_RULES:
+            raise ValueError(f"Unknown survivorship rule {how!r} for column {column}.")
+    return rules
+
+
+def merge_clusters(records, rules=None):
+    """
+    One merged record per cluster, by the survivorship rules.
+
+    Args:
+        records (DataFrame): The records of clusters of more than one record, with a
+            'cluster' column and an 'order' column that ranks them earliest first.
+        rules (dict, optional): Column to rule, over SURVIVORSHIP; see SURVIVORSHIP.
+
+    Returns:
+        DataFrame: The merged records, indexed by cluster.
+    """
+    rules = _survivorship(rules)
+    records = records.sort_values(['cluster', 'order'])
+    groups = records.groupby('cluster', sort=True)
+    merged = {}
+    for column in records.columns.drop(['cluster', 'order']):
+        how = rules.get(column, 'first')
+        if how in ('first', 'last'):
+            merged[column] = getattr(groups[column], how)()
+        elif how in ('most_common', 'longest'):
+            merged[column] = _most_common(records, column, how)
+        elif how == 'sum':
+            merged[column] = _sum(records, column)
+        else:
+            merged[column] = _extreme(records, column, how)
+    return pd.DataFrame(merged, index=pd.Index(sorted(records['cluster'].unique()), name='cluster'))
+
+
+def dedupe_rewards(df, rules=None, window=WINDOW, weights=None, threshold=MATCH_THRESHOLD):
+    """
+    Merges the duplicate customers of one DataFrame in memory.
+
+    Returns:
+        tuple: (the deduplicated rows, the cluster of every row as a position in df)
+    """
+    clusters = find_duplicate_clusters(df, window, weights, threshold)
+    sizes = np.bincount(clusters, minlength=len(df))
+    duplicated = sizes[clusters] > 1
+    records = df[duplicated].assign(cluster=clusters[duplicated], order=np.flatnonzero(duplicated))
+    merged = merge_clusters(records, rules)
+    kept = df[clusters == np.arange(len(df))].copy()
+    survivors = df.index[merged.index.to_numpy()]
+    for column in merged.columns:
+        if kept[column].dtype != merged[column].dtype:
+            kept[column] = kept[column].astype(object)
+        kept.loc[survivors, column] = merged[column].to_numpy()
+    return kept, clusters
+
+
+def _read_text(path, **kwargs):
+    # Text, so the rows no cluster touches are written back exactly as read
+    return pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[''], **kwargs)
+
+
+def _as_text(merged):
+    """Merged values as the text the file's other rows are written as (numbers as pandas writes them)."""
+    return merged.apply(lambda column: column.map(lambda value: value if isinstance(value, str) or pd.isna(value)
+                                                  else str(value)))
+
+
+def dedupe_rewards_file(csv_file_path, output_path, clusters_path=None, rules=None, buckets=BUCKETS,
+                        chunksize=CHUNKSIZE, window=WINDOW, weights=None, threshold=MATCH_THRESHOLD):
+    """
+    Merges the duplicate customers of a cleaned CSV file into output_path, in bounded memory.
+
+    Args:
+        csv_file_path (str): Cleaned RewardsData CSV file.
+        output_path (str): Deduplicated file; .parquet and .feather write those formats.
+        clusters_path (str, optional): Also write every duplicated row's file row number and
+            the row number its cluster was merged into, as a CSV file.
+        rules (dict, optional): Survivorship rules over SURVIVORSHIP.
+        buckets (int, optional): Bucket files the rows are split into; each one is
+            clustered in memory, so more buckets take less memory.
+        chunksize (int, optional): Rows read at a time when splitting and writing.
+        window, weights, threshold: How records of a block are compared, see matching_pairs.
+
+    Returns:
+        tuple: (rows in, rows out, clusters of more than one record)
+    """
+    rules = _survivorship(rules)
+    work_dir = tempfile.mkdtemp(prefix='dedupe_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        # Pass 1: every row into the bucket of its block, with its row number
+        bucket_paths = [os.path.join(work_dir, f"bucket_{i}.csv") for i in range(buckets)]
+        written = set()
+        rows_in = 0
+        for chunk in _read_text(csv_file_path, chunksize=chunksize):
+            chunk.insert(0, 'row', np.arange(rows_in, rows_in + len(chunk)))
+            rows_in += len(chunk)
+            bucket = blocking_keys(chunk).view('uint64') % buckets
+            for i, part in chunk.groupby(bucket, sort=False):
+                part.to_csv(bucket_paths[i], mode='a', header=i not in written, index=False)
+                written.add(i)
+
+        # Pass 2: the clusters of each bucket, merged
+        merged_parts, cluster_parts = [], []
+        for i in sorted(written):
+            part = _read_text(bucket_paths[i])
+            rows = part.pop('row').astype('int64').to_numpy()
+            labels = rows[find_duplicate_clusters(part, window, weights, threshold)]
+            sizes = pd.Series(labels).map(pd.Series(labels).value_counts()).to_numpy()
+            duplicated = sizes > 1
+            records = part[duplicated].assign(cluster=labels[duplicated], order=rows[duplicated])
+            merged_parts.append(merge_clusters(records, rules))
+            cluster_parts.append(pd.DataFrame({'row': rows[duplicated], 'cluster': labels[duplicated]}))
+            os.remove(bucket_paths[i])
+        merged = _as_text(pd.concat(merged_parts)).sort_index() if merged_parts else pd.DataFrame()
+        clusters = pd.concat(cluster_parts) if cluster_parts else pd.DataFrame({'row': [], 'cluster': []})
+        dropped = np.sort(clusters.loc[clusters['row'] != clusters['cluster'], 'row'].to_numpy())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # Pass 3: the file again, without the merged-away rows and with each merged record in
+    # the place of its cluster's first row
+    start = 0
+    with CleanedWriter(output_path) as writer:
+        for chunk in _read_text(csv_file_path, chunksize=chunksize):
+            end = start + len(chunk)
+            chunk.index = np.arange(start, end)
+            low, high = np.searchsorted(dropped, [start, end])
+            chunk = chunk.drop(index=dropped[low:high])
+            low, high = np.searchsorted(merged.index, [start, end])
+            if high > low:
+                survivors = merged.iloc[low:high]
+                chunk.loc[survivors.index, survivors.columns] = survivors.to_numpy()
+            writer.write(chunk)
+            start = end
+    if clusters_path:
+        clusters.sort_values('row').to_csv(clusters_path, index=False)
+    return rows_in, writer.rows, len(merged)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find and merge duplicate customers in a cleaned RewardsData file.")
+    parser.add_argument('csv_file_path', help="Cleaned RewardsData CSV file")
+    parser.add_argument('output_path', nargs='?', default='Deduped_RewardsData.csv')
+    parser.add_argument('--clusters', default=None, help="Write each duplicated row's cluster to this CSV file")
+    parser.add_argument('--rules', default=None,
+                        help="JSON file of column to survivorship rule, over the defaults")
+    parser.add_argument('--buckets', type=int, default=BUCKETS, help="More buckets take less memory")
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    parser.add_argument('--window', type=int, default=WINDOW,
+                        help="Records each record is compared with in its block")
+    parser.add_argument('--threshold', type=float, default=MATCH_THRESHOLD)
+    args = parser.parse_args()
+
+    rules = None
+    if args.rules:
+        with open(args.rules) as f:
+            rules = json.load(f)
+    rows_in, rows_out, clusters = dedupe_rewards_file(args.csv_file_path, args.output_path, args.clusters, rules,
+                                                      args.buckets, args.chunksize, args.window,
+                                                      threshold=args.threshold)
+    print(f"Merged {rows_in - rows_out} duplicate rows into {clusters} customers; "
+          f"saved {rows_out} of {rows_in} rows to {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Follow mode for a RewardsData.csv that is only ever appended to: each run cleans just the
+rows added since the last one, instead of the whole file again.
+
+    python rewards_follow.py RewardsData.csv Cleaned_RewardsData.csv --seed 0
+    python rewards_follow.py RewardsData.csv Cleaned_RewardsData.csv --watch 30 \\
+        --table reward_data --dsn "dbname=rewards_data user=postgres host=localhost"
+
+A checkpoint file beside the raw file keeps the byte offset up to which rows were cleaned,
+the header line they were read with, the dtype every column is read with, and the running
+state of the steps: the Zip sum and count of step d, the step h position in the state
+cycle, the step j generator and the Birthdate format counts. A run reads from the offset
+to the last complete line, so a row that is still being written waits for the next run,
+cleans those rows with the steps of default_plan, and appends them to the cleaned CSV file
+and, with --table, to PostgreSQL.
+
+The dtypes are taken from the first rows cleaned (pinned_dtypes) and every later batch is
+read with them, so a column is written the same way in every batch rather than as each
+batch's own values suggest (Points as 997 in one and 997.0 in the next). The output then
+equals a whole-file clean of the same rows whenever the first rows read as the whole file
+does; a later batch whose values do not fit the pinned dtypes stops the run with an error.
+
+The step d mean is the mean of every Zip seen so far, kept up to date from the running
+sum and count rather than recomputed over the file; rows cleaned earlier keep the mean
+they were filled with. Rows keep their row number in the raw file, so step b still only
+touches row 438. --watch keeps running and cleans new rows as they are appended.
+
+The raw file must only grow: a run stops with an error if it is shorter than the
+checkpoint offset or its header changed. The checkpoint is written after the rows of a
+batch are in the cleaned file, and a run first cuts the cleaned file back to the size the
+checkpoint recorded, so an interrupted run leaves no partial rows there. With --table the
+checkpoint is kept in the database instead (CHECKPOINT_TABLE) and written in the same
+transaction as the COPY of the batch, so the table has a batch's rows exactly when the
+checkpoint says so, and no batch is loaded twice. Rows never span lines, as RewardsData
+has no quoted line breaks.
+"""
+import argparse
+import json
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from rewards_cleaning import (CITY_FIXES, DATE_COLUMNS, _fill_zip_median_step, _zip_totals, default_plan,
+                              load_city_fixes, output_format, zip_mean_of)
+
+CHECKPOINT_VERSION = 2
+
+# Table of the checkpoints of the tables follow mode appends to, one row per table
+CHECKPOINT_TABLE = 'follow_checkpoints'
+
+# Raw bytes read and cleaned at a time, rounded up to the end of a line
+READ_BYTES = 64 << 20
+
+
+def checkpoint_path_for(csv_file_path):
+    """The default checkpoint file of a raw CSV file, beside it."""
+    return csv_file_path + '.follow.json'
+
+
+def _checked(checkpoint, where):
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"Checkpoint {where} has version {checkpoint.get('version')}, not {CHECKPOINT_VERSION}.")
+    return checkpoint
+
+
+def load_checkpoint(path):
+    """The checkpoint saved at path, or None if there is none yet."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return _checked(json.load(f), f"'{path}'")
+
+
+def save_checkpoint(path, checkpoint):
+    """Writes the checkpoint to a temporary file and moves it over path, so path is always whole."""
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def load_table_checkpoint(conn, table_name):
+    """The checkpoint of the rows in table_name, from CHECKPOINT_TABLE, or None if there is none yet."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} "
+                       f"(table_name TEXT PRIMARY KEY, checkpoint TEXT NOT NULL)")
+        cursor.execute(f"SELECT checkpoint FROM {CHECKPOINT_TABLE} WHERE table_name = %s", (table_name,))
+        row = cursor.fetchone()
+    conn.commit()
+    return None if row is None else _checked(json.loads(row[0]), f"of table '{table_name}'")
+
+
+def save_table_checkpoint(conn, table_name, checkpoint):
+    """Stores the checkpoint of table_name and commits, together with whatever the transaction holds."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {CHECKPOINT_TABLE} (table_name, checkpoint) VALUES (%s, %s) "
+                       f"ON CONFLICT (table_name) DO UPDATE SET checkpoint = EXCLUDED.checkpoint",
+                       (table_name, json.dumps(checkpoint)))
+    conn.commit()
+
+
+def new_checkpoint(csv_file_path, header, seed=None):
+    """The checkpoint of a raw file with none of its rows cleaned yet."""
+    return {'version': CHECKPOINT_VERSION, 'input': os.path.abspath(csv_file_path),
+            'header': header.decode('utf-8'), 'dtypes': None, 'offset': len(header), 'rows': 0,
+            'zip_sum': 0, 'zip_count': 0, 'state_start': 0,
+            'rng': np.random.default_rng(seed).bit_generator.state, 'format_counts': {},
+            'output_bytes': 0, 'output_rows': 0}
+
+
+def pinned_dtypes(sample):
+    """
+    The dtype every batch is read with, from the first batch as pd.read_csv infers it.
+
+    Integer and boolean columns become nullable, so a later empty cell still fits, and a
+    column with no values at all becomes text, as a later batch may hold anything there.
+
+    Returns:
+        dict: Column to dtype name, for pd.read_csv and the checkpoint.
+    """
+    dtypes = {}
+    for column, dtype in sample.dtypes.items():
+        if sample[column].isna().all():
+            dtypes[column] = 'object'
+        elif pd.api.types.is_bool_dtype(dtype):
+            dtypes[column] = 'boolean'
+        elif pd.api.types.is_integer_dtype(dtype):
+            dtypes[column] = 'Int64'
+        else:
+            dtypes[column] = str(dtype)
+    return dtypes
+
+
+def table_schema(cleaned, plan):
+    """
+    The pyarrow schema of the table cleaned rows are appended to, from their dtypes alone,
+    so a first batch with no rows left creates the same table: wide integers, doubles,
+    text, and dates for the DATE_COLUMNS step i reformats.
+    """
+    import pyarrow as pa
+
+    fields = []
+    for column, dtype in cleaned.dtypes.items():
+        if (column in DATE_COLUMNS and 'i' in plan.enabled) or pd.api.types.is_datetime64_any_dtype(dtype):
+            arrow_type = pa.date32()
+        elif pd.api.types.is_bool_dtype(dtype):
+            arrow_type = pa.bool_()
+        elif pd.api.types.is_integer_dtype(dtype):
+            arrow_type = pa.int64()
+        elif pd.api.types.is_float_dtype(dtype):
+            arrow_type = pa.float64()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column, arrow_type))
+    return pa.schema(fields)
+
+
+def read_new_lines(f, offset, read_bytes=READ_BYTES):
+    """
+    The complete lines of the open file f from offset, up to about read_bytes of them.
+
+    Returns:
+        bytes: The lines, ending with a line break; empty when no complete line was added.
+    """
+    f.seek(offset)
+    data = f.read(read_bytes)
+    data += f.readline()  # to the end of the line the read stopped in
+    return data[:data.rfind(b'\n') + 1]
+
+
+def follow_once(csv_file_path, output_path, checkpoint_path=None, plan=None, seed=None, city_fixes=CITY_FIXES,
+                optimize=True, conn=None, table_name=None, read_bytes=READ_BYTES):
+    """
+    Cleans the rows appended to a raw CSV file since the checkpoint and appends them to
+    the cleaned file, and to table_name if conn is given.
+
+    Args:
+        csv_file_path (str): The raw CSV file, which is only appended to.
+        output_path (str): The cleaned CSV file rows are appended to.
+        checkpoint_path (str, optional): Defaults to checkpoint_path_for(csv_file_path).
+        plan (CleaningPlan, optional): Steps to run. Defaults to default_plan(); the median
+            Zip fill, which needs the medians of the whole file, cannot follow a file.
+        seed (int, optional): Seed for the step j random birthdates of the first run; later
+            runs carry on the generator saved in the checkpoint.
+        city_fixes (dict, optional): City variant to canonical name, for step e.
+        optimize (bool, optional): Reorder and fuse steps, see CleaningPlan.compile.
+        conn: psycopg2 connection object, to also load the cleaned rows into PostgreSQL.
+            The checkpoint is then kept in CHECKPOINT_TABLE rather than at checkpoint_path.
+        table_name (str, optional): Table for the cleaned rows, created with the first batch
+            from the pinned dtypes (see table_schema).
+        read_bytes (int, optional): Raw bytes cleaned at a time.
+
+    Returns:
+        int: Number of cleaned rows appended.
+    """
+    if plan is None:
+        plan = default_plan()
+    if 'd' in plan.enabled and any(step.func is _fill_zip_median_step for step in plan.steps):
+        raise ValueError("Follow mode fills Zips with the running mean; zip_fill='median' needs the whole file.")
+    if output_format(output_path) != 'csv':
+        raise ValueError(f"Follow mode appends to a CSV file, not '{output_path}'.")
+    if conn is not None:
+        checkpoint = load_table_checkpoint(conn, table_name)
+        where = f"the row of '{table_name}' in {CHECKPOINT_TABLE}"
+    else:
+        checkpoint_path = checkpoint_path or checkpoint_path_for(csv_file_path)
+        checkpoint = load_checkpoint(checkpoint_path)
+        where = f"'{checkpoint_path}'"
+
+    appended = 0
+    with open(csv_file_path, 'rb') as f:
+        header = f.readline()
+        if not header.endswith(b'\n'):
+            return 0  # the header line is not complete yet
+        if checkpoint is None:
+            checkpoint = new_checkpoint(csv_file_path, header, seed)
+        elif header.decode('utf-8') != checkpoint['header']:
+            raise ValueError(f"The header of '{csv_file_path}' changed since the checkpoint; "
+                             f"delete {where} to clean the file from the start.")
+        elif os.path.getsize(csv_file_path) < checkpoint['offset']:
+            raise ValueError(f"'{csv_file_path}' is shorter than at the checkpoint, so it was not only appended "
+                             f"to; delete {where} to clean the file from the start.")
+        if os.path.exists(output_path) and os.path.getsize(output_path) > checkpoint['output_bytes']:
+            # Rows an interrupted run wrote after its last checkpoint
+            os.truncate(output_path, checkpoint['output_bytes'])
+
+        rng = np.random.default_rng()
+        rng.bit_generator.state = checkpoint['rng']
+        while True:
+            lines = read_new_lines(f, checkpoint['offset'], read_bytes)
+            if not lines:
+                break
+            first = checkpoint['dtypes'] is None
+            if first:
+                checkpoint['dtypes'] = pinned_dtypes(pd.read_csv(BytesIO(header + lines), usecols=plan.usecols()))
+            try:
+                chunk = pd.read_csv(BytesIO(header + lines), usecols=plan.usecols(), dtype=checkpoint['dtypes'])
+            except (ValueError, TypeError) as e:
+                raise ValueError(f"Rows appended to '{csv_file_path}' do not fit the column types of the checkpoint "
+                                 f"({e}); delete {where} to clean the file from the start.") from e
+            chunk.index = pd.RangeIndex(checkpoint['rows'], checkpoint['rows'] + len(chunk))
+
+            chunk_sum, chunk_count = _zip_totals(chunk.copy(), plan)
+            zip_sum = checkpoint['zip_sum'] + chunk_sum
+            zip_count = checkpoint['zip_count'] + chunk_count
+            if not zip_count and 'd' in plan.enabled:
+                raise ValueError(f"Zip column of '{csv_file_path}' has no numeric values to take the mean of.")
+            format_counts = dict(checkpoint['format_counts'])
+            context = {'zip_mean': zip_mean_of(zip_sum, zip_count) if zip_count else None,
+                       'state_start': checkpoint['state_start'], 'format_counts': format_counts,
+                       'rng': rng, 'city_fixes': city_fixes, 'compact': False}
+            cleaned = plan.run(chunk, context, optimize)
+
+            cleaned.to_csv(output_path, mode='a', header=checkpoint['output_bytes'] == 0, index=False)
+            checkpoint.update(offset=checkpoint['offset'] + len(lines), rows=checkpoint['rows'] + len(chunk),
+                              zip_sum=zip_sum, zip_count=zip_count, state_start=context['state_start'],
+                              rng=rng.bit_generator.state, format_counts=format_counts,
+                              output_bytes=os.path.getsize(output_path),
+                              output_rows=checkpoint['output_rows'] + len(cleaned))
+            if conn is not None:
+                from rewards_loader import copy_from_frame, create_table_from_schema
+                if first:
+                    create_table_from_schema(conn, table_name, table_schema(cleaned, plan))
+                # The rows and the checkpoint that records them commit together
+                copy_from_frame(conn, table_name, cleaned, commit=False)
+                save_table_checkpoint(conn, table_name, checkpoint)
+            else:
+                save_checkpoint(checkpoint_path, checkpoint)
+            appended += len(cleaned)
+    return appended
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clean only the rows appended to RewardsData.csv since the last run.")
+    parser.add_argument('csv_file_path', help="Raw RewardsData CSV file, only ever appended to")
+    parser.add_argument('output_path', nargs='?', default='Cleaned_RewardsData.csv',
+                        help="Cleaned CSV file the new rows are appended to")
+    parser.add_argument('--checkpoint', default=None,
+                        help="Checkpoint file (default: the raw file's name plus .follow.json); "
+                             f"with --table the checkpoint is kept in {CHECKPOINT_TABLE} instead")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="Seed for the random birthdates of the first run")
+    parser.add_argument('--city-fixes', default=None,
+                        help="CSV of extra City fixes with 'variant' and 'canonical' columns")
+    parser.add_argument('--skip', default='', help="Comma-separated steps to leave out, e.g. c,d")
+    parser.add_argument('--no-optimize', dest='optimize', action='store_false')
+    parser.add_argument('--watch', type=float, default=None,
+                        help="Keep running, looking for new rows every this many seconds")
+    parser.add_argument('--table', default=None, help="Also append the cleaned rows to this PostgreSQL table")
+    parser.add_argument('--dsn', default='dbname=rewards_data user=postgres host=localhost',
+                        help="psycopg2 connection string for --table")
+    args = parser.parse_args()
+
+    city_fixes = load_city_fixes(args.city_fixes) if args.city_fixes else CITY_FIXES
+    plan = default_plan().disable(*[name.strip() for name in args.skip.split(',') if name.strip()])
+    conn = None
+    if args.table:
+        import psycopg2
+        conn = psycopg2.connect(args.dsn)
+    try:
+        while True:
+            rows = follow_once(args.csv_file_path, args.output_path, args.checkpoint, plan, args.seed, city_fixes,
+                               args.optimize, conn, args.table)
+            if rows or args.watch is None:
+                print(f"Appended {rows} cleaned rows to {args.output_path}")
+            if args.watch is None:
+                break
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
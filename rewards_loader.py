@@ -0,0 +1,834 @@
+"""
+Loads the cleaned RewardsData into PostgreSQL (moved here from exam_bright.py).
+
+CSV files go through create_table_from_csv and copy_from_csv. Parquet and Feather files
+written by rewards_cleaning.py keep their column types, so load_cleaned_file creates the
+table from the stored schema and copies the typed columns without re-parsing any text.
+"""
+import csv
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO, StringIO
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from rewards_cleaning import output_format, read_cleaned_table
+
+# Rows per COPY batch when loading a Parquet or Feather file
+COPY_BATCH_ROWS = 100_000
+
+# Characters of COPY data prepared and sent at a time when streaming a CSV file
+COPY_BUFFER_SIZE = 1 << 16
+
+# Binary COPY: signature, flags and header extension length; -1 field count ends the data
+BINARY_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + b'\x00' * 8
+BINARY_COPY_TRAILER = b'\xff\xff'
+
+# PostgreSQL's epoch, 2000-01-01, in days and microseconds since 1970-01-01
+PG_EPOCH_DAYS = 10_957
+PG_EPOCH_MICROSECONDS = PG_EPOCH_DAYS * 86_400 * 1_000_000
+
+# Big-endian layout of each fixed-width PostgreSQL type in binary COPY
+BINARY_TYPES = {'BOOLEAN': '>u1', 'SMALLINT': '>i2', 'INTEGER': '>i4', 'BIGINT': '>i8',
+                'REAL': '>f4', 'DOUBLE PRECISION': '>f8', 'DATE': '>i4', 'TIMESTAMP': '>i8',
+                'TIMESTAMPTZ': '>i8'}
+
+
+class CopyStream:
+    """
+    File-like object that produces COPY data from a CSV reader a buffer at a time.
+
+    Rows longer than the header are truncated and shorter ones padded with empty fields as
+    they are read, so at most about buffer_size characters are held at once, and COPY can
+    start sending data before the file has been read to the end. Progress in rows/sec and
+    bytes/sec is printed every progress_interval seconds.
+
+    Args:
+        reader: csv.reader positioned after the header row.
+        width (int): Number of columns in the header.
+        delimiter (str, optional): Field delimiter to write.
+        buffer_size (int, optional): Characters of COPY data to prepare at a time.
+        progress_interval (float, optional): Seconds between progress lines; None for none.
+    """
+
+    def __init__(self, reader, width, delimiter=',', buffer_size=COPY_BUFFER_SIZE, progress_interval=5.0):
+        self.width = width
+        self.buffer_size = buffer_size
+        self.progress_interval = progress_interval
+        self.rows = 0
+        self.bytes = 0
+        self._reader = reader
+        self._buffer = StringIO()
+        self._writer = csv.writer(self._buffer, delimiter=delimiter, quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        self._pending = ''
+        self._eof = False
+        self._started = time.monotonic()
+        self._last_report = self._started
+
+    def _fill(self):
+        """Fixes and writes rows until about buffer_size characters of COPY data are ready."""
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        rows = 0
+        for row in self._reader:
+            if len(row) > self.width:
+                row = row[:self.width]  # Truncate the row to match the header
+            elif len(row) < self.width:
+                row += [''] * (self.width - len(row))  # Pad the row with empty strings
+            self._writer.writerow(row)
+            rows += 1
+            if self._buffer.tell() >= self.buffer_size:
+                break
+        else:
+            self._eof = True
+        data = self._buffer.getvalue()
+        self.rows += rows
+        self.bytes += len(data.encode('utf-8'))
+        self._report()
+        return data
+
+    def _report(self, final=False):
+        now = time.monotonic()
+        if self.progress_interval is None or not (final or now - self._last_report >= self.progress_interval):
+            return
+        self._last_report = now
+        elapsed = max(now - self._started, 1e-9)
+        print(f"Copied {self.rows} rows, {self.bytes / 1e6:.1f} MB "
+              f"({self.rows / elapsed:,.0f} rows/s, {self.bytes / 1e6 / elapsed:.1f} MB/s)")
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._pending) < size):
+            self._pending += self._fill()
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def readline(self, size=-1):
+        while not self._eof and '\n' not in self._pending:
+            self._pending += self._fill()
+        end = self._pending.find('\n') + 1 or len(self._pending)
+        if size >= 0:
+            end = min(end, size)
+        line, self._pending = self._pending[:end], self._pending[end:]
+        return line
+
+    def finish(self):
+        """Prints the final rows/sec and bytes/sec line."""
+        self._report(final=True)
+
+
+def copy_from_csv(conn, table_name, csv_file_path, delimiter=',', null_string='',
+                  buffer_size=COPY_BUFFER_SIZE, progress_interval=5.0):
+    """
+    Copies data from a CSV file into a PostgreSQL table using the COPY command.
+    This is the most efficient way to load large amounts of data.
+
+    The file is streamed through a CopyStream, so memory use stays flat whatever the file
+    size and the database starts ingesting rows while the file is still being read.
+
+    Args:
+        conn: psycopg2 connection object.
+        table_name (str): The name of the table to copy data into.
+        csv_file_path (str): Path to the CSV file.
+        delimiter (str, optional): The delimiter used in the CSV file. Defaults to ','.
+        null_string (str, optional): The string representing NULL values in the CSV. Defaults to ''.
+        buffer_size (int, optional): Characters of COPY data prepared and sent at a time.
+        progress_interval (float, optional): Seconds between progress lines; None for none.
+    """
+    cursor = conn.cursor()
+    try:
+        with open(csv_file_path, 'r', newline='') as f:
+            reader = csv.reader(f, delimiter=delimiter)
+            header = next(reader)  # Read and discard the header row
+            stream = CopyStream(reader, len(header), delimiter, buffer_size, progress_interval)
+
+            cursor.copy_expert(csv_copy_query(table_name, delimiter, null_string), stream, size=buffer_size)
+            conn.commit()
+            stream.finish()
+            print(f"Data from '{csv_file_path}' successfully copied to table '{table_name}'.")
+
+    except psycopg2.Error as e:
+        print(f"Error copying data from CSV to table: {e}")
+        conn.rollback()  # Rollback the transaction on error
+        raise  # Re-raise the exception to be handled by the caller, if needed.
+    finally:
+        cursor.close()  # Ensure the cursor is closed.
+
+
+def quote_literal(value):
+    """value as a single-quoted SQL string literal."""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def csv_copy_query(table_name, delimiter=',', null_string=''):
+    """COPY statement for the rows a CopyStream produces."""
+    # The rows are re-quoted by csv.writer, so COPY reads them in CSV format
+    return (f"COPY {table_name} FROM STDIN WITH (FORMAT csv, DELIMITER {quote_literal(delimiter)}, "
+            f"NULL {quote_literal(null_string)})")
+
+
+def split_on_lines(csv_file_path, parts):
+    """
+    Splits the data rows of a CSV file into about equal byte ranges, cut at line starts.
+
+    Quoted fields with line breaks inside them are not supported, since a cut could land
+    inside one; the cleaned RewardsData files have none.
+
+    Returns:
+        list: (start, end) byte offsets, one per non-empty range.
+    """
+    size = os.path.getsize(csv_file_path)
+    with open(csv_file_path, 'rb') as f:
+        f.readline()  # Skip the header row
+        data_start = f.tell()
+        bounds = [data_start]
+        for i in range(1, parts):
+            cut = data_start + (size - data_start) * i // parts
+            if cut <= bounds[-1]:
+                continue
+            f.seek(cut - 1)
+            f.readline()  # Move on to the start of the next line
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def _partition_lines(f, start, end, encoding):
+    """The lines of a binary file that start in the byte range [start, end), decoded."""
+    f.seek(start)
+    position = start
+    while position < end:
+        line = f.readline()
+        if not line:
+            break
+        position += len(line)
+        yield line.decode(encoding)
+
+
+def _copy_partition(task):
+    (conn_params, table_name, csv_file_path, start, end, width, delimiter, null_string,
+     buffer_size, encoding) = task
+    conn = psycopg2.connect(**conn_params)
+    try:
+        with open(csv_file_path, 'rb') as f:
+            reader = csv.reader(_partition_lines(f, start, end, encoding), delimiter=delimiter)
+            stream = CopyStream(reader, width, delimiter, buffer_size, progress_interval=None)
+            with conn.cursor() as cursor:
+                cursor.copy_expert(csv_copy_query(table_name, delimiter, null_string), stream, size=buffer_size)
+        conn.commit()
+        return stream.rows
+    finally:
+        conn.close()
+
+
+def parallel_copy_csv(conn_params, table_name, csv_file_path, workers=4, index_columns=(),
+                      delimiter=',', null_string='', buffer_size=COPY_BUFFER_SIZE, encoding='utf-8'):
+    """
+    Replaces the contents of a table with a CSV file, COPYing partitions of it in parallel.
+
+    The file is split into byte ranges on line boundaries, and each range is COPYed over its
+    own connection into an unlogged staging table. Once every partition is in, the indexes
+    are built on the staging table, it is made logged, and it is swapped in for the table in
+    one transaction. If any partition fails the staging table is dropped and the table is
+    left as it was.
+
+    Args:
+        conn_params (dict): psycopg2.connect keyword arguments (dbname, user, password, host, port).
+        table_name (str): The table to load. Created from the CSV file if it does not exist.
+        csv_file_path (str): Path to the CSV file.
+        workers (int, optional): Partitions, and connections, to COPY with at once.
+        index_columns (tuple, optional): Columns to index once the rows are loaded.
+        delimiter (str, optional): The delimiter used in the CSV file.
+        null_string (str, optional): The string representing NULL values in the CSV.
+        buffer_size (int, optional): Characters of COPY data sent at a time per connection.
+        encoding (str, optional): Encoding of the CSV file.
+
+    Returns:
+        int: Number of rows loaded.
+    """
+    staging_table = f"{table_name}_staging"
+    conn = psycopg2.connect(**conn_params)
+    cursor = conn.cursor()
+    try:
+        create_table_from_csv(conn, table_name, csv_file_path, null_string)
+        cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+        cursor.execute(f"CREATE UNLOGGED TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS)")
+        conn.commit()
+
+        with open(csv_file_path, 'r', newline='', encoding=encoding) as f:
+            width = len(next(csv.reader(f, delimiter=delimiter)))
+        partitions = split_on_lines(csv_file_path, workers)
+
+        started = time.monotonic()
+        rows = 0
+        errors = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_copy_partition, (conn_params, staging_table, csv_file_path, start, end,
+                                                     width, delimiter, null_string, buffer_size, encoding))
+                       for start, end in partitions]
+            for future in futures:
+                try:
+                    rows += future.result()
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+        elapsed = max(time.monotonic() - started, 1e-9)
+        print(f"Copied {rows} rows in {len(partitions)} partitions ({rows / elapsed:,.0f} rows/s).")
+
+        for column in index_columns:
+            cursor.execute(f"CREATE INDEX {staging_table}_{column}_idx ON {staging_table} ({column})")
+        cursor.execute(f"ALTER TABLE {staging_table} SET LOGGED")
+        cursor.execute(f"ANALYZE {staging_table}")
+
+        # Swap the staging table into place in one transaction
+        cursor.execute(f"DROP TABLE {table_name}")
+        cursor.execute(f"ALTER TABLE {staging_table} RENAME TO {table_name}")
+        for column in index_columns:
+            cursor.execute(f"ALTER INDEX {staging_table}_{column}_idx RENAME TO {table_name}_{column}_idx")
+        conn.commit()
+        print(f"Table '{table_name}' replaced with {rows} rows from '{csv_file_path}'.")
+        return rows
+
+    except Exception as e:
+        print(f"Parallel load failed, table '{table_name}' is unchanged: {e}")
+        conn.rollback()
+        cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+        conn.commit()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+ColumnType = namedtuple('ColumnType', 'name pg_type rows non_null matches')
+
+_INTEGER_PATTERN = r'[+-]?\d{1,18}'
+_NUMERIC_PATTERN = r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?'
+_DATE_PATTERN = r'\d{4}-\d{2}-\d{2}'
+
+
+class _ColumnStats:
+    """Running counts of the values in one column that fit each candidate type."""
+
+    def __init__(self):
+        self.rows = 0
+        self.non_null = 0
+        self.integer = 0
+        self.numeric = 0
+        self.date = 0
+        self.min_int = None
+        self.max_int = None
+        self.max_length = 0
+
+    def update(self, values, null_string):
+        """Adds a chunk of raw string values, checked a whole column at a time."""
+        self.rows += len(values)
+        values = values[values != null_string]
+        if not len(values):
+            return
+        self.non_null += len(values)
+        self.max_length = max(self.max_length, int(values.str.len().max()))
+
+        is_int = values.str.fullmatch(_INTEGER_PATTERN)
+        self.integer += int(is_int.sum())
+        if is_int.any():
+            ints = values[is_int].astype('int64')
+            low, high = int(ints.min()), int(ints.max())
+            self.min_int = low if self.min_int is None else min(self.min_int, low)
+            self.max_int = high if self.max_int is None else max(self.max_int, high)
+        self.numeric += int(values.str.fullmatch(_NUMERIC_PATTERN).sum())
+
+        looks_like_date = values.str.fullmatch(_DATE_PATTERN)
+        if looks_like_date.any():
+            dates = pd.to_datetime(values[looks_like_date], format='%Y-%m-%d', errors='coerce')
+            self.date += int(dates.notna().sum())
+
+    def pg_type(self):
+        """The narrowest PostgreSQL type every non-null value fits."""
+        if not self.non_null:
+            return 'TEXT'
+        if self.integer == self.non_null:
+            if -32768 <= self.min_int and self.max_int <= 32767:
+                return 'SMALLINT'
+            if -2147483648 <= self.min_int and self.max_int <= 2147483647:
+                return 'INTEGER'
+            return 'BIGINT'
+        if self.numeric == self.non_null:
+            return 'NUMERIC'
+        if self.date == self.non_null:
+            return 'DATE'
+        if not self.max_length:
+            return 'TEXT'  # only empty strings, with a null_string other than ''; VARCHAR(0) is invalid
+        return f'VARCHAR({self.max_length})'
+
+
+def infer_schema(csv_file_path, sample_rows=None, null_string='', chunksize=100_000):
+    """
+    Infers a PostgreSQL type for every column of a CSV file from its values.
+
+    The file is read in chunks of raw strings and each chunk is checked a whole column at a
+    time. A column gets the narrowest of SMALLINT, INTEGER, BIGINT, NUMERIC, DATE
+    (YYYY-MM-DD) or VARCHAR(longest value) that every non-null value fits. Ragged rows are
+    truncated or padded to the header width, as copy_from_csv loads them.
+
+    Args:
+        csv_file_path (str): Path to the CSV file.
+        sample_rows (int, optional): Only look at this many data rows. Defaults to the whole
+            file, which guarantees COPY will accept every row.
+        null_string (str, optional): The string representing NULL values in the CSV.
+        chunksize (int, optional): Rows read at a time.
+
+    Returns:
+        list: One ColumnType per column, with the rows and non-null values seen and how many
+            values matched each candidate type, as confidence counts.
+    """
+    with open(csv_file_path, 'r', newline='') as f:
+        # Use csv.Sniffer to detect the delimiter and quotechar
+        dialect = csv.Sniffer().sniff(f.read(1024))  # Read a chunk to sniff
+        f.seek(0)  # Reset file position after sniffing
+        header = next(csv.reader(f, dialect))  # Get the header row
+
+    try:
+        import pyarrow  # noqa: F401
+        # Arrow-backed strings run the pattern matches below in C++ instead of per object
+        text_dtype = 'string[pyarrow]'
+    except ImportError:
+        text_dtype = str
+
+    stats = [_ColumnStats() for _ in header]
+    chunks = pd.read_csv(csv_file_path, sep=dialect.delimiter, quotechar=dialect.quotechar, header=0,
+                         names=header, usecols=range(len(header)), dtype=text_dtype, na_filter=False,
+                         nrows=sample_rows, chunksize=chunksize)
+    for chunk in chunks:
+        for column_stats, name in zip(stats, header):
+            column_stats.update(chunk[name], null_string)
+
+    if not stats or not stats[0].rows:
+        raise ValueError("CSV file is empty or contains only a header.")
+    return [ColumnType(name, column_stats.pg_type(), column_stats.rows, column_stats.non_null,
+                       {'integer': column_stats.integer, 'numeric': column_stats.numeric,
+                        'date': column_stats.date})
+            for name, column_stats in zip(header, stats)]
+
+
+def print_schema(schema):
+    """Prints the inferred type of each column with its confidence counts."""
+    for column in schema:
+        print(f"  {column.name}: {column.pg_type}  ({column.non_null} of {column.rows} values non-null; "
+              f"integer {column.matches['integer']}, numeric {column.matches['numeric']}, "
+              f"date {column.matches['date']})")
+
+
+def wide_type(pg_type):
+    """pg_type with integers as BIGINT and VARCHAR(n) as TEXT, to fit values larger than those seen."""
+    if pg_type in ('SMALLINT', 'INTEGER'):
+        return 'BIGINT'
+    if pg_type.startswith('VARCHAR'):
+        return 'TEXT'
+    return pg_type
+
+
+def create_table_from_csv(conn, table_name, csv_file_path, null_string='', sample_rows=None, wide=False):
+    """
+    Creates a PostgreSQL table from a CSV file, taking column names from the CSV file's
+    header row and data types from infer_schema.
+
+    Args:
+        conn: psycopg2 connection object.
+        table_name (str): The name of the table to create.
+        csv_file_path (str): Path to the CSV file.
+        null_string (str, optional): The string representing NULL values in the CSV.
+        sample_rows (int, optional): Infer the types from this many rows instead of all of them.
+        wide (bool, optional): Use wide_type, for a table that rows not in the file yet are
+            appended to later.
+    """
+    cursor = conn.cursor()
+    try:
+        schema = infer_schema(csv_file_path, sample_rows, null_string)
+        print(f"Inferred schema of '{csv_file_path}':")
+        print_schema(schema)
+
+        # Construct the CREATE TABLE statement.
+        columns = [f"{column.name} {wide_type(column.pg_type) if wide else column.pg_type}" for column in schema]
+        create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns)})"
+        print(f"Creating table: {create_table_query}")  # Print the query
+        cursor.execute(create_table_query)
+        conn.commit()
+        print(f"Table '{table_name}' successfully created.")
+
+    except psycopg2.Error as e:
+        print(f"Error creating table: {e}")
+        conn.rollback()
+        raise
+    except ValueError as e:
+        print(f"Error determining column types or CSV format: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def postgres_type(arrow_type):
+    """The PostgreSQL column type for a pyarrow type."""
+    import pyarrow as pa
+
+    if pa.types.is_dictionary(arrow_type):
+        arrow_type = arrow_type.value_type
+    if pa.types.is_boolean(arrow_type):
+        return 'BOOLEAN'
+    if pa.types.is_int8(arrow_type) or pa.types.is_int16(arrow_type) or pa.types.is_uint8(arrow_type):
+        return 'SMALLINT'
+    if pa.types.is_int32(arrow_type) or pa.types.is_uint16(arrow_type):
+        return 'INTEGER'
+    if pa.types.is_integer(arrow_type):
+        return 'BIGINT'
+    if pa.types.is_float32(arrow_type):
+        return 'REAL'
+    if pa.types.is_floating(arrow_type):
+        return 'DOUBLE PRECISION'
+    if pa.types.is_date(arrow_type):
+        return 'DATE'
+    if pa.types.is_timestamp(arrow_type):
+        return 'TIMESTAMPTZ' if arrow_type.tz else 'TIMESTAMP'
+    return 'TEXT'
+
+
+def create_table_from_schema(conn, table_name, schema):
+    """
+    Creates a PostgreSQL table from the column types stored in a Parquet or Feather file.
+
+    Args:
+        conn: psycopg2 connection object.
+        table_name (str): The name of the table to create.
+        schema: pyarrow Schema of the cleaned file.
+    """
+    cursor = conn.cursor()
+    try:
+        columns = [f"{field.name} {postgres_type(field.type)}" for field in schema]
+        create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns)})"
+        print(f"Creating table: {create_table_query}")
+        cursor.execute(create_table_query)
+        conn.commit()
+        print(f"Table '{table_name}' successfully created.")
+    except psycopg2.Error as e:
+        print(f"Error creating table: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _binary_values(column, pg_type):
+    """The non-null values of an Arrow column as big-endian numbers, nulls as 0."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if pg_type == 'DATE':
+        days = pc.fill_null(column.cast(pa.date32()).cast(pa.int32()), 0).to_numpy()
+        return (days - PG_EPOCH_DAYS).astype(BINARY_TYPES[pg_type])
+    if pg_type in ('TIMESTAMP', 'TIMESTAMPTZ'):
+        microseconds = column.cast(pa.timestamp('us', column.type.tz)).cast(pa.int64())
+        return (pc.fill_null(microseconds, 0).to_numpy() - PG_EPOCH_MICROSECONDS).astype(BINARY_TYPES[pg_type])
+    values = pc.fill_null(column, False if pg_type == 'BOOLEAN' else 0)
+    return values.to_numpy(zero_copy_only=False).astype(BINARY_TYPES[pg_type])
+
+
+def binary_copy_data(batch, pg_types):
+    """
+    Encodes a pyarrow RecordBatch as the tuples of PostgreSQL's binary COPY format.
+
+    Nothing is formatted as text: every field's length prefix and big-endian value is
+    scattered into one numpy byte buffer a whole column at a time, and text columns are
+    copied straight out of their Arrow UTF-8 data buffer. Empty text is written as NULL, as
+    the CSV COPY reads it. The header and trailer are left to the caller
+    (BINARY_COPY_HEADER, BINARY_COPY_TRAILER).
+
+    Args:
+        batch: pyarrow RecordBatch of the rows to encode.
+        pg_types (list): Column type of each field, as postgres_type gives it; the table's
+            columns must have exactly these types.
+
+    Returns:
+        bytes: The encoded rows.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    rows = batch.num_rows
+    fields = []
+    for column, pg_type in zip(batch.columns, pg_types):
+        if pa.types.is_dictionary(column.type):
+            column = column.dictionary_decode()
+        nulls = column.is_null().to_numpy(zero_copy_only=False)
+        if pg_type in BINARY_TYPES:
+            values = _binary_values(column, pg_type)
+            sizes = np.full(rows, values.dtype.itemsize, dtype=np.int64)
+            fields.append((nulls, sizes, values.view(np.uint8).reshape(rows, values.dtype.itemsize), None))
+        else:
+            column = pc.fill_null(column.cast(pa.large_string()), '')
+            _, offsets, data = column.buffers()
+            offsets = np.frombuffer(offsets, dtype=np.int64)[column.offset:column.offset + rows + 1]
+            data = np.frombuffer(data, dtype=np.uint8) if data is not None else np.empty(0, dtype=np.uint8)
+            sizes = np.diff(offsets)
+            # Empty text loads as NULL, as it does through the CSV COPY
+            fields.append((nulls | (sizes == 0), sizes, data, offsets))
+
+    # Each row is a 2-byte field count, then a 4-byte length and the bytes of every field
+    row_sizes = 2 + sum(4 + np.where(nulls, 0, sizes) for nulls, sizes, _, _ in fields)
+    row_starts = np.zeros(rows, dtype=np.int64)
+    np.cumsum(row_sizes[:-1], out=row_starts[1:])
+    buffer = np.empty(int(row_sizes.sum()), dtype=np.uint8)
+
+    buffer[row_starts[:, None] + np.arange(2)] = np.array([len(fields)], dtype='>i2').view(np.uint8)
+    positions = row_starts + 2
+    for nulls, sizes, data, offsets in fields:
+        lengths = np.where(nulls, -1, sizes).astype('>i4')
+        buffer[positions[:, None] + np.arange(4)] = lengths.view(np.uint8).reshape(rows, 4)
+        starts = positions + 4
+        if offsets is None:
+            present = ~nulls
+            buffer[starts[present, None] + np.arange(data.shape[1])] = data[present]
+        elif offsets[-1] > offsets[0]:
+            # Nulls were filled with '' above, so the data of the batch's rows is one run
+            buffer[np.repeat(starts - offsets[:-1], sizes) + np.arange(offsets[0], offsets[-1])] = \
+                data[offsets[0]:offsets[-1]]
+        positions = starts + np.where(nulls, 0, sizes)
+    return buffer.tobytes()
+
+
+def copy_from_table(conn, table_name, table, batch_rows=COPY_BATCH_ROWS, binary=False):
+    """
+    Copies a pyarrow Table into a PostgreSQL table, one batch of rows per COPY.
+
+    The values come from the typed columns, so nothing is parsed or type-inferred on the
+    way; each batch is only written out in COPY's CSV format, or with binary=True encoded
+    by binary_copy_data, which skips text formatting and parsing altogether.
+
+    Args:
+        conn: psycopg2 connection object.
+        table_name (str): The name of the table to copy data into.
+        table: pyarrow Table, e.g. from read_cleaned_table.
+        batch_rows (int, optional): Rows per COPY batch.
+        binary (bool, optional): Use binary COPY. The table's columns must have the types
+            create_table_from_schema gives them.
+    """
+    columns = ', '.join(table.column_names)
+    pg_types = [postgres_type(field.type) for field in table.schema]
+    cursor = conn.cursor()
+    try:
+        for batch in table.to_batches(max_chunksize=batch_rows):
+            if binary:
+                buffer = BytesIO(BINARY_COPY_HEADER + binary_copy_data(batch, pg_types) + BINARY_COPY_TRAILER)
+                cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT binary)", buffer)
+                continue
+            buffer = StringIO()
+            batch.to_pandas(date_as_object=False).to_csv(buffer, header=False, index=False)
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        conn.commit()
+        print(f"{table.num_rows} rows successfully copied to table '{table_name}'.")
+    except psycopg2.Error as e:
+        print(f"Error copying data to table: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def copy_from_frame(conn, table_name, df, commit=True):
+    """
+    Appends the rows of a cleaned DataFrame to a PostgreSQL table with one COPY, e.g. the
+    rows rewards_follow.py cleaned from the newly appended part of the raw file.
+
+    Args:
+        commit (bool, optional): Commit the COPY; False leaves the transaction open, for
+            the caller to commit with other statements.
+    """
+    columns = ', '.join(df.columns)
+    buffer = StringIO()
+    df.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    cursor = conn.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        if commit:
+            conn.commit()
+        print(f"{len(df)} rows successfully copied to table '{table_name}'.")
+    except psycopg2.Error as e:
+        print(f"Error copying data to table: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def load_cleaned_file(conn, table_name, cleaned_file_path, binary=False):
+    """
+    Creates the table and copies a cleaned CSV, Parquet or Feather file into it.
+
+    Parquet and Feather files are memory-mapped and loaded with their stored types, with
+    binary COPY if binary is True.
+    """
+    if output_format(cleaned_file_path) == 'csv':
+        create_table_from_csv(conn, table_name, cleaned_file_path)
+        copy_from_csv(conn, table_name, cleaned_file_path)
+    else:
+        table = read_cleaned_table(cleaned_file_path, memory_map=True)
+        create_table_from_schema(conn, table_name, table.schema)
+        copy_from_table(conn, table_name, table, binary=binary)
+
+
+def row_hashes(df):
+    """
+    A stable 64-bit hash of every row's values, as signed integers for a BIGINT column.
+
+    Each value is hashed in its text form, so the same cleaned row hashes the same whether
+    it was read from CSV, Parquet or Feather, and on every run.
+    """
+    return pd.util.hash_pandas_object(df.astype(str), index=False).astype('int64')
+
+
+def upsert_cleaned_file(conn, table_name, cleaned_file_path, key_columns=('CustomerID',),
+                        hash_column='row_hash'):
+    """
+    Incremental load: merges only the new or changed rows of a cleaned file into the table.
+
+    Every row of the file is hashed with row_hashes and the hashes already stored in
+    hash_column are read back. Rows whose hash is not in the table are COPYed into a
+    temporary staging table and merged with one INSERT ... ON CONFLICT on key_columns, so a
+    daily load costs about the size of the change instead of the size of the file. The table
+    is created if it does not exist yet, from a CSV file with wide types (see wide_type), and
+    gets hash_column and a unique index on key_columns; rows loaded before it had hashes are
+    rewritten once. Rows that are no longer in the file are left in the table.
+
+    Args:
+        conn: psycopg2 connection object.
+        table_name (str): The table to load.
+        cleaned_file_path (str): Cleaned CSV, Parquet or Feather file.
+        key_columns (tuple, optional): Columns identifying a customer.
+        hash_column (str, optional): Column the row hashes are stored in.
+
+    Returns:
+        int: Number of rows inserted or updated.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", (table_name,))
+        exists = cursor.fetchone()[0] is not None
+    if output_format(cleaned_file_path) == 'csv':
+        if not exists:
+            # Types wide enough for the larger IDs and longer values of later files
+            create_table_from_csv(conn, table_name, cleaned_file_path, wide=True)
+        # Keep the exact text of every field, so COPY parses it as a full load would
+        df = pd.read_csv(cleaned_file_path, dtype=str, keep_default_na=False)
+    else:
+        table = read_cleaned_table(cleaned_file_path, memory_map=True)
+        if not exists:
+            create_table_from_schema(conn, table_name, table.schema)
+        df = table.to_pandas(date_as_object=False)
+
+    keys = ', '.join(key_columns)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {hash_column} BIGINT")
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_key_idx ON {table_name} ({keys})")
+
+        stored = StringIO()
+        cursor.copy_expert(f"COPY (SELECT {hash_column} FROM {table_name} WHERE {hash_column} IS NOT NULL) "
+                           f"TO STDOUT", stored)
+        stored.seek(0)
+        stored_hashes = pd.read_csv(stored, header=None, names=[hash_column], dtype='int64')[hash_column]
+
+        df[hash_column] = row_hashes(df)
+        changed = df[~df[hash_column].isin(stored_hashes)]
+        # A key may only be merged once per INSERT; the last row in the file wins
+        changed = changed.drop_duplicates(list(key_columns), keep='last')
+        if changed.empty:
+            conn.commit()
+            print(f"Table '{table_name}' is up to date; all {len(df)} rows unchanged.")
+            return 0
+
+        staging_table = f"{table_name}_changes"
+        columns = ', '.join(df.columns)
+        cursor.execute(f"CREATE TEMP TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP")
+        buffer = StringIO()
+        changed.to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {staging_table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+        updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in df.columns
+                            if column not in key_columns)
+        cursor.execute(f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {staging_table} "
+                       f"ON CONFLICT ({keys}) DO UPDATE SET {updates} "
+                       f"WHERE {table_name}.{hash_column} IS DISTINCT FROM EXCLUDED.{hash_column}")
+        merged = cursor.rowcount
+        conn.commit()
+        print(f"Merged {merged} new or changed rows into '{table_name}'; "
+              f"{len(df) - len(changed)} of {len(df)} rows unchanged.")
+        return merged
+
+    except psycopg2.Error as e:
+        print(f"Error merging data into table: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def main():
+    """
+    Main function to connect to the database, create a table, and copy data from a CSV file.
+    """
+    # 1.  Database connection details (replace with your actual details)
+    dbname = "rewards_data"  # Replace with your database name
+    user = "postgres"  # Default PostgreSQL user
+    password = "best1234"
+    host = "localhost"  # e.g., 'localhost' or an IP address
+    port = "5432"  # Default PostgreSQL port
+
+    # 2. Cleaned file path and table name
+    csv_file_path = "Cleaned_RewardsData.csv"  # Or the .parquet / .feather file rewards_cleaning.py wrote
+    table_name = "reward_data"  # Replace with your desired table name
+    parallel_workers = 0  # e.g. 4 to replace the table from a big CSV over 4 connections at once
+    incremental = False  # True to merge only new or changed rows, keyed by CustomerID
+    binary_copy = False  # True to COPY a Parquet or Feather file in binary format
+
+    conn_params = {'dbname': dbname, 'user': user, 'password': password, 'host': host, 'port': port}
+    conn = None
+    try:
+        if parallel_workers:
+            parallel_copy_csv(conn_params, table_name, csv_file_path, parallel_workers)
+            return
+
+        # 3. Establish database connection
+        conn = psycopg2.connect(**conn_params)
+        conn.autocommit = False # Start a transaction
+
+        # 4 + 5. Create the table (if it doesn't exist) and copy the data into it
+        if incremental:
+            upsert_cleaned_file(conn, table_name, csv_file_path)
+        else:
+            load_cleaned_file(conn, table_name, csv_file_path, binary_copy)
+
+        conn.commit() # Explicitly commit the transaction
+        print("Transaction completed successfully.")
+
+    except psycopg2.Error as e:
+        print(f"Database error: {e}")
+        # IMPORTANT:  No conn.rollback() here.  It's handled in the functions.
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        # No conn.rollback() here either.
+    finally:
+        if conn:
+            conn.close()
+            print("Connection closed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Polars backend for the cleaning steps: a CleaningPlan run as one lazy Polars query.
+
+    python rewards_cleaning.py RewardsData.csv Cleaned_RewardsData.parquet --backend polars
+
+The raw CSV file is scanned rather than loaded, every step adds to the query, and the
+result is streamed into the cleaned file by Polars' streaming engine, on all cores and
+without holding the whole file in memory. The plan and its compile order are the pandas
+ones, so steps h and j see the same rows on both backends.
+
+Steps that need the whole file first get it from a pre-pass over the query so far, as
+streaming mode does with scan_rewards_csv: the step d mean (or City/State medians), the
+distinct values of each 'map' step's column, which are fixed by the step's own pandas
+function and mapped back, the distinct birthdates of step i (normalize_dates), and the
+number of birthdates step j draws from the NumPy generator. Each pre-pass scans the
+file again, but only keeps its small result in memory.
+
+Columns are scanned as text, so one more pre-pass reads the columns the query leaves as
+text with pd.read_csv, a chunk at a time as scan_rewards_csv does, and those pandas reads
+as numbers are cast to the same type before the cleaned file is written.
+
+parity_backends.py checks that both backends clean a file to the same rows.
+"""
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from rewards_cleaning import (CHUNKSIZE, CITY_FIXES, DATE_COLUMNS, STATES_ORDERED, ZIP_GROUPS, _common_dtype,
+                              _fill_zip_median_step, default_plan, normalize_dates, output_format, random_dates)
+
+# What pd.read_csv reads as missing by default, so both backends see the same empty cells
+PANDAS_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+                    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+# Row number column, for step b; dropped before the cleaned file is written
+ROW_NUMBER = '_row'
+# Column of a distinct value's replacement while it is joined onto the rows
+MAPPED = '_mapped'
+# The Polars type of each kind of numeric dtype pd.read_csv gives a column
+NUMERIC_TYPES = {'i': pl.Int64, 'u': pl.UInt64, 'f': pl.Float64}
+
+
+def scan_rewards_csv_lazy(csv_file_path, plan=None):
+    """
+    The raw CSV file as a LazyFrame of text columns, without the columns plan drops unread.
+
+    Columns stay text until a step converts them, so no type is guessed from a sample.
+    """
+    if plan is None:
+        plan = default_plan()
+    dropped = plan.dropped_columns()
+    lf = pl.scan_csv(csv_file_path, infer_schema=False, null_values=PANDAS_NA_VALUES, row_index_name=ROW_NUMBER)
+    return lf.select([column for column in lf.collect_schema().names() if column not in dropped])
+
+
+def _collect(lf):
+    return lf.collect(engine='streaming')
+
+
+def normalize_zips_expr(zips):
+    """
+    normalize_zips as a Polars expression: the first 5 digits of every Zip, as floats.
+
+    Whole non-negative Zips keep their first 5 digits, as in normalize_zips; other numbers
+    and text are cut to their first 5 characters, then read as numbers where they can be.
+    """
+    numbers = zips.cast(pl.Float64, strict=False)
+    whole = (numbers >= 0) & (numbers < 1e15) & (numbers.floor() == numbers)
+    return (pl.when(whole).then(numbers.cast(pl.Int64).cast(pl.String).str.slice(0, 5))
+            .otherwise(zips.cast(pl.String).str.slice(0, 5))
+            .cast(pl.Float64, strict=False))
+
+
+def _map_values(lf, column, values, mapped):
+    """
+    Replaces each of values in column by the same item of mapped, and any other value by null.
+
+    A left join on a small frame of values, which the streaming engine runs a batch at a
+    time, where Expr.replace would hold the whole column in memory.
+    """
+    mapping = pl.LazyFrame({column: pl.Series(values, dtype=pl.String), MAPPED: pl.Series(mapped, dtype=pl.String)})
+    return (lf.join(mapping, on=column, how='left', maintain_order='left')
+            .with_columns(pl.col(MAPPED).alias(column)).drop(MAPPED))
+
+
+def _map_step(lf, step, context):
+    """A 'map' step: step.func on the distinct values of its column, mapped back to the rows."""
+    values = _collect(lf.select(pl.col(step.column).drop_nulls().unique()))[step.column].to_list()
+    if not values:
+        return lf
+    fixed = step.func(pd.Series(values, dtype=object), context)
+    return _map_values(lf, step.column, values, [None if pd.isna(value) else str(value) for value in fixed])
+
+
+def _fill_row_438_zip(lf, step, context):
+    zips = pl.col('Zip')
+    fill = pl.lit(11011).cast(lf.collect_schema()['Zip'])
+    return lf.with_columns(pl.when((pl.col(ROW_NUMBER) == 437) & zips.is_null()).then(fill)
+                           .otherwise(zips).alias('Zip'))
+
+
+def _normalize_zip(lf, step, context):
+    return lf.with_columns(normalize_zips_expr(pl.col('Zip')).alias('Zip'))
+
+
+def _zip_mean(lf, context):
+    if context.get('zip_mean') is not None:
+        return context['zip_mean']
+    mean = _collect(lf.select(pl.col('Zip').cast(pl.Float64, strict=False).mean())).item()
+    if mean is None:
+        raise ValueError("Zip column has no numeric values to take the mean of.")
+    return int(mean)
+
+
+def _fill_zip(lf, step, context):
+    zips = pl.col('Zip').cast(pl.Float64, strict=False)
+    if step.func is _fill_zip_median_step:
+        zips = zips.fill_null(zips.median().over(list(ZIP_GROUPS)).floor())
+    return lf.with_columns(zips.fill_null(_zip_mean(lf, context)).cast(pl.Int64).alias('Zip'))
+
+
+def _nth_empty(column):
+    """For each empty cell of column, how many empty cells came before it (0 for the first)."""
+    return (pl.col(column).is_null().cum_sum().cast(pl.Int64) - 1).clip(lower_bound=0)
+
+
+def _fill_empty_states(lf, step, context):
+    states = pl.Series(STATES_ORDERED, dtype=pl.String)
+    position = (_nth_empty('State') + context.get('state_start', 0)) % len(STATES_ORDERED)
+    return lf.with_columns(pl.when(pl.col('State').is_null()).then(pl.lit(states).gather(position))
+                           .otherwise(pl.col('State')).alias('State'))
+
+
+def _reformat_birthdates(lf, step, context):
+    if context.get('compact'):
+        raise ValueError("The Polars backend has no compact schema.")
+    counts = _collect(lf.group_by('Birthdate').len().drop_nulls('Birthdate'))
+    if not len(counts):
+        return lf
+    values = counts['Birthdate'].to_list()
+    reformatted, format_counts = normalize_dates(pd.Series(values, dtype=object), weights=counts['len'].to_numpy())
+    if context.get('format_counts') is not None:
+        for fmt, rows in format_counts.items():
+            context['format_counts'][fmt] = context['format_counts'].get(fmt, 0) + rows
+    return _map_values(lf, 'Birthdate', values, [None if pd.isna(value) else value for value in reformatted])
+
+
+def _fill_empty_birthdates(lf, step, context):
+    empty = _collect(lf.select(pl.col('Birthdate').null_count())).item()
+    if not empty:
+        return lf
+    rng = context.get('rng')
+    dates = pl.Series(list(random_dates(empty, rng if rng is not None else np.random.default_rng())),
+                      dtype=pl.String)
+    return lf.with_columns(pl.when(pl.col('Birthdate').is_null()).then(pl.lit(dates).gather(_nth_empty('Birthdate')))
+                           .otherwise(pl.col('Birthdate')).alias('Birthdate'))
+
+
+def _drop_small_zips(lf, step, context):
+    return lf.filter(pl.col('Zip').cast(pl.Float64, strict=False) >= 5)
+
+
+def _fill_empty_cities(lf, step, context):
+    return lf.with_columns(pl.col('City').fill_null('Thomasville'))
+
+
+# The Polars version of each 'frame' and 'filter' step of default_plan, by step name;
+# 'map' and 'drop' steps run from their pandas definitions
+POLARS_STEPS = {
+    'b': _fill_row_438_zip,
+    'c': _normalize_zip,
+    'd': _fill_zip,
+    'h': _fill_empty_states,
+    'i': _reformat_birthdates,
+    'j': _fill_empty_birthdates,
+    'k': _drop_small_zips,
+    'l': _fill_empty_cities,
+}
+
+
+def run_plan_lazy(lf, plan, context, optimize=True):
+    """Adds the enabled steps of plan to a LazyFrame, in plan.compile(optimize) order."""
+    for step in plan.compile(optimize):
+        if step.kind == 'drop':
+            lf = lf.drop(list(step.writes), strict=False)
+        elif step.kind == 'map':
+            lf = _map_step(lf, step, context)
+        elif step.name in POLARS_STEPS:
+            lf = POLARS_STEPS[step.name](lf, step, context)
+        else:
+            raise ValueError(f"Step {step.name} has no Polars version; run it on the pandas backend.")
+    return lf
+
+
+def _cast_like_pandas(lf, csv_file_path, steps, chunksize=CHUNKSIZE):
+    """
+    Casts the columns lf still holds as text to the numeric type pd.read_csv gives them in
+    the raw file, so they are written as the pandas backend writes them. Columns a 'map'
+    step writes stay as they are.
+    """
+    mapped = {column for step in steps if step.kind == 'map' for column in step.writes}
+    columns = [column for column, dtype in lf.collect_schema().items()
+               if dtype == pl.String and column not in mapped]
+    if not columns:
+        return lf
+    chunk_dtypes = {}
+    for chunk in pd.read_csv(csv_file_path, usecols=columns, chunksize=chunksize):
+        for column, dtype in chunk.dtypes.items():
+            chunk_dtypes.setdefault(column, []).append(dtype)
+    types = {column: NUMERIC_TYPES.get(_common_dtype(seen).kind) for column, seen in chunk_dtypes.items()}
+    return lf.with_columns(pl.col(column).cast(dtype) for column, dtype in types.items() if dtype is not None)
+
+
+def clean_rewards_polars(csv_file_path, output_path, format_counts=None, seed=None, city_fixes=CITY_FIXES,
+                         plan=None, optimize=True, zip_mean=None, rng=None):
+    """
+    clean_rewards_csv_chunked on the Polars backend: cleans a raw CSV file into output_path.
+
+    Args:
+        csv_file_path (str): Path to the raw CSV file.
+        output_path (str): Path of the cleaned file; .parquet and .feather write those formats.
+        Others: As for clean_rewards_csv_chunked.
+
+    Returns:
+        int: Number of rows written.
+    """
+    if plan is None:
+        plan = default_plan()
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    context = {'zip_mean': zip_mean, 'state_start': 0, 'format_counts': format_counts,
+               'rng': rng, 'city_fixes': city_fixes, 'compact': False}
+    lf = run_plan_lazy(scan_rewards_csv_lazy(csv_file_path, plan), plan, context, optimize).drop(ROW_NUMBER)
+    lf = _cast_like_pandas(lf, csv_file_path, plan.compile(optimize))
+
+    fmt = output_format(output_path)
+    if fmt != 'csv' and 'i' in plan.enabled:
+        # Stored as dates, as CleanedWriter stores them; step i left only ISO dates
+        lf = lf.with_columns(pl.col(column).str.to_date('%Y-%m-%d') for column in DATE_COLUMNS
+                             if column in lf.collect_schema().names())
+    if fmt == 'csv':
+        lf.sink_csv(output_path)
+        written = pl.scan_csv(output_path, infer_schema=False)
+    elif fmt == 'parquet':
+        lf.sink_parquet(output_path)
+        written = pl.scan_parquet(output_path)
+    else:
+        lf.sink_ipc(output_path)
+        written = pl.scan_ipc(output_path)
+    return _collect(written.select(pl.len())).item()
@@ -0,0 +1,175 @@
+"""
+Generates synthetic dirty RewardsData CSV files for benchmarks, with the defects steps a-l fix.
+
+    python rewards_synth.py 1000000 RewardsData_1000000.csv --seed 0
+
+The columns are those of the real export (CustomerID, FirstName, LastName, Email, City,
+State, Zip, Birthdate, Tags, Points), and the rows carry:
+
+- Winston-Salem spelled every way in CITY_FIXES, single-letter city abbreviations and
+  blank cities (steps e, f, l);
+- state codes mixed with full state names, and blank states (steps g, h);
+- blank Zips, 9-digit Zips, and Zips below 5 (steps b, c, d, k), with row 438 blank;
+- birthdates in every format of DATE_FORMATS, plus blank and unparseable ones (steps i, j).
+
+Rows are written a chunk at a time, so any number of rows fits in memory. Every value
+comes from a small pool picked by random index, so no string is formatted per row except
+the email.
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from rewards_cleaning import CITY_FIXES, DATE_FORMATS, STATE_ABBR
+
+# Rows generated and written at a time
+GENERATE_CHUNK_ROWS = 1_000_000
+
+FIRST_NAMES = ('James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda',
+               'William', 'Elizabeth', 'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica')
+LAST_NAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis',
+              'Rodriguez', 'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson')
+CLEAN_CITIES = ('Winston-Salem', 'Greensboro', 'High Point', 'Thomasville', 'Lexington', 'Kernersville',
+                'Charlotte', 'Raleigh', 'Durham', 'Asheville', 'Richmond', 'Columbia')
+TAGS = ('gold', 'silver', 'bronze', 'new', 'vip')
+
+# Share of rows carrying each defect
+DEFECT_RATES = {
+    'city_variant': 0.10,       # one of the CITY_FIXES variants of Winston-Salem
+    'city_abbreviation': 0.05,  # a single letter
+    'city_blank': 0.05,
+    'state_code': 0.45,         # 'NC' rather than 'North Carolina'
+    'state_blank': 0.10,
+    'zip_blank': 0.15,
+    'zip_long': 0.25,           # 9 digits, truncated by step c
+    'zip_small': 0.02,          # below 5, dropped by step k
+    'birthdate_blank': 0.10,
+    'birthdate_bad': 0.02,      # matches no format
+    'tags_blank': 0.30,
+    'points_blank': 0.01,
+}
+
+
+def _date_pool(start_year=1940, end_year=2005):
+    """Every day from start_year to end_year written in every DATE_FORMATS format, by format."""
+    days = pd.date_range(f"{start_year}-01-01", f"{end_year}-12-31", freq='D')
+    return [days.strftime(fmt).to_numpy(dtype=object) for fmt in DATE_FORMATS]
+
+
+def _pick(rng, pool, n):
+    pool = np.asarray(pool, dtype=object)
+    return pool[rng.integers(0, len(pool), n)]
+
+
+def _with_defects(rng, values, defects):
+    """values with each (rate, replacement) applied to a random share of the rows, in order."""
+    draw = rng.random(len(values))
+    low = 0.0
+    for rate, replacement in defects:
+        hit = (draw >= low) & (draw < low + rate)
+        values[hit] = replacement(int(hit.sum())) if callable(replacement) else replacement
+        low += rate
+    return values
+
+
+def generate_chunk(rng, start, rows, date_pool=None):
+    """
+    Rows start .. start + rows - 1 of a synthetic RewardsData file, as a DataFrame of text.
+
+    Args:
+        rng (Generator): Generator for every random choice.
+        start (int): CustomerID and row number of the first row.
+        rows (int): Number of rows.
+        date_pool (list, optional): _date_pool(), to build it only once per file.
+    """
+    if date_pool is None:
+        date_pool = _date_pool()
+    rates = DEFECT_RATES
+    ids = np.arange(start, start + rows)
+
+    cities = _with_defects(rng, _pick(rng, CLEAN_CITIES, rows), [
+        (rates['city_variant'], lambda n: _pick(rng, list(CITY_FIXES), n)),
+        (rates['city_abbreviation'], lambda n: _pick(rng, list('GTHWR'), n)),
+        (rates['city_blank'], ''),
+    ])
+    states = _with_defects(rng, _pick(rng, list(STATE_ABBR.values()), rows), [
+        (rates['state_code'], lambda n: _pick(rng, list(STATE_ABBR), n)),
+        (rates['state_blank'], ''),
+    ])
+
+    zips = rng.integers(10_000, 100_000, rows).astype(object)
+    zips = _with_defects(rng, zips, [
+        (rates['zip_blank'], ''),
+        (rates['zip_long'], lambda n: rng.integers(100_000_000, 1_000_000_000, n)),
+        (rates['zip_small'], lambda n: rng.integers(0, 5, n)),
+    ])
+    zips[ids == 437] = ''  # step b fills row 438
+
+    formats = rng.integers(0, len(date_pool), rows)
+    day = rng.integers(0, len(date_pool[0]), rows)
+    birthdates = np.empty(rows, dtype=object)
+    for i, pool in enumerate(date_pool):
+        birthdates[formats == i] = pool[day[formats == i]]
+    birthdates = _with_defects(rng, birthdates, [
+        (rates['birthdate_blank'], ''),
+        (rates['birthdate_bad'], lambda n: _pick(rng, ['31/31/1990', 'unknown', '1990-13-45', 'N/A'], n)),
+    ])
+
+    tags = _with_defects(rng, _pick(rng, TAGS, rows), [(rates['tags_blank'], '')])
+    points = _with_defects(rng, rng.integers(0, 5_000, rows).astype(object), [(rates['points_blank'], '')])
+
+    first_names = _pick(rng, FIRST_NAMES, rows)
+    last_names = _pick(rng, LAST_NAMES, rows)
+    return pd.DataFrame({
+        'CustomerID': ids,
+        'FirstName': first_names,
+        'LastName': last_names,
+        'Email': 'customer' + pd.Series(ids).astype(str) + '@example.com',
+        'City': cities,
+        'State': states,
+        'Zip': zips,
+        'Birthdate': birthdates,
+        'Tags': tags,
+        'Points': points,
+    })
+
+
+def generate_rewards_data(rows, path, seed=0, chunk_rows=GENERATE_CHUNK_ROWS):
+    """
+    Writes a synthetic RewardsData CSV file of rows rows, a chunk at a time.
+
+    The same rows, seed and chunk_rows always give the same file; the draws depend on the
+    chunking, so keep the default chunk_rows for files that compare between runs.
+
+    Args:
+        rows (int): Number of data rows.
+        path (str): CSV file to write.
+        seed (int, optional): Seed for every random choice.
+        chunk_rows (int, optional): Rows generated and written at a time.
+    """
+    rng = np.random.default_rng(seed)
+    date_pool = _date_pool()
+    for start in range(0, rows, chunk_rows):
+        chunk = generate_chunk(rng, start, min(chunk_rows, rows - start), date_pool)
+        chunk.to_csv(path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    if not rows:
+        generate_chunk(rng, 0, 0, date_pool).to_csv(path, index=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic dirty RewardsData CSV file.")
+    parser.add_argument('rows', type=int)
+    parser.add_argument('path', nargs='?', default=None, help="Defaults to RewardsData_<rows>.csv")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-rows', type=int, default=GENERATE_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    path = args.path or f"RewardsData_{args.rows}.csv"
+    generate_rewards_data(args.rows, path, args.seed, args.chunk_rows)
+    print(f"Wrote {args.rows} rows to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Validation rules with a quarantine file: rows that break a rule are set aside, with the
+names of the rules they broke, instead of being silently dropped or overwritten.
+
+    python rewards_cleaning.py RewardsData.csv --quarantine Quarantined_RewardsData.csv
+    python rewards_validation.py RewardsData.csv Quarantined_RewardsData.csv
+
+Without the rules engine, step k drops every row with a Zip under 5, step f blanks
+single-letter cities and step i turns unparseable birthdates into NaN, for steps d, l and
+j to fill. validation_step runs DEFAULT_RULES (or any others) on the raw rows, before
+step a; the rows that break one go to the quarantine file, and the rest are cleaned.
+
+Every rule compiles to one boolean mask over a whole column: a rule on one column checks
+the column's distinct values once, as the 'map' steps do, and its mask is then gathered
+back to the rows, so n rules cost n mask operations and no loop over rows.
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from rewards_cleaning import CHUNKSIZE, CleanedWriter, Step, normalize_dates, normalize_zips
+
+# Columns the quarantine file adds before and after the raw columns of a row
+ROW_COLUMN = 'row'
+RULES_COLUMN = 'rules'
+
+
+class Rule:
+    """
+    One validation rule, which a row breaks or keeps.
+
+    Args:
+        name (str): Rule name, as written in the quarantine file.
+        check: With column, check(values) takes a Series of the distinct values of column
+            that are not missing and returns the mask of those that break the rule.
+            Without, check(df) returns the mask of the rows of df that break it.
+        column (str, optional): The column a one-column rule checks.
+        missing (bool, optional): Whether a missing value in column breaks the rule.
+        reads (tuple, optional): Columns a rule without column reads.
+    """
+
+    def __init__(self, name, check, column=None, missing=False, reads=()):
+        self.name = name
+        self.check = check
+        self.column = column
+        self.missing = missing
+        self.reads = tuple(reads) or ((column,) if column else ())
+
+    def __repr__(self):
+        return f"Rule({self.name!r}, column={self.column!r})"
+
+
+def not_empty(column):
+    """A rule broken by a missing value in column."""
+    return Rule(f'{column.lower()}_empty', lambda values: np.zeros(len(values), dtype=bool), column, missing=True)
+
+
+def in_range(column, low=None, high=None):
+    """A rule broken by a value of column that is not a number from low to high."""
+    def check(values):
+        numbers = pd.to_numeric(values, errors='coerce')
+        return (numbers.isna() | (numbers < (-np.inf if low is None else low))
+                | (numbers > (np.inf if high is None else high)))
+    return Rule(f'{column.lower()}_out_of_range', check, column)
+
+
+def matches(column, pattern):
+    """A rule broken by a value of column that does not fully match the regex pattern."""
+    return Rule(f'{column.lower()}_malformed',
+                lambda values: ~values.astype(str).str.fullmatch(pattern).to_numpy(dtype=bool), column)
+
+
+# k. Rows whose Zip is under 5 once truncated to 5 digits, which step k would drop
+def _zip_below_5(zips):
+    return (normalize_zips(pd.to_numeric(zips, errors='coerce')) < 5).to_numpy()
+
+
+# c, d. Zips that are not numbers, which step c empties and step d overwrites with the mean
+def _zip_not_numeric(zips):
+    return pd.to_numeric(zips, errors='coerce').isna().to_numpy()
+
+
+# f. Single-letter cities, which step f blanks and step l overwrites with Thomasville
+def _city_abbreviation(cities):
+    return (cities.str.strip().str.len() == 1).to_numpy()
+
+
+# i. Birthdates no DATE_FORMATS format parses, which step i empties and step j overwrites
+def _birthdate_unparseable(dates):
+    return normalize_dates(dates)[0].isna().to_numpy()
+
+
+DEFAULT_RULES = (
+    Rule('zip_not_numeric', _zip_not_numeric, 'Zip'),
+    Rule('zip_below_5', _zip_below_5, 'Zip'),
+    Rule('city_abbreviation', _city_abbreviation, 'City'),
+    Rule('birthdate_unparseable', _birthdate_unparseable, 'Birthdate'),
+)
+
+
+def rule_masks(df, rules=DEFAULT_RULES):
+    """
+    Which rows break which rule, as a boolean array with a row per row of df and a column
+    per rule. Each column is factorized once for all the rules on it.
+    """
+    masks = np.zeros((len(df), len(rules)), dtype=bool)
+    distinct = {}
+    for i, rule in enumerate(rules):
+        if rule.column is None:
+            masks[:, i] = np.asarray(rule.check(df), dtype=bool)
+            continue
+        if rule.column not in distinct:
+            codes, uniques = pd.factorize(df[rule.column])  # missing values get code -1
+            distinct[rule.column] = codes, pd.Series(uniques, dtype=object)
+        codes, uniques = distinct[rule.column]
+        broken = np.append(np.asarray(rule.check(uniques), dtype=bool), rule.missing)
+        masks[:, i] = broken[codes]
+    return masks
+
+
+def broken_rules(masks, rules=DEFAULT_RULES):
+    """The names of the rules each row of masks broke, joined with ';' ('' for none)."""
+    if not len(masks):
+        return np.array([], dtype=object)
+    # Number each distinct combination of broken rules, 62 rules' bits at a time
+    combination = np.zeros(len(masks), dtype=np.int64)
+    for start in range(0, masks.shape[1], 62):
+        block = masks[:, start:start + 62]
+        bits, _ = pd.factorize(block @ (np.int64(1) << np.arange(block.shape[1], dtype=np.int64)))
+        combination, _ = pd.factorize(combination * (bits.max() + 1) + bits)
+    first = np.unique(combination, return_index=True)[1]
+    names = np.array([';'.join(rule.name for rule, hit in zip(rules, masks[row]) if hit) for row in first],
+                     dtype=object)
+    return names[combination]
+
+
+class Quarantine(CleanedWriter):
+    """
+    The quarantine file: rows that broke a rule, with their row number in the raw file and
+    the rules they broke. A CleanedWriter, so the extension picks CSV, Parquet or Feather.
+
+    Attributes:
+        rule_counts (dict): Rows that broke each rule; a row can count for several.
+    """
+
+    def __init__(self, output_path):
+        super().__init__(output_path, date_columns=())  # raw Birthdates stay as they were written
+        self.rule_counts = {}
+
+    def add(self, rows, masks, rules):
+        """Writes rows, which broke the rules masks says they broke."""
+        for rule, broken in zip(rules, masks.sum(axis=0)):
+            self.rule_counts[rule.name] = self.rule_counts.get(rule.name, 0) + int(broken)
+        quarantined = rows.copy()
+        quarantined.insert(0, ROW_COLUMN, rows.index)
+        quarantined[RULES_COLUMN] = broken_rules(masks, rules)
+        self.write(quarantined)
+
+
+def validate(df, rules=DEFAULT_RULES, quarantine=None):
+    """
+    The mask of the rows of df that break none of rules; the others go to quarantine.
+
+    Args:
+        df (DataFrame): Rows to validate.
+        rules (tuple, optional): Rules to check.
+        quarantine (Quarantine, optional): Gets the rows that break a rule.
+    """
+    masks = rule_masks(df, rules)
+    broken = masks.any(axis=1)
+    if quarantine is not None:
+        for rule in rules:
+            quarantine.rule_counts.setdefault(rule.name, 0)
+        if broken.any():
+            quarantine.add(df[broken], masks[broken], rules)
+    return ~broken
+
+
+def validation_step(rules=DEFAULT_RULES):
+    """
+    A 'filter' Step 'v' that keeps the rows breaking none of rules, and writes the others
+    to context['quarantine'] when there is one; for
+    CleaningPlan.add(validation_step(), before='a'), so rules see the raw values.
+    """
+    reads = tuple(dict.fromkeys(column for rule in rules for column in rule.reads))
+    return Step('v', lambda df, context: validate(df, rules, context.get('quarantine')), kind='filter',
+                reads=reads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quarantine the raw RewardsData rows that break a validation rule.")
+    parser.add_argument('csv_file_path', help="Raw RewardsData CSV file")
+    parser.add_argument('quarantine_path', nargs='?', default='Quarantined_RewardsData.csv',
+                        help="Quarantine file; a .parquet or .feather extension writes that format")
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    args = parser.parse_args()
+
+    rows = 0
+    with Quarantine(args.quarantine_path) as quarantine:
+        for chunk in pd.read_csv(args.csv_file_path, chunksize=args.chunksize):
+            validate(chunk, DEFAULT_RULES, quarantine)
+            rows += len(chunk)
+    print(f"Quarantined {quarantine.rows} of {rows} rows to {args.quarantine_path}")
+    for name, broken in quarantine.rule_counts.items():
+        print(f"Rule {name}: {broken} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Checkpoint cache for the cleaning steps, so a re-run resumes from the last unchanged step.
+
+After each step of a whole-file run (clean_rewards_cached) the frame cleaned so far is
+stored as a Feather file, under a key that hashes the bytes of the input file, the read
+options, and the code and settings of every step up to that one. A re-run looks for the
+last step whose key is stored, loads that frame instead of reading the raw CSV, and only
+runs the steps after it. Editing a step, or a function or constant it uses, changes its
+key and the keys of every step after it.
+
+The cache is bounded: once its files pass max_bytes, the least recently used are deleted.
+
+    python step_cache.py list
+    python step_cache.py clear
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+from disk_cache import DiskCache
+from rewards_cleaning import CITY_FIXES, default_plan, read_rewards_csv
+
+DEFAULT_CACHE_DIR = '.step_cache'
+DEFAULT_MAX_BYTES = 2 << 30  # 2 GB
+
+# Bump to invalidate every existing entry when the layout of an entry changes
+CACHE_VERSION = 1
+
+
+def file_digest(path, block_size=1 << 20):
+    """SHA-256 of a file's bytes, read a block at a time."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _hash_value(value, hasher, seen):
+    """Feeds a step function, or a setting or constant it uses, to hasher."""
+    if isinstance(value, types.FunctionType):
+        if value in seen:
+            return
+        seen.add(value)
+        _hash_code(value.__code__, hasher, value.__globals__, seen)
+        _hash_value(value.__defaults__, hasher, seen)
+        _hash_value(value.__kwdefaults__, hasher, seen)
+        for cell in value.__closure__ or ():
+            _hash_value(cell.cell_contents, hasher, seen)
+    elif isinstance(value, (types.ModuleType, type)):
+        hasher.update(getattr(value, '__name__', '').encode())
+    elif hasattr(value, 'func') and hasattr(value, 'kind'):  # a Step, e.g. in a fused map
+        hasher.update(f"{value.name}/{value.kind}/{value.column}".encode())
+        _hash_value(value.func, hasher, seen)
+    elif isinstance(value, (list, tuple)):
+        hasher.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _hash_value(item, hasher, seen)
+    elif isinstance(value, (set, frozenset)):
+        hasher.update(repr(sorted(map(repr, value))).encode())
+    elif isinstance(value, dict):
+        hasher.update(json.dumps(value, sort_keys=True, default=repr).encode())
+    elif isinstance(value, np.ndarray):
+        hasher.update(value.tobytes())
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        hasher.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.random.Generator):
+        hasher.update(json.dumps(value.bit_generator.state, sort_keys=True).encode())
+    else:
+        hasher.update(repr(value).encode())
+
+
+def _hash_code(code, hasher, module_globals, seen):
+    hasher.update(code.co_code)
+    hasher.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(const, hasher, module_globals, seen)
+        else:
+            hasher.update(repr(const).encode())
+    # Functions and constants of the module the code refers to by name
+    for name in code.co_names:
+        if name in module_globals:
+            _hash_value(module_globals[name], hasher, seen)
+
+
+def step_key(previous_key, step, context):
+    """The cache key of the frame after step: previous_key plus the step's code and settings."""
+    hasher = hashlib.sha256(previous_key.encode())
+    hasher.update(f"{step.name}/{step.kind}/{step.column}/{step.reads}/{step.writes}".encode())
+    _hash_value(step.func, hasher, set())
+    for key in step.uses:
+        hasher.update(key.encode())
+        _hash_value(context.get(key), hasher, set())
+    return hasher.hexdigest()
+
+
+class StepCache(DiskCache):
+    """
+    Cleaned frames by key, as Feather files with a JSON file of run state beside each.
+
+    Args:
+        cache_dir (str, optional): Directory of the cache; created when first written to.
+        max_bytes (int, optional): Size past which least recently used entries are deleted.
+    """
+
+    EXTENSIONS = ('feather', 'json')
+    USED = 'feather'
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key, 'json')) and os.path.exists(self._path(key, 'feather'))
+
+    def get(self, key):
+        """The stored (frame, info) for key, or None. Marks the entry as just used."""
+        if key not in self:
+            return None
+        import pyarrow.feather as feather
+
+        info = self._read_info(key)
+        df = feather.read_table(self._path(key, 'feather')).to_pandas()
+        self._touch(key)
+        return df, info
+
+    def put(self, key, df, info):
+        """
+        Stores a frame and its info under key, then evicts down to max_bytes.
+
+        Returns:
+            bool: False if the frame has columns Arrow cannot store (e.g. mixed types).
+        """
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return False
+        # The info last, so an entry is only listed once its frame is whole
+        self._replace(key, 'feather', lambda path: feather.write_feather(table, path))
+        self._write_info(key, info)
+        self.evict(keep=key)
+        return True
+
+
+def _run_state(context):
+    """The running state a resumed run needs back: the h cycle, the j generator, i's counts."""
+    rng = context.get('rng')
+    return {'state_start': context.get('state_start', 0),
+            'rng': rng.bit_generator.state if rng is not None else None,
+            'format_counts': dict(context.get('format_counts') or {})}
+
+
+def clean_rewards_cached(csv_file_path, cache=None, format_counts=None, rng=None, city_fixes=CITY_FIXES,
+                         compact=False, plan=None, optimize=True, zip_mean=None, state_start=0,
+                         profiler=None):
+    """
+    clean_rewards on a raw CSV file, resuming from the last step whose result is cached.
+
+    Runs without a seeded rng get a fresh generator, whose state is part of the key of step
+    j, so random birthdates are only reused when the run is seeded.
+
+    Args:
+        csv_file_path (str): Path to the raw CSV file.
+        cache (StepCache, optional): Defaults to StepCache() in DEFAULT_CACHE_DIR.
+        profiler (StepProfiler, optional): Records what each step that runs costs.
+        Others: As for clean_rewards.
+
+    Returns:
+        DataFrame: The cleaned rows, as clean_rewards returns them.
+    """
+    if cache is None:
+        cache = StepCache()
+    if plan is None:
+        plan = default_plan()
+    if rng is None:
+        rng = np.random.default_rng()
+    steps = plan.compile(optimize)
+    run_counts = {}
+    context = {'zip_mean': zip_mean, 'state_start': state_start, 'format_counts': run_counts,
+               'rng': rng, 'city_fixes': city_fixes, 'compact': compact}
+
+    root = hashlib.sha256(json.dumps([CACHE_VERSION, sys.version, pd.__version__, file_digest(csv_file_path),
+                                      compact, sorted(plan.dropped_columns())]).encode()).hexdigest()
+    keys = []
+    for step in steps:
+        keys.append(step_key(keys[-1] if keys else root, step, context))
+
+    done = 0
+    df = None
+    for position in range(len(steps), 0, -1):
+        cached = cache.get(keys[position - 1])
+        if cached is not None:
+            df, info = cached
+            state = info['state']
+            # Only state a cached step used has moved on from what this run started with
+            used = {key for step in steps[:position] for key in step.uses}
+            if 'state_start' in used:
+                context['state_start'] = state['state_start']
+            if 'rng' in used:
+                rng.bit_generator.state = state['rng']
+            run_counts.update(state['format_counts'])
+            done = position
+            print(f"Resuming after step {steps[position - 1].name} from the step cache.")
+            break
+    if df is None:
+        df = read_rewards_csv(csv_file_path, compact, usecols=plan.usecols())
+
+    for position in range(done, len(steps)):
+        step = steps[position]
+        df = step.run(df, context) if profiler is None else profiler.run_step(step, df, context)
+        cache.put(keys[position], df, {'input': os.path.abspath(csv_file_path),
+                                       'steps': [step.name for step in steps[:position + 1]],
+                                       'rows': len(df), 'state': _run_state(context)})
+
+    if format_counts is not None:
+        for fmt, rows in run_counts.items():
+            format_counts[fmt] = format_counts.get(fmt, 0) + rows
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the cleaning step cache.")
+    parser.add_argument('command', choices=['list', 'clear'])
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+
+    cache = StepCache(args.cache_dir)
+    if args.command == 'clear':
+        print(f"Removed {cache.clear()} entries from {args.cache_dir}.")
+        return
+    entries = cache.entries()
+    for entry in entries:
+        last_used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['last_used']))
+        print(f"{entry['key'][:12]}  after {'>'.join(entry['steps']):24} {entry['rows']:>10} rows "
+              f"{entry['bytes'] / 1e6:9.1f} MB  {last_used}  {entry['input']}")
+    print(f"{len(entries)} entries, {sum(entry['bytes'] for entry in entries) / 1e6:.1f} MB in {args.cache_dir}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Per-step metrics for CleaningPlan runs: what each step of a-l costs, and what it did.
+
+Pass a StepProfiler as profiler= to clean_rewards, clean_rewards_csv_chunked or
+CleaningPlan.run (or --profile on the command line of rewards_cleaning.py). Each step run
+records wall time, CPU time, the process's peak memory after it, rows in and out, and how
+many rows the step changed. Records can be written as JSON lines while the run goes,
+and summed up per step in a table at the end. One step can also run under cProfile, or
+under tracemalloc for its peak Python allocation.
+
+Without a profiler the plan only checks for one per step, so leaving it off costs nothing.
+"""
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_memory_bytes():
+    """The process's peak resident memory so far, or None where it cannot be read."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux and the BSDs kilobytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def changed_rows(before, after):
+    """Rows of after whose values differ from the same rows of before, in before's columns."""
+    changed = pd.Series(False, index=after.index)
+    for column in before.columns:
+        if column not in after.columns:
+            continue
+        old = before[column].reindex(after.index).astype(object)
+        new = after[column].astype(object)
+        changed |= ~((old == new) | (old.isna() & new.isna()))
+    return int(changed.sum())
+
+
+class StepProfiler:
+    """
+    Collects one record per step run (per chunk in streaming mode).
+
+    Args:
+        jsonl_path (str, optional): Append each record to this file as a JSON line.
+        cprofile_step (str, optional): Name of a step to run under cProfile; fused steps
+            such as 'e+f' match either name. See print_cprofile.
+        tracemalloc_step (str, optional): Name of a step whose peak Python allocation to
+            record, as tracemalloc_peak_bytes.
+
+    peak_rss_bytes is the process's high-water mark of resident memory once the step ran,
+    and peak_rss_growth_bytes how far the step raised it. The mark never comes down, so a
+    step that runs after a larger one grows it by 0 however much it allocates; for what a
+    step itself allocates, use tracemalloc_step.
+        count_changes (bool, optional): Count the rows each step changed. This copies the
+            columns a step writes before it runs and compares them after, outside the timed
+            part; turn it off when only the times matter.
+    """
+
+    def __init__(self, jsonl_path=None, cprofile_step=None, tracemalloc_step=None, count_changes=True):
+        self.jsonl_path = jsonl_path
+        self.count_changes = count_changes
+        self.cprofile_step = cprofile_step
+        self.tracemalloc_step = tracemalloc_step
+        self.records = []
+        self._profile = cProfile.Profile() if cprofile_step else None
+        self._calls = {}
+
+    @staticmethod
+    def _matches(step, name):
+        return name is not None and name in step.name.split('+')
+
+    def run_step(self, step, df, context):
+        """Runs step on df like Step.run, recording what it costs."""
+        rows_in = len(df)
+        before = None
+        if self.count_changes and step.kind in ('map', 'frame'):
+            before = df[[column for column in step.writes if column in df.columns]].copy()
+        tracing = self._matches(step, self.tracemalloc_step)
+        profile = self._profile if self._matches(step, self.cprofile_step) else None
+        peak_before = peak_memory_bytes()
+        if tracing:
+            tracemalloc.start()
+        try:
+            wall_started = time.perf_counter()
+            cpu_started = time.process_time()
+            if profile is not None:
+                profile.enable()
+            try:
+                df = step.run(df, context)
+            finally:
+                if profile is not None:
+                    profile.disable()
+            cpu_seconds = time.process_time() - cpu_started
+            wall_seconds = time.perf_counter() - wall_started
+            traced_peak = tracemalloc.get_traced_memory()[1] if tracing else None
+        finally:
+            if tracing:
+                tracemalloc.stop()
+        peak_after = peak_memory_bytes()
+
+        call = self._calls.get(step.name, 0)
+        self._calls[step.name] = call + 1
+        if not self.count_changes:
+            rows_changed = None
+        elif step.kind == 'drop':
+            rows_changed = len(df)
+        elif before is not None:
+            rows_changed = changed_rows(before, df)
+        else:
+            rows_changed = 0
+        record = {'step': step.name, 'kind': step.kind, 'call': call, 'wall_seconds': wall_seconds,
+                  'cpu_seconds': cpu_seconds,
+                  'peak_rss_bytes': peak_after,
+                  'peak_rss_growth_bytes': None if peak_before is None else peak_after - peak_before,
+                  'rows_in': rows_in, 'rows_out': len(df), 'rows_changed': rows_changed}
+        if tracing:
+            record['tracemalloc_peak_bytes'] = traced_peak
+        self.records.append(record)
+        if self.jsonl_path:
+            with open(self.jsonl_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        return df
+
+    def summary(self):
+        """The records added up per step, in the order the steps first ran."""
+        steps = {}
+        for record in self.records:
+            total = steps.setdefault(record['step'], {'step': record['step'], 'calls': 0, 'wall_seconds': 0.0,
+                                                      'cpu_seconds': 0.0, 'peak_rss_bytes': None,
+                                                      'peak_rss_growth_bytes': None, 'rows_in': 0, 'rows_out': 0, 'rows_changed': None})
+            total['calls'] += 1
+            for key in ('wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out'):
+                total[key] += record[key]
+            for key in ('peak_rss_growth_bytes', 'rows_changed'):
+                if record[key] is not None:
+                    total[key] = (total[key] or 0) + record[key]
+            if record['peak_rss_bytes'] is not None:
+                total['peak_rss_bytes'] = max(total['peak_rss_bytes'] or 0, record['peak_rss_bytes'])
+            if 'tracemalloc_peak_bytes' in record:
+                total['tracemalloc_peak_bytes'] = max(total.get('tracemalloc_peak_bytes', 0),
+                                                      record['tracemalloc_peak_bytes'])
+        return list(steps.values())
+
+    def print_summary(self):
+        """
+        Prints the summary as a table, with each step's share of the total wall time.
+
+        'peak MB' is the process's high-water mark after the step and '+MB' how far the step
+        raised it; see the class docstring.
+        """
+        summary = self.summary()
+        total_wall = sum(step['wall_seconds'] for step in summary) or 1e-9
+        print(f"{'step':6} {'calls':>5} {'wall s':>9} {'cpu s':>9} {'share':>6} {'peak MB':>9} {'+MB':>7} "
+              f"{'rows in':>11} {'rows out':>11} {'changed':>11}")
+        for step in summary:
+            peak = step['peak_rss_bytes']
+            peak = f"{peak / 1e6:9.1f}" if peak is not None else f"{'-':>9}"
+            growth = step['peak_rss_growth_bytes']
+            growth = f"{growth / 1e6:7.1f}" if growth is not None else f"{'-':>7}"
+            changed = '-' if step['rows_changed'] is None else step['rows_changed']
+            print(f"{step['step']:6} {step['calls']:5} {step['wall_seconds']:9.3f} {step['cpu_seconds']:9.3f} "
+                  f"{step['wall_seconds'] / total_wall:6.1%} {peak} {growth} {step['rows_in']:11} {step['rows_out']:11} "
+                  f"{changed:>11}")
+            if 'tracemalloc_peak_bytes' in step:
+                print(f"       tracemalloc peak {step['tracemalloc_peak_bytes'] / 1e6:.1f} MB")
+
+    def print_cprofile(self, limit=20, sort='cumulative'):
+        """Prints the cProfile statistics of cprofile_step, if it ran."""
+        if self._profile is None:
+            return
+        stream = io.StringIO()
+        try:
+            pstats.Stats(self._profile, stream=stream).sort_stats(sort).print_stats(limit)
+        except TypeError:  # the step never ran, so there are no stats
+            return
+        print(f"cProfile of step {self.cprofile_step}:")
+        print(stream.getvalue())
@@ -0,0 +1,226 @@
+"""
+ZIP reference index: the City and State of every ZIP code, in a compact file that is
+memory-mapped rather than loaded, for filling missing City/State values from the Zip and
+flagging rows whose City or State contradicts their Zip.
+
+    python zip_reference.py build uszips.csv zips.zipref --zip-column zip --city-column city --state-column state_id
+    python zip_reference.py check Cleaned_RewardsData.csv zips.zipref --output contradictions.csv
+    python rewards_cleaning.py RewardsData.csv --zip-reference zips.zipref
+
+The file holds the ZIP codes sorted as uint32, a uint32 city and a uint16 state code per
+ZIP, and the city and state names once each; a whole country is under a megabyte. Opening
+it maps the arrays in place, and a whole Zip column is looked up with one searchsorted.
+
+File layout, little-endian: MAGIC, then zips, cities, states and name bytes as four uint64
+counts, then the zip, city code and state code arrays, then the city names and the state
+names as UTF-8 lines.
+"""
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from rewards_cleaning import STATE_ABBR, Step, normalize_zips
+
+MAGIC = b'ZIPREF01'
+_HEADER = np.dtype([('zips', '<u8'), ('cities', '<u8'), ('states', '<u8'), ('name_bytes', '<u8')])
+
+
+def build_zip_reference(source, output_path, zip_column='Zip', city_column='City', state_column='State'):
+    """
+    Writes a ZIP reference file from a table of ZIP codes with their city and state.
+
+    Where the source has several cities or states for one ZIP (e.g. cleaned RewardsData
+    rows), the most common pair wins. State codes such as 'NC' are written as full names,
+    as step g writes them.
+
+    Args:
+        source (str or DataFrame): CSV file or DataFrame of ZIP codes.
+        output_path (str): Reference file to write.
+        zip_column, city_column, state_column (str, optional): Columns of the source.
+
+    Returns:
+        tuple: (ZIP codes written, source rows dropped because their ZIP did not parse).
+    """
+    if isinstance(source, str):
+        source = pd.read_csv(source, usecols=[zip_column, city_column, state_column], dtype=str)
+    # ZIP+4 codes such as '27513-1234' are cut to their first 5 digits, as step c cuts Zips
+    zips = normalize_zips(source[zip_column])
+    parsed = (zips >= 0) & (zips < 100_000)
+    unparseable = int((~parsed & source[zip_column].notna()).sum())
+    table = pd.DataFrame({'zip': zips, 'city': source[city_column].str.strip(),
+                          'state': source[state_column].str.strip().replace(STATE_ABBR)})
+    table = table[parsed].dropna()
+    counts = table.groupby(['zip', 'city', 'state'], sort=False).size().rename('rows').reset_index()
+    counts = counts.sort_values(['zip', 'rows'], ascending=[True, False], kind='stable').drop_duplicates('zip')
+
+    city_codes, cities = pd.factorize(counts['city'])
+    state_codes, states = pd.factorize(counts['state'])
+    names = '\n'.join(list(cities) + list(states)).encode('utf-8')
+    header = np.array([(len(counts), len(cities), len(states), len(names))], dtype=_HEADER)
+    with open(output_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(header.tobytes())
+        f.write(counts['zip'].to_numpy().astype('<u4').tobytes())
+        f.write(city_codes.astype('<u4').tobytes())
+        f.write(state_codes.astype('<u2').tobytes())
+        f.write(names)
+    return len(counts), unparseable
+
+
+class ZipReference:
+    """
+    A ZIP reference file, memory-mapped; see build_zip_reference.
+
+    Args:
+        path (str): Reference file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"'{path}' is not a ZIP reference file.")
+            header = np.frombuffer(f.read(_HEADER.itemsize), dtype=_HEADER)[0]
+        n = int(header['zips'])
+        offset = len(MAGIC) + _HEADER.itemsize
+        self.zips = np.memmap(path, dtype='<u4', mode='r', offset=offset, shape=(n,))
+        self.city_codes = np.memmap(path, dtype='<u4', mode='r', offset=offset + 4 * n, shape=(n,))
+        self.state_codes = np.memmap(path, dtype='<u2', mode='r', offset=offset + 8 * n, shape=(n,))
+        names = np.memmap(path, dtype='u1', mode='r', offset=offset + 10 * n, shape=(int(header['name_bytes']),))
+        names = names.tobytes().decode('utf-8').split('\n') if len(names) else []
+        self.cities = np.array(names[:int(header['cities'])], dtype=object)
+        self.states = np.array(names[int(header['cities']):], dtype=object)
+        self.digest = hashlib.sha256(np.memmap(path, dtype='u1', mode='r')).hexdigest()
+
+    def __len__(self):
+        return len(self.zips)
+
+    def __repr__(self):
+        # The content digest, so a step cache key changes with the file, not its address
+        return f"ZipReference({self.path!r}, {len(self)} zips, sha256={self.digest[:16]})"
+
+    def positions(self, zips):
+        """Position of each Zip in the reference, or -1 where it is missing or not listed."""
+        values = pd.to_numeric(pd.Series(zips), errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        valid = (values >= 0) & (values < 2 ** 32) & (np.floor(values) == values)
+        # Searched once per distinct Zip, which is far fewer than the rows
+        codes, keys = pd.factorize(np.where(valid, values, 0).astype('u4'))
+        found = np.searchsorted(self.zips, keys).clip(max=max(len(self) - 1, 0))
+        listed = np.zeros(len(keys), dtype=bool) if not len(self) else self.zips[found] == keys
+        return np.where(valid, np.where(listed, found, -1)[codes], -1)
+
+    def lookup(self, zips):
+        """
+        The reference City and State of each Zip.
+
+        Returns:
+            tuple: (cities, states) as object arrays, with None for Zips not listed.
+        """
+        positions = self.positions(zips)
+        hit = positions >= 0
+        cities = np.full(len(positions), None, dtype=object)
+        states = np.full(len(positions), None, dtype=object)
+        cities[hit] = self.cities[self.city_codes[positions[hit]]]
+        states[hit] = self.states[self.state_codes[positions[hit]]]
+        return cities, states
+
+    def fill(self, df):
+        """Fills each missing City and State of df from its Zip, where the Zip is listed."""
+        empty = (df['City'].isna() | df['State'].isna()).to_numpy()
+        if not empty.any():
+            return df
+        rows = np.flatnonzero(empty)
+        cities, states = self.lookup(df['Zip'].iloc[rows])
+        for column, reference in (('City', cities), ('State', states)):
+            missing = df[column].iloc[rows].isna().to_numpy() & (reference != None)  # noqa: E711
+            if missing.any():
+                values = df[column]
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    values = values.cat.add_categories(
+                        pd.Index(reference[missing]).unique().difference(values.cat.categories))
+                values = values.copy()
+                values.iloc[rows[missing]] = reference[missing]
+                df[column] = values
+        return df
+
+    def contradictions(self, df):
+        """
+        Rows whose City or State contradicts their Zip, as a DataFrame of the row labels,
+        the Zip, the City and State of the row and those of the reference.
+
+        Cities compare case-insensitively and without spaces or punctuation; rows with an
+        empty City or State, or a Zip not listed, are not flagged on it.
+        """
+        positions = self.positions(df['Zip'])
+        listed = positions >= 0
+
+        def differ(values, names, name_codes):
+            # Names are normalized once per distinct value, then compared as integer codes
+            row_codes, distinct = pd.factorize(values)
+            vocabulary = pd.Index(_normalize_names(names)).unique()
+            expected = vocabulary.get_indexer(_normalize_names(names))[name_codes[positions[listed]]]
+            actual = vocabulary.get_indexer(_normalize_names(distinct))
+            actual = np.append(actual, -2)[row_codes[listed]]  # empty cells (code -1) are never flagged
+            flagged = np.zeros(len(positions), dtype=bool)
+            flagged[listed] = (actual != -2) & (actual != expected)
+            return flagged
+
+        flagged = (differ(df['City'], self.cities, self.city_codes)
+                   | differ(df['State'], self.states, self.state_codes))
+        cities, states = self.lookup(df['Zip'].to_numpy()[flagged])
+        return pd.DataFrame({'Zip': df['Zip'].to_numpy()[flagged], 'City': df['City'].to_numpy()[flagged],
+                             'State': df['State'].to_numpy()[flagged], 'zip_city': cities,
+                             'zip_state': states}, index=df.index[flagged])
+
+
+def _normalize_names(names):
+    """Names in lower case without spaces or punctuation, for comparing cities and states."""
+    return pd.Series(names, dtype=object).astype(str).str.lower().str.replace(r'[^a-z0-9]', '', regex=True).to_numpy()
+
+
+def zip_reference_step(reference):
+    """
+    A Step 'r' that fills missing City and State values from the Zip, for
+    CleaningPlan.add(zip_reference_step(reference), before=...) just after step c, while
+    the Zips are still only real ones rather than the step d fill.
+    """
+    return Step('r', lambda df, context: reference.fill(df), reads=('Zip', 'City', 'State'),
+                writes=('City', 'State'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or check against a ZIP to City/State reference file.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="Write a reference file from a CSV of ZIP codes")
+    build.add_argument('source', help="CSV with a ZIP, a city and a state column, e.g. cleaned RewardsData")
+    build.add_argument('reference')
+    build.add_argument('--zip-column', default='Zip')
+    build.add_argument('--city-column', default='City')
+    build.add_argument('--state-column', default='State')
+    check = commands.add_parser('check', help="List the rows of a cleaned file that contradict their Zip")
+    check.add_argument('csv_file_path')
+    check.add_argument('reference')
+    check.add_argument('--output', default=None, help="Write the contradicting rows to this CSV file")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        zips, unparseable = build_zip_reference(args.source, args.reference, args.zip_column, args.city_column,
+                                                args.state_column)
+        print(f"Wrote {zips} ZIP codes to {args.reference} ({os.path.getsize(args.reference) / 1e3:.0f} kB)")
+        if unparseable:
+            print(f"Dropped {unparseable} rows whose {args.zip_column} is not a ZIP code.")
+        return
+    reference = ZipReference(args.reference)
+    flagged = reference.contradictions(pd.read_csv(args.csv_file_path, usecols=['Zip', 'City', 'State']))
+    print(f"{len(flagged)} rows contradict their Zip.")
+    if len(flagged):
+        print(flagged.head(10).to_string())
+        if args.output:
+            flagged.to_csv(args.output, index_label='row')
+
+
+if __name__ == "__main__":
+    main()